@@ -0,0 +1,158 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Benchmark of the activation memory of a GemNetT training step with gradient checkpointing.
+
+Usage:
+    python benchmark/performance/gradient_checkpointing.py --batch_size=32 --save_as=ckpt.json
+
+Runs one forward and backward pass of a GemNetT with the sizes of the default MatterGen model on
+a batch of random crystals, once for each checkpointing setting, and reports the time, the peak
+memory and whether the gradients agree with the ones computed without checkpointing. On CUDA,
+peak memory is torch.cuda.max_memory_allocated; on CPU, it is the size of the tensors saved for
+the backward pass, which is the part of the memory that checkpointing reduces. The CPU number does
+not include the block inputs kept by the checkpoints, so it is a lower bound.
+"""
+
+import json
+import time
+from pathlib import Path
+
+import fire
+import torch
+
+from mattergen.common.gemnet.gemnet import GemNetT
+from mattergen.common.gemnet.layers.embedding_block import AtomEmbedding
+
+SETTINGS = {
+    "none": dict(checkpoint_interaction_blocks=False, checkpoint_output_blocks=False),
+    "interaction_blocks": dict(checkpoint_interaction_blocks=True, checkpoint_output_blocks=False),
+    "all_blocks": dict(checkpoint_interaction_blocks=True, checkpoint_output_blocks=True),
+}
+
+
+def get_random_batch(
+    batch_size: int, num_atoms: int, hidden_dim: int, device: str
+) -> dict[str, torch.Tensor]:
+    num_atoms_per_crystal = torch.full((batch_size,), num_atoms, device=device)
+    return dict(
+        z=torch.randn(batch_size, hidden_dim, device=device),
+        frac_coords=torch.rand(batch_size * num_atoms, 3, device=device),
+        atom_types=torch.randint(1, 84, (batch_size * num_atoms,), device=device),
+        num_atoms=num_atoms_per_crystal,
+        batch=torch.repeat_interleave(
+            torch.arange(batch_size, device=device), num_atoms_per_crystal
+        ),
+        lattice=(6.0 * torch.eye(3, device=device) + torch.rand(batch_size, 3, 3, device=device)),
+    )
+
+
+class SavedTensorsCounter:
+    """Counts the bytes of the distinct tensors saved for the backward pass."""
+
+    def __init__(self):
+        self.data_ptrs: set[int] = set()
+        self.num_bytes = 0
+
+    def pack(self, tensor: torch.Tensor) -> torch.Tensor:
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in self.data_ptrs:
+            self.data_ptrs.add(storage.data_ptr())
+            self.num_bytes += storage.nbytes()
+        return tensor
+
+    @staticmethod
+    def unpack(tensor: torch.Tensor) -> torch.Tensor:
+        return tensor
+
+
+def run_training_step(
+    model: GemNetT, inputs: dict[str, torch.Tensor]
+) -> tuple[dict[str, torch.Tensor], float, int]:
+    """Returns the gradients, the time and the peak memory of one forward and backward pass."""
+    model.zero_grad()
+    counter = SavedTensorsCounter()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = time.perf_counter()
+    with torch.autograd.graph.saved_tensors_hooks(counter.pack, counter.unpack):
+        output = model(**inputs)
+        loss = output.forces.square().sum() + output.stress.square().sum()
+    loss.backward()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+        peak_memory = torch.cuda.max_memory_allocated()
+    else:
+        peak_memory = counter.num_bytes
+    seconds = time.perf_counter() - start
+    gradients = {
+        name: param.grad.clone()
+        for name, param in model.named_parameters()
+        if param.grad is not None
+    }
+    return gradients, seconds, peak_memory
+
+
+def main(
+    batch_size: int = 16,
+    num_atoms: int = 20,
+    hidden_dim: int = 512,
+    num_blocks: int = 4,
+    seed: int = 0,
+    save_as: str | None = None,
+):
+    """
+    Args:
+        batch_size: number of crystals in the batch.
+        num_atoms: number of atoms per crystal.
+        hidden_dim: embedding size of atoms and edges, 512 in the default MatterGen model.
+        num_blocks: number of interaction blocks, 4 in the default MatterGen model.
+        seed: random seed of the model weights and the batch.
+        save_as: path to a JSON file to write the results to.
+    """
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    torch.manual_seed(seed)
+    model = GemNetT(
+        num_targets=1,
+        latent_dim=hidden_dim,
+        atom_embedding=AtomEmbedding(emb_size=hidden_dim, with_mask_type=True),
+        num_blocks=num_blocks,
+        emb_size_atom=hidden_dim,
+        emb_size_edge=hidden_dim,
+        regress_stress=True,
+        otf_graph=True,
+        max_neighbors=50,
+        cutoff=7.0,
+    ).to(device)
+    inputs = get_random_batch(batch_size, num_atoms, hidden_dim, device)
+
+    results: dict[str, float | int | str | bool] = {
+        "device": device,
+        "batch_size": batch_size,
+        "num_atoms": num_atoms,
+        "peak_memory": "max_memory_allocated" if device == "cuda" else "saved_tensors_bytes",
+    }
+    expected = None
+    for name, setting in SETTINGS.items():
+        model.checkpoint_interaction_blocks = setting["checkpoint_interaction_blocks"]
+        model.checkpoint_output_blocks = setting["checkpoint_output_blocks"]
+        gradients, seconds, peak_memory = run_training_step(model, inputs)
+        results[f"{name}_seconds"] = seconds
+        results[f"{name}_peak_memory_mb"] = peak_memory / 2**20
+        if expected is None:
+            expected = gradients
+        else:
+            results[f"{name}_gradients_agree"] = gradients.keys() == expected.keys() and all(
+                torch.allclose(gradients[k], expected[k], rtol=1e-4, atol=1e-6) for k in expected
+            )
+
+    print(json.dumps(results, indent=4))
+    if save_as is not None:
+        Path(save_as).parent.mkdir(parents=True, exist_ok=True)
+        with open(save_as, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
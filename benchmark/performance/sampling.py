@@ -0,0 +1,298 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Benchmark of the predictor-corrector sampler with a breakdown of the time per denoising step.
+
+Usage:
+    python benchmark/performance/sampling.py --batch_sizes=[4,16] --num_atoms=[8,20] \
+        --num_steps=[10,50] --save_as=sampling.json
+
+Samples with the default sampling config, i.e., classifier-free guidance, ancestral predictors and
+Langevin correctors, from a small randomly initialized GemNetTDenoiser, for every combination of
+batch size, number of atoms per crystal and number of denoising steps N. The lattice score of the
+random model is replaced by the exact score of crystals with the mean lattice of the prior, so that
+the crystals keep a realistic density. The time of each run is
+split into stages, which add up to the total time:
+    prior: sampling the prior.
+    radius_graph_pbc, get_triplets: graph construction in GemNetT.
+    graph_construction: rest of the interaction graph, i.e., edge reordering and geometry.
+    gemnet_forward: GemNetT forward pass without the graph construction.
+    denoiser: rest of the GemNetTDenoiser forward pass, e.g., property embeddings and heads.
+    cfg_collation: collating the conditional and unconditional batches of classifier-free guidance.
+    score_function: rest of the score function of the sampler, e.g., combining the guided scores.
+    corrector, predictor: updates of the corrector and predictor steps, without the score.
+    recording: recording the trajectories.
+    postprocessing: converting the samples and trajectories to structures and writing them.
+    other: everything else, e.g., the sampling loop.
+Every stage is also reported per denoising step. The score function is evaluated once before
+each run is timed, so that one-off initializations are not included. The results contain the git
+commit and the environment, so that result files of different commits can be diffed.
+"""
+
+import itertools
+import json
+import os
+import platform
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Sequence
+
+import fire
+import numpy as np
+import torch
+from hydra import compose, initialize_config_dir
+from hydra.utils import instantiate
+
+import mattergen.diffusion.sampling.classifier_free_guidance as classifier_free_guidance
+import mattergen.diffusion.sampling.pc_sampler as pc_sampler
+from mattergen.common.data.chemgraph import ChemGraph
+from mattergen.common.data.collate import collate
+from mattergen.common.data.dataset import NumAtomsCrystalDataset
+from mattergen.common.gemnet import gemnet
+from mattergen.common.utils.columnar_structures import ColumnarStructureWriter
+from mattergen.common.utils.globals import DEFAULT_SAMPLING_CONFIG_PATH, MODELS_PROJECT_ROOT
+from mattergen.common.utils.profiling import StageTimer
+from mattergen.denoiser import GemNetTDenoiser
+from mattergen.diffusion.lightning_module import DiffusionLightningModule
+from mattergen.diffusion.sampling.pc_sampler import PredictorCorrector
+from mattergen.diffusion.sampling.trajectory_recorder import TrajectoryRecorder
+from mattergen.generator import append_recorded_trajectories, structures_from_samples
+
+RECORDED_FIELDS = ["pos", "cell", "atomic_numbers"]
+
+
+def get_model(hidden_dim: int, num_blocks: int, N: int, device: str) -> DiffusionLightningModule:
+    """Returns a randomly initialized model whose atom type diffusion has N steps, as required by
+    a sampler with N steps."""
+    with initialize_config_dir(os.path.join(MODELS_PROJECT_ROOT, "conf")):
+        config = compose(
+            config_name="default",
+            overrides=[
+                f"lightning_module.diffusion_module.model.hidden_dim={hidden_dim}",
+                f"lightning_module.diffusion_module.model.gemnet.num_blocks={num_blocks}",
+                "lightning_module.diffusion_module.corruption.discrete_corruptions"
+                f".atomic_numbers.d3pm.schedule.num_steps={N}",
+            ],
+        )
+    model = instantiate(config.lightning_module).to(device)
+    diffusion_module = model.diffusion_module
+    score_fn, lattice_sde = diffusion_module.score_fn, diffusion_module.corruption.sdes["cell"]
+
+    def score_fn_with_mean_lattice(x: ChemGraph, t: torch.Tensor) -> ChemGraph:
+        # With random weights, the lattice scores drive the crystals to huge cells without edges.
+        # The exact score of crystals with the mean lattice of the prior keeps a realistic density.
+        mean_lattice = lattice_sde.get_limit_mean(x=x.cell, batch=x)
+        mean, std = lattice_sde.marginal_prob(mean_lattice, t, batch=x)
+        return score_fn(x, t).replace(cell=-(x.cell - mean) / std**2)
+
+    diffusion_module.score_fn = score_fn_with_mean_lattice
+    return model
+
+
+def get_sampler(
+    model: DiffusionLightningModule, N: int, guidance_scale: float, correctors: bool
+) -> PredictorCorrector:
+    overrides = [f"sampler_partial.N={N}", f"sampler_partial.guidance_scale={guidance_scale}"]
+    if not correctors:
+        overrides.append("~sampler_partial.corrector_partials")
+    with initialize_config_dir(str(DEFAULT_SAMPLING_CONFIG_PATH)):
+        config = compose(config_name="default", overrides=overrides)
+    return instantiate(config.sampler_partial)(pl_module=model)
+
+
+def get_stage_timer(sampler: PredictorCorrector, model: DiffusionLightningModule) -> StageTimer:
+    timer = StageTimer(synchronize_cuda=True)
+    timer.instrument(pc_sampler, "_sample_prior", stage="prior")
+    timer.instrument(gemnet, "radius_graph_pbc", stage="radius_graph_pbc")
+    timer.instrument(gemnet.GemNetT, "get_triplets", stage="get_triplets")
+    timer.instrument(gemnet.GemNetT, "generate_interaction_graph", stage="graph_construction")
+    timer.instrument(type(model.diffusion_module.model.gemnet), "forward", stage="gemnet_forward")
+    timer.instrument(GemNetTDenoiser, "forward", stage="denoiser")
+    timer.instrument(classifier_free_guidance, "collate", stage="cfg_collation")
+    timer.instrument(type(sampler), "_score_fn", stage="score_function")
+    timer.instrument(PredictorCorrector, "_corrector_step", stage="corrector")
+    timer.instrument(PredictorCorrector, "_predictor_step", stage="predictor")
+    for method in ["start", "record", "finish"]:
+        timer.instrument(TrajectoryRecorder, method, stage="recording")
+    return timer
+
+
+def get_conditioning_data(batch_size: int, num_atoms: int) -> ChemGraph:
+    dataset = NumAtomsCrystalDataset(num_atoms=np.full(batch_size, num_atoms))
+    return collate([dataset[i] for i in range(batch_size)])
+
+
+@torch.no_grad()
+def warm_up(sampler: PredictorCorrector, conditioning_data: ChemGraph, device: str) -> None:
+    """Evaluates the score function once on a prior sample."""
+    batch = pc_sampler._sample_prior(
+        sampler.diffusion_module.corruption, conditioning_data.to(device), mask=None
+    )
+    sampler._score_fn(batch, torch.ones(batch.get_batch_size(), device=device))
+
+
+def run_sampler(
+    sampler: PredictorCorrector,
+    conditioning_data: ChemGraph,
+    record_trajectories: bool,
+    timer: StageTimer,
+) -> None:
+    """Samples a batch of crystals and converts them to structures like `CrystalGenerator`."""
+    if record_trajectories:
+        _, mean, recorded_trajectories = sampler.sample_with_record(
+            conditioning_data, recorder=TrajectoryRecorder(fields=RECORDED_FIELDS)
+        )
+    else:
+        _, mean = sampler.sample(conditioning_data)
+    with timer.stage("postprocessing"):
+        structures_from_samples(mean)
+        if record_trajectories:
+            with (
+                TemporaryDirectory() as tmpdir,
+                ColumnarStructureWriter(Path(tmpdir) / "trajectories.npz") as writer,
+            ):
+                append_recorded_trajectories(writer, recorded_trajectories)
+
+
+def benchmark_configuration(
+    model: DiffusionLightningModule,
+    batch_size: int,
+    num_atoms: int,
+    N: int,
+    guidance_scale: float,
+    correctors: bool,
+    record_trajectories: bool,
+    device: str,
+) -> dict[str, Any]:
+    """Returns the total time and the time of each stage of sampling one batch."""
+    sampler = get_sampler(model, N=N, guidance_scale=guidance_scale, correctors=correctors)
+    conditioning_data = get_conditioning_data(batch_size, num_atoms)
+    warm_up(sampler, conditioning_data, device)
+    timer = get_stage_timer(sampler, model)
+    with timer:
+        run_sampler(sampler, conditioning_data, record_trajectories, timer=timer)
+    timings = timer.as_dict()
+    for stage in timings["stages"].values():
+        stage["seconds_per_step"] = stage["seconds"] / N
+    return {
+        "batch_size": batch_size,
+        "num_atoms": num_atoms,
+        "N": N,
+        "seconds": timings["seconds"],
+        "seconds_per_step": timings["seconds"] / N,
+        "crystals_per_second": batch_size / timings["seconds"],
+        "stages": timings["stages"],
+    }
+
+
+def get_environment(device: str) -> dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "device": device,
+        "num_threads": torch.get_num_threads(),
+    }
+
+
+def _as_list(values: int | Sequence[int]) -> list[int]:
+    return [values] if isinstance(values, int) else list(values)
+
+
+def main(
+    batch_sizes: int | Sequence[int] = (4, 16),
+    num_atoms: int | Sequence[int] = (8, 20),
+    num_steps: int | Sequence[int] = (10, 50),
+    hidden_dim: int = 128,
+    num_blocks: int = 2,
+    guidance_scale: float = 2.0,
+    correctors: bool = True,
+    record_trajectories: bool = True,
+    num_threads: int | None = None,
+    device: str = "cpu",
+    seed: int = 0,
+    save_as: str | None = None,
+):
+    """
+    Args:
+        batch_sizes: numbers of crystals per batch.
+        num_atoms: numbers of atoms per crystal.
+        num_steps: numbers of denoising steps N.
+        hidden_dim: embedding size of the model, 512 in the default MatterGen model.
+        num_blocks: number of interaction blocks, 4 in the default MatterGen model.
+        guidance_scale: classifier-free guidance scale. With 0 or 1, the score model is evaluated
+            on the unconditional or conditional batch only, without collating them.
+        correctors: whether to run the Langevin correctors of the default sampling config.
+        record_trajectories: whether to record every step of the trajectories, like
+            `mattergen-generate` does by default.
+        num_threads: number of CPU threads used by torch. Defaults to the torch default.
+        device: device to sample on.
+        seed: random seed of the model weights and the samples.
+        save_as: path to a JSON file to write the results to.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    models = {}
+    for N in _as_list(num_steps):
+        # the same weights for every N
+        torch.manual_seed(seed)
+        models[N] = get_model(hidden_dim=hidden_dim, num_blocks=num_blocks, N=N, device=device)
+    results: dict[str, Any] = {
+        "environment": get_environment(device),
+        "settings": {
+            "hidden_dim": hidden_dim,
+            "num_blocks": num_blocks,
+            "num_parameters": sum(p.numel() for p in models[N].parameters()),
+            "guidance_scale": guidance_scale,
+            "correctors": correctors,
+            "record_trajectories": record_trajectories,
+            "seed": seed,
+        },
+        "results": [],
+    }
+    for batch_size, n_atoms, N in itertools.product(
+        _as_list(batch_sizes), _as_list(num_atoms), _as_list(num_steps)
+    ):
+        torch.manual_seed(seed)
+        result = benchmark_configuration(
+            models[N],
+            batch_size=batch_size,
+            num_atoms=n_atoms,
+            N=N,
+            guidance_scale=guidance_scale,
+            correctors=correctors,
+            record_trajectories=record_trajectories,
+            device=device,
+        )
+        print(
+            f"batch_size={batch_size} num_atoms={n_atoms} N={N}: "
+            f"{result['seconds_per_step'] * 1000:.1f} ms/step, "
+            + ", ".join(
+                f"{name} {stage['fraction']:.0%}"
+                for name, stage in sorted(
+                    result["stages"].items(), key=lambda x: x[1]["seconds"], reverse=True
+                )
+            )
+        )
+        results["results"].append(result)
+
+    if save_as is not None:
+        Path(save_as).parent.mkdir(parents=True, exist_ok=True)
+        with open(save_as, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
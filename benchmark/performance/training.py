@@ -0,0 +1,405 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Benchmark of the training step and the data loader with a breakdown of the time per step.
+
+Usage:
+    python benchmark/performance/training.py --batch_sizes=[16,64] --num_workers=[0,2] \
+        --num_atoms_distribution=ALEX_MP_20 --save_as=training.json
+
+Trains a small randomly initialized model with the default training config for a few steps on a
+synthetic CrystalDataset with the transforms of the default data module, for every combination
+of batch size and number of data loader workers. The crystals have random positions and atomic
+numbers, a number of atoms drawn from `num_atoms_distribution` and a cell with the average
+density of MP-20. Each step runs `DiffusionLightningModule.training_step`, the backward pass and
+the optimizer step, like the Lightning trainer does. The time of each run is split into stages,
+which add up to the total time:
+    loader_startup: creating the data loader iterator, which starts the worker processes.
+    __getitem__: building a ChemGraph from the dataset arrays, without the transforms.
+    <transform>: each transform of the data module, e.g., symmetrize_lattice.
+    collate: collating the crystals of a batch.
+    data_loading: rest of the data loader, including moving the batch to the device. With
+        workers, __getitem__, the transforms and collate run in the workers, so that this is the
+        time the training loop waits for the next batch.
+    corruption: sampling the time steps and the noisy batch.
+    graph_construction: interaction graph of GemNetT.
+    forward: rest of the GemNetTDenoiser forward pass.
+    wrapped_normal_loss, denoising_score_matching, d3pm_loss: losses of the positions, the cell
+        and the atomic numbers.
+    loss: rest of the loss, i.e., the weighted sum of the field losses.
+    training_step: rest of the training step, e.g., logging.
+    backward, optimizer: backward pass and optimizer step.
+    other: everything else, e.g., the training loop.
+In addition, the data loader is benchmarked on its own, without training, which is the upper bound
+of the training throughput for the number of workers. If it is not much larger than the training
+throughput, training is bound by data loading and benefits from more workers.
+
+One untimed step is run before every run. On CUDA, peak memory is torch.cuda.max_memory_allocated
+of the timed steps; on CPU, it is the size of the tensors saved for the backward pass in the
+untimed step, i.e., the activation memory, and the peak resident memory of the process so far.
+The results contain the git commit and the environment, so that result files of different commits
+can be diffed.
+"""
+
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+import warnings
+from contextlib import contextmanager
+from dataclasses import replace
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Iterator, Sequence
+
+import fire
+import numpy as np
+import torch
+from hydra import compose, initialize_config_dir
+from hydra.utils import instantiate
+from omegaconf import DictConfig
+from torch.utils.data import DataLoader
+
+from mattergen.common.data.chemgraph import ChemGraph
+from mattergen.common.data.collate import collate
+from mattergen.common.data.datamodule import worker_init_fn
+from mattergen.common.data.dataset import CrystalDataset
+from mattergen.common.data.num_atoms_distribution import NUM_ATOMS_DISTRIBUTIONS
+from mattergen.common.gemnet.gemnet import GemNetT
+from mattergen.common.utils.globals import MAX_ATOMIC_NUM, MODELS_PROJECT_ROOT
+from mattergen.common.utils.profiling import StageTimer
+from mattergen.denoiser import GemNetTDenoiser
+from mattergen.diffusion.diffusion_module import DiffusionModule
+from mattergen.diffusion.lightning_module import DiffusionLightningModule
+from mattergen.diffusion.losses import SummedFieldLoss
+
+# atoms/Angstrom**3, see conf/data_module/mp_20.yaml
+AVERAGE_DENSITY = 0.05771451654022283
+
+
+def get_config(hidden_dim: int, num_blocks: int) -> DictConfig:
+    with initialize_config_dir(os.path.join(MODELS_PROJECT_ROOT, "conf")):
+        return compose(
+            config_name="default",
+            overrides=[
+                f"lightning_module.diffusion_module.model.hidden_dim={hidden_dim}",
+                f"lightning_module.diffusion_module.model.gemnet.num_blocks={num_blocks}",
+            ],
+        )
+
+
+def sample_num_atoms(
+    num_structures: int, num_atoms_distribution: str | int, rng: np.random.Generator
+) -> np.ndarray:
+    if isinstance(num_atoms_distribution, int):
+        return np.full(num_structures, num_atoms_distribution)
+    distribution = NUM_ATOMS_DISTRIBUTIONS[num_atoms_distribution]
+    return rng.choice(list(distribution.keys()), size=num_structures, p=list(distribution.values()))
+
+
+def get_dataset(
+    num_structures: int,
+    num_atoms_distribution: str | int,
+    transforms: list[Callable[[ChemGraph], ChemGraph]],
+    seed: int,
+) -> CrystalDataset:
+    """Returns a dataset of random crystals with the average density of MP-20."""
+    rng = np.random.default_rng(seed)
+    num_atoms = sample_num_atoms(num_structures, num_atoms_distribution, rng)
+    cell_lengths = (num_atoms / AVERAGE_DENSITY) ** (1 / 3)
+    cell = cell_lengths[:, None, None] * (
+        np.eye(3) + 0.1 * rng.standard_normal((num_structures, 3, 3))
+    )
+    return CrystalDataset(
+        pos=rng.random((num_atoms.sum(), 3)),
+        cell=cell,
+        atomic_numbers=rng.integers(1, MAX_ATOMIC_NUM + 1, num_atoms.sum()),
+        num_atoms=num_atoms,
+        structure_id=np.arange(num_structures),
+        transforms=transforms,
+    )
+
+
+def _function_name(function: Callable) -> str:
+    return function.func.__name__ if isinstance(function, partial) else function.__name__
+
+
+def get_stage_timer() -> StageTimer:
+    timer = StageTimer(synchronize_cuda=True)
+    timer.instrument(CrystalDataset, "__getitem__", stage="__getitem__")
+    timer.instrument(DiffusionModule, "_corrupt_batch", stage="corruption")
+    timer.instrument(GemNetT, "generate_interaction_graph", stage="graph_construction")
+    timer.instrument(GemNetTDenoiser, "forward", stage="forward")
+    timer.instrument(SummedFieldLoss, "__call__", stage="loss")
+    timer.instrument(DiffusionLightningModule, "training_step", stage="training_step")
+    return timer
+
+
+@contextmanager
+def timed_field_losses(loss_fn: SummedFieldLoss, timer: StageTimer) -> Iterator[None]:
+    """Times the field losses, which are bound when the loss is created."""
+    loss_fns = loss_fn.loss_fns
+    loss_fn.loss_fns = {k: timer.timed(fn, stage=_function_name(fn)) for k, fn in loss_fns.items()}
+    try:
+        yield
+    finally:
+        loss_fn.loss_fns = loss_fns
+
+
+class SavedTensorsCounter:
+    """Counts the bytes of the distinct tensors saved for the backward pass."""
+
+    def __init__(self):
+        self.data_ptrs: set[int] = set()
+        self.num_bytes = 0
+
+    def pack(self, tensor: torch.Tensor) -> torch.Tensor:
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in self.data_ptrs:
+            self.data_ptrs.add(storage.data_ptr())
+            self.num_bytes += storage.nbytes()
+        return tensor
+
+    @staticmethod
+    def unpack(tensor: torch.Tensor) -> torch.Tensor:
+        return tensor
+
+
+def get_data_loader(
+    dataset: CrystalDataset, batch_size: int, num_workers: int, timer: StageTimer
+) -> DataLoader:
+    """Returns a data loader like `CrystDataModule.train_dataloader`."""
+    return DataLoader(
+        dataset,
+        shuffle=True,
+        batch_size=batch_size,
+        num_workers=num_workers,
+        worker_init_fn=worker_init_fn,
+        collate_fn=timer.timed(collate, stage="collate"),
+    )
+
+
+def iterate_batches(
+    data_loader: DataLoader, num_steps: int, device: str, timer: StageTimer
+) -> Iterator[ChemGraph]:
+    """Yields `num_steps` batches on the device, for as many epochs as needed."""
+    num_batches = 0
+    while True:
+        with timer.stage("loader_startup"):
+            iterator = iter(data_loader)
+        while True:
+            if num_batches == num_steps:
+                return
+            with timer.stage("data_loading"):
+                try:
+                    batch = next(iterator).to(device)
+                except StopIteration:
+                    break
+            num_batches += 1
+            yield batch
+
+
+def training_step(
+    model: DiffusionLightningModule,
+    optimizer: torch.optim.Optimizer,
+    batch: ChemGraph,
+    step: int,
+    timer: StageTimer,
+) -> None:
+    loss = model.training_step(batch, step)
+    with timer.stage("backward"):
+        loss.backward()
+    with timer.stage("optimizer"):
+        optimizer.step()
+        optimizer.zero_grad()
+
+
+def get_optimizer(model: DiffusionLightningModule) -> torch.optim.Optimizer:
+    optimizers = model.configure_optimizers()
+    # with learning rate schedulers, a list of optimizers and a list of schedulers
+    return optimizers[0][0] if isinstance(optimizers, tuple) else optimizers
+
+
+def benchmark_data_loader(
+    dataset: CrystalDataset, batch_size: int, num_workers: int, num_steps: int
+) -> float:
+    """Returns the number of crystals per second that the data loader yields on its own."""
+    data_loader = get_data_loader(dataset, batch_size, num_workers, timer=StageTimer())
+    start = time.perf_counter()
+    for _ in iterate_batches(data_loader, num_steps, device="cpu", timer=StageTimer()):
+        pass
+    return num_steps * batch_size / (time.perf_counter() - start)
+
+
+def benchmark_configuration(
+    model: DiffusionLightningModule,
+    initial_state: dict[str, torch.Tensor],
+    dataset: CrystalDataset,
+    transforms: list[Callable[[ChemGraph], ChemGraph]],
+    batch_size: int,
+    num_workers: int,
+    num_steps: int,
+    device: str,
+) -> dict[str, Any]:
+    """Returns the throughput, the time of each stage and the peak memory of training for
+    `num_steps` steps, starting from the initial weights."""
+    model.load_state_dict(initial_state)
+    optimizer = get_optimizer(model)
+    timer = get_stage_timer()
+    dataset = replace(
+        dataset, transforms=[timer.timed(t, stage=_function_name(t)) for t in transforms]
+    )
+
+    warm_up_batch = collate([dataset[i] for i in range(batch_size)]).to(device)
+    counter = SavedTensorsCounter()
+    with torch.autograd.graph.saved_tensors_hooks(counter.pack, counter.unpack):
+        training_step(model, optimizer, warm_up_batch, step=0, timer=StageTimer())
+
+    if device == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+    data_loader = get_data_loader(dataset, batch_size, num_workers, timer)
+    num_atoms = 0
+    with timer, timed_field_losses(model.diffusion_module.loss_fn, timer):
+        batches = iterate_batches(data_loader, num_steps, device, timer)
+        for step, batch in enumerate(batches, start=1):
+            training_step(model, optimizer, batch, step=step, timer=timer)
+            num_atoms += batch.num_atoms.sum().item()
+    timings = timer.as_dict()
+    for stage in timings["stages"].values():
+        stage["seconds_per_step"] = stage["seconds"] / num_steps
+
+    if device == "cuda":
+        memory = {"peak_memory_mb": torch.cuda.max_memory_allocated() / 2**20}
+    else:
+        memory = {"activation_memory_mb": counter.num_bytes / 2**20}
+    # kilobytes on Linux
+    memory["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+    return {
+        "batch_size": batch_size,
+        "num_workers": num_workers,
+        "num_steps": num_steps,
+        "seconds": timings["seconds"],
+        "seconds_per_step": timings["seconds"] / num_steps,
+        "crystals_per_second": num_steps * batch_size / timings["seconds"],
+        "atoms_per_second": num_atoms / timings["seconds"],
+        "data_loader_crystals_per_second": benchmark_data_loader(
+            dataset, batch_size, num_workers, num_steps
+        ),
+        **memory,
+        "stages": timings["stages"],
+    }
+
+
+def get_environment(device: str) -> dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "device": device,
+        "num_threads": torch.get_num_threads(),
+        "num_cpus": os.cpu_count(),
+    }
+
+
+def _as_list(values: int | Sequence[int]) -> list[int]:
+    return [values] if isinstance(values, int) else list(values)
+
+
+def main(
+    batch_sizes: int | Sequence[int] = (16, 64),
+    num_workers: int | Sequence[int] = (0, 2),
+    num_steps: int = 10,
+    num_structures: int = 1024,
+    num_atoms_distribution: str | int = "ALEX_MP_20",
+    hidden_dim: int = 128,
+    num_blocks: int = 2,
+    num_threads: int | None = None,
+    device: str = "cpu",
+    seed: int = 0,
+    save_as: str | None = None,
+):
+    """
+    Args:
+        batch_sizes: numbers of crystals per batch.
+        num_workers: numbers of data loader worker processes, 0 in the shipped data module configs.
+        num_steps: number of timed training steps of each configuration.
+        num_structures: number of crystals in the synthetic dataset.
+        num_atoms_distribution: name of a distribution in NUM_ATOMS_DISTRIBUTIONS, or a fixed
+            number of atoms per crystal.
+        hidden_dim: embedding size of the model, 512 in the default MatterGen model.
+        num_blocks: number of interaction blocks, 4 in the default MatterGen model.
+        num_threads: number of CPU threads used by torch. Defaults to the torch default.
+        device: device to train on.
+        seed: random seed of the dataset, the model weights and the training steps.
+        save_as: path to a JSON file to write the results to.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    config = get_config(hidden_dim=hidden_dim, num_blocks=num_blocks)
+    torch.manual_seed(seed)
+    model = instantiate(config.lightning_module).to(device)
+    initial_state = {k: v.clone() for k, v in model.state_dict().items()}
+    transforms = instantiate(config.data_module.transforms)
+    dataset = get_dataset(num_structures, num_atoms_distribution, transforms, seed=seed)
+    results: dict[str, Any] = {
+        "environment": get_environment(device),
+        "settings": {
+            "num_structures": num_structures,
+            "num_atoms_distribution": num_atoms_distribution,
+            "mean_num_atoms": float(dataset.num_atoms.mean()),
+            "hidden_dim": hidden_dim,
+            "num_blocks": num_blocks,
+            "num_parameters": sum(p.numel() for p in model.parameters()),
+            "seed": seed,
+        },
+        "results": [],
+    }
+    # self.log without a trainer only warns
+    warnings.filterwarnings("ignore", message=".*self.log.*")
+    for batch_size, workers in itertools.product(_as_list(batch_sizes), _as_list(num_workers)):
+        torch.manual_seed(seed)
+        result = benchmark_configuration(
+            model,
+            initial_state,
+            dataset,
+            transforms,
+            batch_size=batch_size,
+            num_workers=workers,
+            num_steps=num_steps,
+            device=device,
+        )
+        print(
+            f"batch_size={batch_size} num_workers={workers}: "
+            f"{result['crystals_per_second']:.1f} crystals/s "
+            f"(data loader {result['data_loader_crystals_per_second']:.1f} crystals/s), "
+            + ", ".join(
+                f"{name} {stage['fraction']:.0%}"
+                for name, stage in sorted(
+                    result["stages"].items(), key=lambda x: x[1]["seconds"], reverse=True
+                )
+            )
+        )
+        results["results"].append(result)
+
+    if save_as is not None:
+        Path(save_as).parent.mkdir(parents=True, exist_ok=True)
+        with open(save_as, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
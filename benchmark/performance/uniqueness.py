@@ -0,0 +1,173 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Benchmark of the uniqueness computation on a large synthetic set of structures.
+
+Usage:
+    python benchmark/performance/uniqueness.py --num_structures=10000 --save_as=uniqueness.json
+
+Structures have random coordinates and one of a few formulas, so that they fall into a handful
+of large reduced-formula / chemical-system groups, like large generated sets do. By default, the
+benchmark runs the combination that `mattergen-evaluate` uses for generated structures, which are
+ordered: the OrderedDatasetUniquenessComputer with the DefaultDisorderedStructureMatcher. Besides
+the time, the number of `StructureMatcher.fit` calls is reported.
+"""
+
+import json
+import time
+from pathlib import Path
+from typing import Callable, Literal
+
+import fire
+import numpy as np
+from pymatgen.analysis.structure_matcher import StructureMatcher
+from pymatgen.core import Lattice, Structure
+from pymatgen.entries.computed_entries import ComputedStructureEntry
+
+from mattergen.evaluation.reference.reference_dataset import ReferenceDataset
+from mattergen.evaluation.utils.dataset_matcher import (
+    DisorderedDatasetUniquenessComputer,
+    OrderedDatasetUniquenessComputer,
+)
+from mattergen.evaluation.utils.structure_matcher import (
+    DefaultDisorderedStructureMatcher,
+    DefaultOrderedStructureMatcher,
+)
+
+UNIQUENESS_COMPUTERS = {
+    "ordered": OrderedDatasetUniquenessComputer,
+    "disordered": DisorderedDatasetUniquenessComputer,
+}
+STRUCTURE_MATCHERS = {
+    "ordered": DefaultOrderedStructureMatcher,
+    "disordered": DefaultDisorderedStructureMatcher,
+}
+
+# Formulas of the synthetic structures, one formula unit each. Structures get 1 to 4 formula
+# units, which gives large reduced-formula groups containing cells of different sizes.
+FORMULAS = [
+    ["Mg", "O"],
+    ["Ca", "F", "F"],
+    ["Sr", "Ti", "O", "O", "O"],
+    ["Li", "Fe", "P", "O", "O", "O", "O"],
+]
+
+
+def get_random_structure(rng: np.random.Generator) -> Structure:
+    species = FORMULAS[rng.integers(len(FORMULAS))] * int(rng.integers(1, 5))
+    lattice = Lattice.from_parameters(
+        *(rng.uniform(3.0, 6.0, size=3)), *(rng.uniform(70.0, 110.0, size=3))
+    )
+    return Structure(lattice, species, rng.random((len(species), 3)))
+
+
+def get_synthetic_dataset(
+    num_structures: int, duplicate_fraction: float = 0.3, seed: int = 0
+) -> ReferenceDataset:
+    """Returns a dataset of random structures, a fraction of which are near-duplicates
+    (slightly perturbed copies or supercells) of earlier ones."""
+    rng = np.random.default_rng(seed)
+    structures: list[Structure] = []
+    for _ in range(num_structures):
+        if len(structures) > 0 and rng.random() < duplicate_fraction:
+            structure = structures[rng.integers(len(structures))].copy()
+            structure.perturb(0.01)
+            if rng.random() < 0.2:
+                structure.make_supercell([2, 1, 1])
+        else:
+            structure = get_random_structure(rng)
+        structures.append(structure)
+    entries = [ComputedStructureEntry(structure=s, energy=np.nan) for s in structures]
+    for i, e in enumerate(entries):
+        e.entry_id = i
+    return ReferenceDataset.from_entries("synthetic", entries)
+
+
+def count_fit_calls(structure_matcher: StructureMatcher) -> Callable[[], int]:
+    """Counts the calls of `structure_matcher.fit` and returns a function that returns the count."""
+    fit = structure_matcher.fit
+    num_calls = 0
+
+    def counting_fit(*args, **kwargs):
+        nonlocal num_calls
+        num_calls += 1
+        return fit(*args, **kwargs)
+
+    structure_matcher.fit = counting_fit  # type: ignore
+    return lambda: num_calls
+
+
+def run_uniqueness(
+    dataset: ReferenceDataset,
+    uniqueness_computer: str,
+    structure_matcher: str,
+    use_buckets: bool,
+    bucket_by_space_group: bool,
+) -> tuple[np.typing.NDArray[np.bool_], float, int]:
+    """Returns the uniqueness mask, the time and the number of `fit` calls."""
+    matcher = STRUCTURE_MATCHERS[structure_matcher]()
+    num_fit_calls = count_fit_calls(matcher)
+    start = time.perf_counter()
+    is_unique = UNIQUENESS_COMPUTERS[uniqueness_computer](
+        matcher, use_buckets=use_buckets, bucket_by_space_group=bucket_by_space_group
+    )(dataset)
+    return is_unique, time.perf_counter() - start, num_fit_calls()
+
+
+def main(
+    num_structures: int = 10000,
+    uniqueness_computer: Literal["ordered", "disordered"] = "ordered",
+    structure_matcher: Literal["ordered", "disordered"] = "disordered",
+    bucket_by_space_group: bool = False,
+    compare_with_exhaustive: bool = False,
+    seed: int = 0,
+    save_as: str | None = None,
+):
+    """
+    Args:
+        num_structures: number of synthetic structures.
+        uniqueness_computer: which uniqueness computer to benchmark. "ordered" groups by reduced
+            formula, "disordered" by chemical system.
+        structure_matcher: which default structure matcher to benchmark.
+        bucket_by_space_group: whether to additionally bucket by space group.
+        compare_with_exhaustive: whether to also run the uniqueness computation without buckets
+            and check that the results agree. This is slow for large `num_structures`.
+        seed: random seed of the synthetic dataset.
+        save_as: path to a JSON file to write the results to.
+    """
+    dataset = get_synthetic_dataset(num_structures, seed=seed)
+
+    results: dict[str, float | int | str | bool] = {
+        "num_structures": num_structures,
+        "uniqueness_computer": uniqueness_computer,
+        "structure_matcher": structure_matcher,
+        "bucket_by_space_group": bucket_by_space_group,
+    }
+    is_unique, results["bucketed_seconds"], results["bucketed_fit_calls"] = run_uniqueness(
+        dataset,
+        uniqueness_computer,
+        structure_matcher,
+        use_buckets=True,
+        bucket_by_space_group=bucket_by_space_group,
+    )
+    results["num_unique"] = int(is_unique.sum())
+
+    if compare_with_exhaustive:
+        expected, results["exhaustive_seconds"], results["exhaustive_fit_calls"] = run_uniqueness(
+            dataset,
+            uniqueness_computer,
+            structure_matcher,
+            use_buckets=False,
+            bucket_by_space_group=False,
+        )
+        results["results_agree"] = bool((expected == is_unique).all())
+
+    print(json.dumps(results, indent=4))
+    if save_as is not None:
+        Path(save_as).parent.mkdir(parents=True, exist_ok=True)
+        with open(save_as, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -9,6 +9,8 @@ from mattergen.common.data.chemgraph import ChemGraph
 from mattergen.common.data.types import PropertySourceId
 from mattergen.denoiser import GemNetTDenoiser, get_chemgraph_from_denoiser_output
 from mattergen.property_embeddings import (
+    _USE_UNCONDITIONAL_EMBEDDING,
+    PropertyEmbedding,
     ZerosEmbedding,
     get_property_embeddings,
     get_use_unconditional_embedding,
@@ -16,6 +18,53 @@ from mattergen.property_embeddings import (
 
 BatchTransform = Callable[[ChemGraph], ChemGraph]
 
+# attribute name in ChemGraph corresponding to a torch.LongTensor, shape=(n_structures_in_batch,),
+# that selects the adapter of each structure when several adapters are served in one batch.
+# NOTE: the name must not contain "index", otherwise PyG offsets the values when collating.
+ADAPTER_ID = "adapter_id"
+
+
+def set_zeros_unconditional_embedding(property_embedding: PropertyEmbedding) -> None:
+    """
+    We make the choice that new adapter fields do not alter the unconditional score.
+    We therefore need the unconditional embedding for all properties added in the adapter
+    to return 0. We hack the unconditional embedding module here to achieve that.
+    """
+    property_embedding.unconditional_embedding_module = ZerosEmbedding(
+        hidden_dim=property_embedding.unconditional_embedding_module.hidden_dim,
+    )
+
+
+def route_to_adapter(x: ChemGraph, cond_field: PropertySourceId, adapter_index: int) -> ChemGraph:
+    """
+    When one batch is served by several adapters, ChemGraph[ADAPTER_ID] selects the adapter
+    of each structure. Returns a shallow copy of x in which all structures that are routed through
+    other adapters use the unconditional embedding for cond_field. Since the unconditional
+    embedding of adapter fields is zero and masked out in GemNetTCtrl, these structures do not
+    receive any contribution from the adapter layers of cond_field.
+    """
+    try:
+        adapter_ids = x[ADAPTER_ID]
+    except KeyError:
+        raise KeyError(f"Several adapters are active, but the batch does not specify {ADAPTER_ID}.")
+    routed_elsewhere = (adapter_ids != adapter_index).reshape(-1, 1)
+    use_unconditional_embedding = (
+        get_use_unconditional_embedding(batch=x, cond_field=cond_field) | routed_elsewhere
+    )
+    try:
+        existing_use_unconditional_embedding = x[_USE_UNCONDITIONAL_EMBEDDING]
+    except KeyError:
+        existing_use_unconditional_embedding = {}
+    # do not modify the dict in place, it is shared by all adapters
+    return x.replace(
+        **{
+            _USE_UNCONDITIONAL_EMBEDDING: {
+                **existing_use_unconditional_embedding,
+                cond_field: use_unconditional_embedding,
+            }
+        }
+    )
+
 
 class GemNetTAdapter(GemNetTDenoiser):
     """
@@ -37,13 +86,12 @@ class GemNetTAdapter(GemNetTDenoiser):
             ]
         ), f"One of adapter conditions {self.property_embeddings_adapt.keys()} already exists in base model {self.property_embeddings.keys()}, please remove."
 
-        # we make the choice that new adapter fields do not alter the unconditional score
-        # we therefore need the unconditional embedding for all properties added in the adapter
-        # to return 0. We hack the unconditional embedding module here to achieve that
         for property_embedding in self.property_embeddings_adapt.values():
-            property_embedding.unconditional_embedding_module = ZerosEmbedding(
-                hidden_dim=property_embedding.unconditional_embedding_module.hidden_dim,
-            )
+            set_zeros_unconditional_embedding(property_embedding)
+
+        # Dict[str, int] -- when several adapters are served at once, maps the keys of
+        # <property_embeddings_adapt> to the index of the adapter they belong to, see route_to_adapter
+        self.adapter_routing: dict[str, int] = {}
 
     def forward(
         self,
@@ -76,10 +124,17 @@ class GemNetTAdapter(GemNetTDenoiser):
         conditions_adapt_dict = {}
         conditions_adapt_mask_dict = {}
         for cond_field, property_embedding in self.property_embeddings_adapt.items():
-            conditions_adapt_dict[cond_field] = property_embedding.forward(batch=x)
+            x_cond = x
+            if cond_field in self.adapter_routing:
+                x_cond = route_to_adapter(
+                    x=x,
+                    cond_field=property_embedding.name,
+                    adapter_index=self.adapter_routing[cond_field],
+                )
+            conditions_adapt_dict[cond_field] = property_embedding.forward(batch=x_cond)
             try:
                 conditions_adapt_mask_dict[cond_field] = get_use_unconditional_embedding(
-                    batch=x, cond_field=cond_field
+                    batch=x_cond, cond_field=property_embedding.name
                 )
             except KeyError:
                 # no values have been provided for the conditional field,
@@ -125,4 +180,5 @@ class GemNetTAdapter(GemNetTDenoiser):
         This function returns the list of all field names that a given score model was trained to
         condition on.
         """
-        return list(self.property_embeddings) + list(self.property_embeddings_adapt)
+        adapt_fields = [embedding.name for embedding in self.property_embeddings_adapt.values()]
+        return list(self.property_embeddings) + list(dict.fromkeys(adapt_fields))
@@ -0,0 +1,320 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Serving of several fine-tuned adapters on top of one shared base model.
+
+A model that was fine-tuned with `adapter.full_finetuning=False` only differs from its base model
+in the weights added by the adapter: the `cond_adapt_layers` and `cond_mixin_layers` of
+GemNetTCtrl and the `property_embeddings_adapt` of GemNetTAdapter. An adapter checkpoint stores
+only these weights. An AdapterRegistry loads the base weights once and switches between adapters by
+swapping these modules, which is cheap enough to do for every batch.
+
+Usage:
+    registry = AdapterRegistry.from_pretrained(MatterGenCheckpointInfo.from_hf_hub("mattergen_base"))
+    registry.load_adapter("dft_band_gap", "dft_band_gap.adapter.pt")
+    with registry.use("dft_band_gap"):
+        ...  # sample with registry.pl_module
+
+Several adapters can be active at once to serve structures with different targets in one batch.
+Then, ChemGraph[ADAPTER_ID] selects the adapter of each structure, see
+`AdapterRegistry.get_adapter_ids`.
+"""
+
+import dataclasses
+import logging
+import os
+from contextlib import contextmanager
+from typing import Any, Iterator, Sequence
+
+import hydra
+import torch
+from omegaconf import OmegaConf
+
+from mattergen.adapter import GemNetTAdapter, set_zeros_unconditional_embedding
+from mattergen.common.data.types import PropertySourceId
+from mattergen.common.gemnet.gemnet_ctrl import GemNetTCtrl
+from mattergen.common.utils.data_classes import MatterGenCheckpointInfo
+from mattergen.common.utils.eval_utils import load_model_diffusion
+from mattergen.common.utils.globals import get_device
+from mattergen.diffusion.lightning_module import DiffusionLightningModule, load_checkpoint
+
+logger = logging.getLogger(__name__)
+
+# Config overrides that load a base model as a GemNetTAdapter without any adapter layers.
+# The resulting model has exactly the parameters of the base model.
+ADAPTER_BASE_CONFIG_OVERRIDES = [
+    "lightning_module.diffusion_module.model._target_=mattergen.adapter.GemNetTAdapter",
+    "++lightning_module.diffusion_module.model.property_embeddings_adapt={}",
+    "lightning_module.diffusion_module.model.gemnet._target_=mattergen.common.gemnet.gemnet_ctrl.GemNetTCtrl",
+    "++lightning_module.diffusion_module.model.gemnet.condition_on_adapt=[]",
+]
+
+# prefixes of the parameters in the state dict of a GemNetTAdapter that belong to the adapter
+_ADAPTER_PREFIXES = (
+    "gemnet.cond_adapt_layers.",
+    "gemnet.cond_mixin_layers.",
+    "property_embeddings_adapt.",
+)
+
+
+class Adapter(torch.nn.Module):
+    """
+    The modules that a fine-tuned GemNetTAdapter adds to its base model, for all conditions
+    of the adapter.
+    """
+
+    def __init__(
+        self,
+        cond_adapt_layers: torch.nn.ModuleDict,
+        cond_mixin_layers: torch.nn.ModuleDict,
+        property_embeddings_adapt: torch.nn.ModuleDict,
+    ):
+        super().__init__()
+        assert (
+            set(cond_adapt_layers) == set(cond_mixin_layers) == set(property_embeddings_adapt)
+        ), "Adapt layers, mixin layers and property embeddings must exist for the same conditions."
+        self.cond_adapt_layers = cond_adapt_layers
+        self.cond_mixin_layers = cond_mixin_layers
+        self.property_embeddings_adapt = property_embeddings_adapt
+
+    @property
+    def condition_on_adapt(self) -> list[PropertySourceId]:
+        return list(self.property_embeddings_adapt)
+
+    @classmethod
+    def empty(cls) -> "Adapter":
+        """Returns an adapter without any conditions, i.e., the base model is used as it is."""
+        return cls(torch.nn.ModuleDict(), torch.nn.ModuleDict(), torch.nn.ModuleDict())
+
+    @classmethod
+    def from_model(cls, model: GemNetTAdapter) -> "Adapter":
+        """Returns the adapter of a fine-tuned model. The modules are shared with the model."""
+        assert isinstance(model.gemnet, GemNetTCtrl)
+        return cls(
+            cond_adapt_layers=model.gemnet.cond_adapt_layers,
+            cond_mixin_layers=model.gemnet.cond_mixin_layers,
+            property_embeddings_adapt=model.property_embeddings_adapt,
+        )
+
+    def save(
+        self, path: str | os.PathLike, property_embeddings_adapt_config: dict[str, Any]
+    ) -> None:
+        """
+        Saves the adapter weights together with the config of its property embeddings, which is
+        needed to instantiate them again.
+
+        Args:
+            path: path of the adapter checkpoint.
+            property_embeddings_adapt_config: resolved config of `property_embeddings_adapt` of the
+                fine-tuned model.
+        """
+        assert set(property_embeddings_adapt_config) == set(self.condition_on_adapt)
+        torch.save(
+            {
+                "property_embeddings_adapt": property_embeddings_adapt_config,
+                "state_dict": self.state_dict(),
+            },
+            path,
+        )
+
+    @classmethod
+    def load(
+        cls,
+        path: str | os.PathLike,
+        gemnet: GemNetTCtrl,
+        map_location: str | torch.device | None = None,
+    ) -> "Adapter":
+        """
+        Loads an adapter checkpoint written by `Adapter.save`.
+
+        Args:
+            path: path of the adapter checkpoint.
+            gemnet: base model the adapter was fine-tuned from. Used to build the adapter layers.
+            map_location: device to load the weights to.
+        """
+        checkpoint = torch.load(path, map_location=map_location)
+        property_embeddings_adapt = torch.nn.ModuleDict(
+            {
+                cond: hydra.utils.instantiate(cfg)
+                for cond, cfg in checkpoint["property_embeddings_adapt"].items()
+            }
+        )
+        cond_adapt_layers = torch.nn.ModuleDict()
+        cond_mixin_layers = torch.nn.ModuleDict()
+        for cond, property_embedding in property_embeddings_adapt.items():
+            set_zeros_unconditional_embedding(property_embedding)
+            cond_adapt_layers[cond], cond_mixin_layers[cond] = gemnet.make_adapter_layers()
+        adapter = cls(cond_adapt_layers, cond_mixin_layers, property_embeddings_adapt)
+        adapter.load_state_dict(checkpoint["state_dict"], strict=True)
+        return adapter.to(map_location) if map_location is not None else adapter
+
+
+def get_modified_base_parameters(
+    pl_module: DiffusionLightningModule, base_state_dict: dict[str, torch.Tensor]
+) -> list[str]:
+    """Returns the names of the parameters outside of the adapter that differ from the base model."""
+    prefixes = tuple(f"diffusion_module.model.{prefix}" for prefix in _ADAPTER_PREFIXES)
+    return [
+        name
+        for name, value in pl_module.state_dict().items()
+        if not name.startswith(prefixes)
+        and name in base_state_dict
+        and not torch.equal(value, base_state_dict[name].to(value.device))
+    ]
+
+
+def export_adapter(
+    checkpoint_info: MatterGenCheckpointInfo,
+    path: str | os.PathLike,
+    base_checkpoint_info: MatterGenCheckpointInfo | None = None,
+) -> None:
+    """
+    Writes the adapter of a fine-tuned model to an adapter checkpoint.
+
+    Args:
+        checkpoint_info: fine-tuned model.
+        path: path of the adapter checkpoint.
+        base_checkpoint_info: base model the model was fine-tuned from. If provided, we verify that
+            the base weights were not modified during fine-tuning, since the adapter checkpoint
+            does not contain them.
+    """
+    pl_module = load_model_diffusion(checkpoint_info)
+    model = pl_module.diffusion_module.model
+    if not isinstance(model, GemNetTAdapter):
+        raise ValueError(f"{checkpoint_info.model_path} is not a fine-tuned adapter model.")
+    if base_checkpoint_info is not None:
+        base_state_dict = load_checkpoint(
+            base_checkpoint_info.checkpoint_path, map_location=get_device()
+        )["state_dict"]
+        modified = get_modified_base_parameters(pl_module, base_state_dict)
+        if modified:
+            raise ValueError(
+                f"{len(modified)} base model parameters, e.g., {modified[0]}, were modified during "
+                "fine-tuning, so the model cannot be served as an adapter. Fine-tune with "
+                "adapter.full_finetuning=False instead."
+            )
+    property_embeddings_adapt_config = OmegaConf.to_container(
+        checkpoint_info.config.lightning_module.diffusion_module.model.property_embeddings_adapt,
+        resolve=True,
+    )
+    Adapter.from_model(model).save(path, property_embeddings_adapt_config)
+    logger.info(f"Saved adapter with conditions {model.gemnet.condition_on_adapt} to {path}")
+
+
+def merge_adapters(adapters: Sequence[Adapter]) -> tuple[Adapter, dict[str, int]]:
+    """
+    Combines several adapters into one adapter, whose conditions are prefixed with the index of
+    the adapter they belong to, e.g., `0/dft_band_gap`. Returns the combined adapter and the
+    index of the adapter of each combined condition, see GemNetTAdapter.adapter_routing.
+    The modules are shared with the given adapters.
+    """
+    merged = Adapter.empty()
+    routing = {}
+    for index, adapter in enumerate(adapters):
+        for cond in adapter.condition_on_adapt:
+            key = f"{index}/{cond}"
+            merged.cond_adapt_layers[key] = adapter.cond_adapt_layers[cond]
+            merged.cond_mixin_layers[key] = adapter.cond_mixin_layers[cond]
+            merged.property_embeddings_adapt[key] = adapter.property_embeddings_adapt[cond]
+            routing[key] = index
+    return merged, routing
+
+
+class AdapterRegistry:
+    """
+    Keeps one base model in memory and any number of adapters fine-tuned from it. The active
+    adapter is swapped into the model without copying any weights.
+
+    Args:
+        pl_module: base model, loaded as a GemNetTAdapter with a GemNetTCtrl, see
+            `AdapterRegistry.from_pretrained`.
+    """
+
+    def __init__(self, pl_module: DiffusionLightningModule):
+        self.pl_module = pl_module
+        self.model: GemNetTAdapter = pl_module.diffusion_module.model
+        assert isinstance(self.model, GemNetTAdapter) and isinstance(
+            self.model.gemnet, GemNetTCtrl
+        ), "Load the base model with ADAPTER_BASE_CONFIG_OVERRIDES, e.g., via AdapterRegistry.from_pretrained."
+        self.adapters: dict[str, Adapter] = {}
+        self._base_adapter = Adapter.empty()
+        self._active: str | tuple[str, ...] | None = None
+        self.activate(None)
+
+    @classmethod
+    def from_pretrained(cls, checkpoint_info: MatterGenCheckpointInfo) -> "AdapterRegistry":
+        """Loads the base model, which all adapters of the registry must be fine-tuned from."""
+        checkpoint_info = dataclasses.replace(
+            checkpoint_info,
+            config_overrides=[*checkpoint_info.config_overrides, *ADAPTER_BASE_CONFIG_OVERRIDES],
+        )
+        return cls(load_model_diffusion(checkpoint_info).to(get_device()))
+
+    @property
+    def active(self) -> str | tuple[str, ...] | None:
+        """Name(s) of the active adapter(s), None if the base model is used without adapter."""
+        return self._active
+
+    def register_adapter(self, name: str, adapter: Adapter) -> None:
+        overlap = set(adapter.condition_on_adapt) & set(self.model.property_embeddings)
+        assert (
+            not overlap
+        ), f"Adapter conditions {overlap} already exist in the base model, please remove."
+        device = next(self.model.parameters()).device
+        adapter.to(device).train(self.model.training)
+        self.adapters[name] = adapter
+
+    def load_adapter(self, name: str, path: str | os.PathLike) -> Adapter:
+        """Loads an adapter checkpoint written by `export_adapter` and registers it as `name`."""
+        adapter = Adapter.load(
+            path, gemnet=self.model.gemnet, map_location=next(self.model.parameters()).device
+        )
+        self.register_adapter(name, adapter)
+        return adapter
+
+    def activate(self, name: str | Sequence[str] | None) -> None:
+        """
+        Swaps the adapter `name` into the model. Use None for the base model without adapter.
+
+        If a sequence of names is given, all these adapters are active at once: each structure of
+        a batch is routed through the adapter at index ChemGraph[ADAPTER_ID] of the sequence,
+        see `get_adapter_ids`, while the base model runs once for the whole batch.
+        """
+        names = [name] if isinstance(name, str) else list(name or [])
+        unknown = [n for n in names if n not in self.adapters]
+        if unknown:
+            raise KeyError(f"Unknown adapters {unknown}. Available adapters: {list(self.adapters)}")
+        if name is None:
+            adapter, routing = self._base_adapter, {}
+        elif isinstance(name, str):
+            adapter, routing = self.adapters[name], {}
+        else:
+            adapter, routing = merge_adapters([self.adapters[n] for n in names])
+        self.model.property_embeddings_adapt = adapter.property_embeddings_adapt
+        self.model.adapter_routing = routing
+        self.model.gemnet.cond_adapt_layers = adapter.cond_adapt_layers
+        self.model.gemnet.cond_mixin_layers = adapter.cond_mixin_layers
+        self.model.gemnet.condition_on_adapt = adapter.condition_on_adapt
+        self._active = name if name is None or isinstance(name, str) else tuple(names)
+
+    def get_adapter_ids(self, names: Sequence[str]) -> torch.LongTensor:
+        """
+        Returns the values of ChemGraph[ADAPTER_ID] that route each structure through the
+        adapter of the given name, when several adapters are active.
+        """
+        assert isinstance(self._active, tuple), "Activate several adapters first."
+        return torch.tensor(
+            [self._active.index(name) for name in names],
+            device=next(self.model.parameters()).device,
+        )
+
+    @contextmanager
+    def use(self, name: str | Sequence[str] | None) -> Iterator[DiffusionLightningModule]:
+        """Activates the adapter `name`, or several adapters, while the context is active."""
+        previous = self._active
+        self.activate(name)
+        try:
+            yield self.pl_module
+        finally:
+            self.activate(previous)
@@ -0,0 +1,50 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import torch
+
+from mattergen.common.data.chemgraph import ChemGraph
+from mattergen.common.data.collate import collate
+
+
+def _get_unsliced_fields(x: ChemGraph) -> dict:
+    # Fields set on the batch after collation, e.g., the conditioning values of
+    # set_conditional_property_values, are not part of the PyG slicing information, so
+    # index_select and to_data_list drop them.
+    return {
+        key: value
+        for key, value in x.items()
+        if key not in x._slice_dict
+        and key not in ("batch", "ptr", "num_nodes")
+        and isinstance(value, (torch.Tensor, list))
+        and len(value) == x.get_batch_size()
+    }
+
+
+class ChemGraphBatchOperations:
+    """Selects and concatenates crystals of ChemGraph batches, whose size is their number of atoms."""
+
+    def select(self, x: ChemGraph, index: torch.LongTensor) -> ChemGraph:
+        unsliced_fields = {
+            key: (
+                value[index.to(value.device)]
+                if isinstance(value, torch.Tensor)
+                else [value[i] for i in index.tolist()]
+            )
+            for key, value in _get_unsliced_fields(x).items()
+        }
+        return collate(x.index_select(index.cpu())).replace(**unsliced_fields)
+
+    def concatenate(self, xs: list[ChemGraph]) -> ChemGraph:
+        unsliced_fields = {
+            key: (
+                torch.cat([x[key] for x in xs])
+                if isinstance(value, torch.Tensor)
+                else sum((x[key] for x in xs), [])
+            )
+            for key, value in _get_unsliced_fields(xs[0]).items()
+        }
+        return collate([data for x in xs for data in x.to_data_list()]).replace(**unsliced_fields)
+
+    def get_sizes(self, x: ChemGraph) -> torch.LongTensor:
+        return x.num_atoms
@@ -0,0 +1,105 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import torch
+from torch_scatter import scatter
+
+from mattergen.common.data.batch_operations import ChemGraphBatchOperations
+from mattergen.common.data.chemgraph import ChemGraph
+from mattergen.common.utils.data_utils import frac_to_cart_coords_with_lattice, radius_graph_pbc
+
+
+class CrystalHealthMonitor:
+    """
+    Rejects crystals during denoising that cannot turn into a valid structure anymore:
+
+    - crystals with non-finite coordinates, lattices or scores, at every check.
+    - crystals with a volume per atom outside [min_volume_per_atom, max_volume_per_atom], once the
+      diffusion time is at most `geometry_check_max_t`.
+    - crystals with two atoms closer than `min_distance`, once the diffusion time is at most
+      `geometry_check_max_t`. Only checked if `min_distance` is not None.
+
+    Early in denoising the structures are mostly noise, so the geometry checks would reject
+    crystals that are still fine. Used as `health_monitor` of a PredictorCorrector sampler.
+    """
+
+    def __init__(
+        self,
+        check_every: int = 10,
+        min_volume_per_atom: float = 0.1,
+        max_volume_per_atom: float = 1000.0,
+        min_distance: float | None = None,
+        geometry_check_max_t: float = 0.1,
+        max_neighbors: int = 20,
+    ):
+        """
+        Args:
+            check_every: number of denoising steps between two checks.
+            min_volume_per_atom: minimum volume per atom in Å^3.
+            max_volume_per_atom: maximum volume per atom in Å^3.
+            min_distance: minimum distance between two atoms in Å.
+            geometry_check_max_t: diffusion time below which the volume and distances are checked.
+            max_neighbors: maximum number of neighbors per atom in the distance check.
+        """
+        self.check_every = check_every
+        self.min_volume_per_atom = min_volume_per_atom
+        self.max_volume_per_atom = max_volume_per_atom
+        self.min_distance = min_distance
+        self.geometry_check_max_t = geometry_check_max_t
+        self.max_neighbors = max_neighbors
+
+    def is_healthy(self, x: ChemGraph, score: ChemGraph, t: torch.Tensor) -> torch.BoolTensor:
+        batch_size = x.get_batch_size()
+        healthy = torch.ones(batch_size, dtype=torch.bool, device=t.device)
+        for data in (x, score):
+            for field_name in ("pos", "cell", "atomic_numbers"):
+                value = data[field_name]
+                if not torch.is_floating_point(value):
+                    continue
+                finite = torch.isfinite(value).reshape(value.shape[0], -1).all(dim=1)
+                batch_idx = data.get_batch_idx(field_name)
+                if batch_idx is not None:
+                    finite = scatter(
+                        finite.long(), batch_idx, dim=0, dim_size=batch_size, reduce="min"
+                    ).bool()
+                healthy &= finite
+
+        check_geometry = healthy & (t <= self.geometry_check_max_t)
+        if not check_geometry.any():
+            return healthy
+
+        volume_per_atom = torch.det(x.cell).abs() / x.num_atoms
+        healthy &= ~check_geometry | (
+            (volume_per_atom >= self.min_volume_per_atom)
+            & (volume_per_atom <= self.max_volume_per_atom)
+        )
+
+        # only look for close atoms in the crystals that have passed all other checks
+        checked_idx = (check_geometry & healthy).nonzero().squeeze(-1)
+        if self.min_distance is not None and len(checked_idx) > 0:
+            checked = self.select(x, checked_idx)
+            edge_index, _, _ = radius_graph_pbc(
+                cart_coords=frac_to_cart_coords_with_lattice(
+                    checked.pos, checked.num_atoms, lattice=checked.cell
+                ),
+                lattice=checked.cell,
+                num_atoms=checked.num_atoms,
+                radius=self.min_distance,
+                max_num_neighbors_threshold=self.max_neighbors,
+            )
+            has_close_atoms = (
+                scatter(
+                    torch.ones_like(edge_index[0]),
+                    checked.batch[edge_index[0]],
+                    dim=0,
+                    dim_size=checked.get_batch_size(),
+                    reduce="sum",
+                )
+                > 0
+            )
+            healthy[checked_idx[has_close_atoms]] = False
+
+        return healthy
+
+    def select(self, x: ChemGraph, index: torch.LongTensor) -> ChemGraph:
+        return ChemGraphBatchOperations().select(x, index)
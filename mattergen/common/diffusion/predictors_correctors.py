@@ -8,6 +8,7 @@ from mattergen.common.utils.data_utils import compute_lattice_polar_decompositio
 from mattergen.diffusion.corruption.corruption import Corruption, maybe_expand
 from mattergen.diffusion.data.batched_data import BatchedData
 from mattergen.diffusion.sampling import predictors_correctors as pc
+from mattergen.diffusion.sampling import random_streams
 from mattergen.diffusion.sampling.predictors import AncestralSamplingPredictor
 
 SampleAndMean = tuple[torch.Tensor, torch.Tensor]
@@ -42,7 +43,9 @@ class LatticeAncestralSamplingPredictor(AncestralSamplingPredictor):
         # => mean_coeff = 1 - x_coeff = 1 - 1/(1-beta)
         mean_coeff = 1 - x_coeff
         # Sample random noise.
-        z = sde_lib.make_noise_symmetric_preserve_variance(torch.randn_like(x_coeff))
+        z = sde_lib.make_noise_symmetric_preserve_variance(
+            random_streams.randn_like(x_coeff, batch_idx)
+        )
         assert hasattr(self.corruption, "get_limit_mean")  # mypy
         mean = (
             x_coeff * x
@@ -73,7 +76,7 @@ class LatticeLangevinDiffCorrector(pc.LangevinCorrector):
         assert isinstance(self.corruption, sde_lib.LatticeVPSDE)
         alpha = self.get_alpha(t, dt=dt)
         snr = self.snr
-        noise = torch.randn_like(x)
+        noise = random_streams.randn_like(x, batch_idx)
         noise = sde_lib.make_noise_symmetric_preserve_variance(noise)
 
         # [batch_size, ] or [num_atoms, ] if batch_idx is not None
@@ -93,6 +96,6 @@ class LatticeLangevinDiffCorrector(pc.LangevinCorrector):
         mean = x + step_size * score
         x = mean + torch.sqrt(step_size * 2) * noise
 
-        x = compute_lattice_polar_decomposition(x)
-        mean = compute_lattice_polar_decomposition(mean)
+        # decompose the sample and the mean in one batched SVD instead of two
+        x, mean = compute_lattice_polar_decomposition(torch.cat([x, mean])).split(len(x))
         return x, mean
@@ -11,8 +11,8 @@ from typing import Optional, Tuple
 # import numpy as np
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 from torch_scatter import scatter
-from torch_sparse import SparseTensor
 
 from mattergen.common.gemnet.layers.atom_update_block import OutputBlock
 from mattergen.common.gemnet.layers.base_layers import Dense
@@ -30,11 +30,10 @@ from mattergen.common.gemnet.utils import (
 )
 from mattergen.common.utils.data_utils import (
     frac_to_cart_coords_with_lattice,
-    get_pbc_distances,
     lattice_params_to_matrix_torch,
     radius_graph_pbc,
 )
-from mattergen.common.utils.globals import MODELS_PROJECT_ROOT, get_device, get_pyg_device
+from mattergen.common.utils.globals import MODELS_PROJECT_ROOT
 from mattergen.common.utils.lattice_score import edge_score_to_lattice_score_frac_symmetric
 
 
@@ -177,6 +176,11 @@ class GemNetT(torch.nn.Module):
             Path to the json file containing the scaling factors.
         encoder_mode: bool
             if <True>, use the encoder mode of the model, i.e. only get the atom/edge embedddings.
+        checkpoint_interaction_blocks: bool
+            if <True>, the activations of the interaction blocks are recomputed in the backward
+            pass instead of being stored, which trades compute for memory during training.
+        checkpoint_output_blocks: bool
+            if <True>, the same for the output blocks and lattice output blocks.
     """
 
     def __init__(
@@ -208,6 +212,8 @@ class GemNetT(torch.nn.Module):
         activation: str = "swish",
         max_cell_images_per_dim: int = 5,
         encoder_mode: bool = False,  #
+        checkpoint_interaction_blocks: bool = False,
+        checkpoint_output_blocks: bool = False,
         **kwargs,
     ):
         super().__init__()
@@ -215,6 +221,8 @@ class GemNetT(torch.nn.Module):
         assert scale_file is not None, "`scale_file` is required."
 
         self.encoder_mode = encoder_mode
+        self.checkpoint_interaction_blocks = checkpoint_interaction_blocks
+        self.checkpoint_output_blocks = checkpoint_output_blocks
         self.num_targets = num_targets
         assert num_blocks > 0
         self.num_blocks = num_blocks
@@ -378,22 +386,25 @@ class GemNetT(torch.nn.Module):
             Indices enumerating the copies of id3_ca for creating a padded matrix
         """
         idx_s, idx_t = edge_index  # c->a (source=c, target=a)
-
-        value = torch.arange(idx_s.size(0), device=idx_s.device, dtype=idx_s.dtype)
-        # Possibly contains multiple copies of the same edge (for periodic interactions)
-        pyg_device = get_pyg_device() if idx_s.device != torch.device("cpu") else idx_s.device
-        torch_device = get_device() if idx_s.device != torch.device("cpu") else idx_s.device
-        adj = SparseTensor(
-            row=idx_t.to(pyg_device),
-            col=idx_s.to(pyg_device),
-            value=value.to(pyg_device),
-            sparse_sizes=(num_atoms.to(pyg_device), num_atoms.to(pyg_device)),
+        num_atoms = int(num_atoms)
+
+        # Sort the edges by target atom and then by source atom, i.e. build the CSR adjacency
+        # of the incoming edges of each atom. The sort is stable, so that several edges between
+        # the same atoms (for periodic interactions) keep their order.
+        edge_order = torch.sort(idx_t * num_atoms + idx_s, stable=True).indices
+        num_incoming = torch.bincount(idx_t, minlength=num_atoms)
+        incoming_ptr = torch.cumsum(num_incoming, dim=0) - num_incoming
+
+        # For each edge c->a, enumerate all edges b->a that point to the same atom a.
+        num_incoming_per_edge = num_incoming[idx_t]
+        id3_ca = torch.repeat_interleave(
+            torch.arange(idx_s.size(0), device=idx_s.device, dtype=idx_s.dtype),
+            num_incoming_per_edge,
         )
-        adj_edges = adj[idx_t.to(pyg_device)].to(torch_device)
-
-        # Edge indices (b->a, c->a) for triplets.
-        id3_ba = adj_edges.storage.value().to(torch_device)
-        id3_ca = adj_edges.storage.row().to(torch_device)
+        id3_ba = edge_order[
+            torch.repeat_interleave(incoming_ptr[idx_t], num_incoming_per_edge)
+            + ragged_range(num_incoming_per_edge)
+        ]
 
         # Remove self-loop triplets
         # Compare edge indices, not atom indices to correctly handle periodic interactions
@@ -423,11 +434,15 @@ class GemNetT(torch.nn.Module):
         edge_index: torch.Tensor,
         cell_offsets: torch.Tensor,
         neighbors: torch.Tensor,
-        edge_dist: torch.Tensor,
-        edge_vector: torch.Tensor,
-    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        edge_dist: Optional[torch.Tensor] = None,
+        edge_vector: Optional[torch.Tensor] = None,
+    ) -> Tuple[
+        torch.Tensor, torch.Tensor, torch.Tensor, Optional[torch.Tensor], Optional[torch.Tensor]
+    ]:
         """
         Reorder edges to make finding counter-directional edges easier.
+        edge_dist and edge_vector are optional, since they can also be computed after reordering,
+        see get_edge_geometry.
 
         Some edges are only present in one direction in the data,
         since every atom has a maximum number of neighbors. Since we only use i->j
@@ -481,8 +496,16 @@ class GemNetT(torch.nn.Module):
         # Reorder everything so the edges of every image are consecutive
         edge_index_new = edge_index_cat[:, edge_reorder_idx]
         cell_offsets_new = self.select_symmetric_edges(cell_offsets, mask, edge_reorder_idx, True)
-        edge_dist_new = self.select_symmetric_edges(edge_dist, mask, edge_reorder_idx, False)
-        edge_vector_new = self.select_symmetric_edges(edge_vector, mask, edge_reorder_idx, True)
+        edge_dist_new = (
+            None
+            if edge_dist is None
+            else self.select_symmetric_edges(edge_dist, mask, edge_reorder_idx, False)
+        )
+        edge_vector_new = (
+            None
+            if edge_vector is None
+            else self.select_symmetric_edges(edge_vector, mask, edge_reorder_idx, True)
+        )
 
         return (
             edge_index_new,
@@ -512,6 +535,41 @@ class GemNetT(torch.nn.Module):
 
         return edge_index, cell_offsets, neighbors, edge_dist, edge_vector
 
+    def get_edge_geometry(
+        self,
+        cart_coords: torch.Tensor,
+        lattice: torch.Tensor,
+        edge_index: torch.Tensor,
+        cell_offsets: torch.Tensor,
+        neighbors: torch.Tensor,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Computes the geometry of all edges c->a in one pass. The lattice of each edge is gathered
+        once and used both for the periodic offsets and for the angles with the lattice vectors.
+
+        Returns
+        -------
+        D_st: torch.Tensor, shape (num_edges,)
+            Length of each edge
+        V_st: torch.Tensor, shape (num_edges, 3)
+            Unit vector of each edge, pointing from c to a
+        offsets: torch.Tensor, shape (num_edges, 3)
+            Cartesian offset of the periodic image of c
+        lattice_cosines: torch.Tensor, shape (num_edges, 3)
+            Cosines of the angles between each edge and the three lattice vectors
+        """
+        idx_s, idx_t = edge_index
+        batch_edge = torch.repeat_interleave(
+            torch.arange(neighbors.size(0), device=neighbors.device), neighbors
+        )
+        lattice_edges = lattice[batch_edge]  # (nEdges, 3, 3)
+        offsets = torch.einsum("bi,bij->bj", cell_offsets.to(lattice.dtype), lattice_edges)
+        distance_vec = cart_coords[idx_t] - cart_coords[idx_s] - offsets
+        D_st = distance_vec.norm(dim=-1)
+        V_st = distance_vec / D_st[:, None]
+        lattice_cosines = torch.cosine_similarity(V_st[:, None], lattice_edges, dim=-1)
+        return D_st, V_st, offsets, lattice_cosines
+
     def generate_interaction_graph(
         self,
         cart_coords: torch.Tensor,
@@ -530,6 +588,7 @@ class GemNetT(torch.nn.Module):
         torch.Tensor,
         torch.Tensor,
         torch.Tensor,
+        torch.Tensor,
     ]:
         if self.otf_graph:
             edge_index, to_jimages, num_bonds = radius_graph_pbc(
@@ -541,33 +600,14 @@ class GemNetT(torch.nn.Module):
                 max_cell_images_per_dim=self.max_cell_images_per_dim,
             )
 
-        # Switch the indices, so the second one becomes the target index,
-        # over which we can efficiently aggregate.
-        out = get_pbc_distances(
-            cart_coords,
-            edge_index,
-            lattice,
-            to_jimages,
-            num_atoms,
-            num_bonds,
-            coord_is_cart=True,
-            return_offsets=True,
-            return_distance_vec=True,
+        # The edge geometry is computed after reordering, since the counter-edges only differ in
+        # the sign of the edge vector.
+        edge_index, cell_offsets, neighbors, _, _ = self.reorder_symmetric_edges(
+            edge_index, to_jimages, num_bonds
+        )
+        D_st, V_st, _, lattice_cosines = self.get_edge_geometry(
+            cart_coords, lattice, edge_index, cell_offsets, neighbors
         )
-
-        edge_index = out["edge_index"]
-        D_st = out["distances"]
-        # These vectors actually point in the opposite direction.
-        # But we want to use col as idx_t for efficient aggregation.
-        V_st = -out["distance_vec"] / D_st[:, None]
-
-        (
-            edge_index,
-            cell_offsets,
-            neighbors,
-            D_st,
-            V_st,
-        ) = self.reorder_symmetric_edges(edge_index, to_jimages, num_bonds, D_st, V_st)
 
         # Indices for swapping c->a and a->c (for symmetric MP)
         block_sizes = neighbors // 2
@@ -593,6 +633,7 @@ class GemNetT(torch.nn.Module):
             neighbors,
             D_st,
             V_st,
+            lattice_cosines,
             id_swap,
             id3_ba,
             id3_ca,
@@ -600,6 +641,15 @@ class GemNetT(torch.nn.Module):
             cell_offsets,
         )
 
+    def run_block(self, block: nn.Module, checkpointing: bool, *args, **kwargs):
+        """
+        Runs an interaction or output block. With <checkpointing>, the activations of the block
+        are not stored for the backward pass, but recomputed from its inputs.
+        """
+        if checkpointing and torch.is_grad_enabled():
+            return checkpoint(block, *args, use_reentrant=False, **kwargs)
+        return block(*args, **kwargs)
+
     def forward(
         self,
         z: torch.Tensor,
@@ -657,6 +707,7 @@ class GemNetT(torch.nn.Module):
             neighbors,
             D_st,
             V_st,
+            lattice_cosines,
             id_swap,
             id3_ba,
             id3_ca,
@@ -683,9 +734,7 @@ class GemNetT(torch.nn.Module):
             h = self.atom_latent_emb(h)
         # (nAtoms, emb_size_atom)
         m = self.edge_emb(h, rbf, idx_s, idx_t)  # (nEdges, emb_size_edge)
-        batch_edge = batch[edge_index[0]]
-        cosines = torch.cosine_similarity(V_st[:, None], distorted_lattice[batch_edge], dim=-1)
-        m = torch.cat([m, cosines], dim=-1)
+        m = torch.cat([m, lattice_cosines], dim=-1)
         m = self.angle_edge_emb(m)
 
         rbf3 = self.mlp_rbf3(rbf)
@@ -694,13 +743,17 @@ class GemNetT(torch.nn.Module):
         rbf_h = self.mlp_rbf_h(rbf)
         rbf_out = self.mlp_rbf_out(rbf)
 
-        E_t, F_st = self.out_blocks[0](h, m, rbf_out, idx_t)
+        E_t, F_st = self.run_block(
+            self.out_blocks[0], self.checkpoint_output_blocks, h, m, rbf_out, idx_t
+        )
 
         distance_vec = V_st * D_st[:, None]
 
         lattice_update = None
         rbf_lattice = self.mlp_rbf_lattice(rbf)
-        lattice_update = self.lattice_out_blocks[0](
+        lattice_update = self.run_block(
+            self.lattice_out_blocks[0],
+            self.checkpoint_output_blocks,
             edge_emb=m,
             edge_index=edge_index,
             distance_vec=distance_vec,
@@ -712,7 +765,9 @@ class GemNetT(torch.nn.Module):
         F_fully_connected = torch.tensor(0.0, device=distorted_lattice.device)
         for i in range(self.num_blocks):
             # Interaction block
-            h, m = self.int_blocks[i](
+            h, m = self.run_block(
+                self.int_blocks[i],
+                self.checkpoint_interaction_blocks,
                 h=h,
                 m=m,
                 rbf3=rbf3,
@@ -726,12 +781,16 @@ class GemNetT(torch.nn.Module):
                 idx_t=idx_t,
             )  # (nAtoms, emb_size_atom), (nEdges, emb_size_edge)
 
-            E, F = self.out_blocks[i + 1](h, m, rbf_out, idx_t)
+            E, F = self.run_block(
+                self.out_blocks[i + 1], self.checkpoint_output_blocks, h, m, rbf_out, idx_t
+            )
             # (nAtoms, num_targets), (nEdges, num_targets)
             F_st += F
             E_t += E
             rbf_lattice = self.mlp_rbf_lattice(rbf)
-            lattice_update += self.lattice_out_blocks[i + 1](
+            lattice_update += self.run_block(
+                self.lattice_out_blocks[i + 1],
+                self.checkpoint_output_blocks,
                 edge_emb=m,
                 edge_index=edge_index,
                 distance_vec=distance_vec,
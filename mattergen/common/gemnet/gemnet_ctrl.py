@@ -4,7 +4,7 @@
 
 # Adapted from https://github.com/FAIR-Chem/fairchem/blob/main/src/fairchem/core/models/gemnet/gemnet.py.
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 # import numpy as np
 import torch
@@ -49,22 +49,28 @@ class GemNetTCtrl(GemNetT):
         self.emb_size_atom = kwargs["emb_size_atom"] if "emb_size_atom" in kwargs else 512
 
         for cond in condition_on_adapt:
-            adapt_layers = []
-            mixin_layers = []
-
-            for _ in range(self.num_blocks):
-                adapt_layers.append(
-                    nn.Sequential(
-                        nn.Linear(self.emb_size_atom * 2, self.emb_size_atom),
-                        nn.ReLU(),
-                        nn.Linear(self.emb_size_atom, self.emb_size_atom),
-                    )
+            self.cond_adapt_layers[cond], self.cond_mixin_layers[cond] = self.make_adapter_layers()
+
+    def make_adapter_layers(self) -> Tuple[nn.ModuleList, nn.ModuleList]:
+        """
+        Returns new adapt layers and mixin layers for one condition, one of each for every
+        message passing block. The mixin layers are initialized to zeros.
+        """
+        adapt_layers = []
+        mixin_layers = []
+
+        for _ in range(self.num_blocks):
+            adapt_layers.append(
+                nn.Sequential(
+                    nn.Linear(self.emb_size_atom * 2, self.emb_size_atom),
+                    nn.ReLU(),
+                    nn.Linear(self.emb_size_atom, self.emb_size_atom),
                 )
-                mixin_layers.append(nn.Linear(self.emb_size_atom, self.emb_size_atom, bias=False))
-                nn.init.zeros_(mixin_layers[-1].weight)
+            )
+            mixin_layers.append(nn.Linear(self.emb_size_atom, self.emb_size_atom, bias=False))
+            nn.init.zeros_(mixin_layers[-1].weight)
 
-            self.cond_adapt_layers[cond] = torch.nn.ModuleList(adapt_layers)
-            self.cond_mixin_layers[cond] = torch.nn.ModuleList(mixin_layers)
+        return torch.nn.ModuleList(adapt_layers), torch.nn.ModuleList(mixin_layers)
 
     def forward(
         self,
@@ -128,6 +134,7 @@ class GemNetTCtrl(GemNetT):
             neighbors,
             D_st,
             V_st,
+            lattice_cosines,
             id_swap,
             id3_ba,
             id3_ca,
@@ -153,9 +160,7 @@ class GemNetTCtrl(GemNetT):
             h = self.atom_latent_emb(h)
         # (nAtoms, emb_size_atom)
         m = self.edge_emb(h, rbf, idx_s, idx_t)  # (nEdges, emb_size_edge)
-        batch_edge = batch[edge_index[0]]
-        cosines = torch.cosine_similarity(V_st[:, None], distorted_lattice[batch_edge], dim=-1)
-        m = torch.cat([m, cosines], dim=-1)
+        m = torch.cat([m, lattice_cosines], dim=-1)
         m = self.angle_edge_emb(m)
 
         rbf3 = self.mlp_rbf3(rbf)
@@ -164,13 +169,17 @@ class GemNetTCtrl(GemNetT):
         rbf_h = self.mlp_rbf_h(rbf)
         rbf_out = self.mlp_rbf_out(rbf)
 
-        E_t, F_st = self.out_blocks[0](h, m, rbf_out, idx_t)
+        E_t, F_st = self.run_block(
+            self.out_blocks[0], self.checkpoint_output_blocks, h, m, rbf_out, idx_t
+        )
 
         distance_vec = V_st * D_st[:, None]
 
         lattice_update = None
         rbf_lattice = self.mlp_rbf_lattice(rbf)
-        lattice_update = self.lattice_out_blocks[0](
+        lattice_update = self.run_block(
+            self.lattice_out_blocks[0],
+            self.checkpoint_output_blocks,
             edge_emb=m,
             edge_index=edge_index,
             distance_vec=distance_vec,
@@ -186,26 +195,33 @@ class GemNetTCtrl(GemNetT):
         # use a dictionary to track the conditions?
 
         if cond_adapt is not None and cond_adapt_mask is not None:
+            cond_adapt_atoms = {}
             cond_adapt_per_atom = {}
-            cond_adapt_mask_per_atom = {}
             for cond in self.condition_on_adapt:
-                cond_adapt_per_atom[cond] = cond_adapt[cond][batch]
-                # 1 = use conditional embedding, 0 = use unconditional embedding
-                cond_adapt_mask_per_atom[cond] = 1.0 - cond_adapt_mask[cond][batch].float()
+                # indices of the atoms that use the conditional embedding. The adapter of the
+                # unconditional embedding contributes nothing, so it only runs on these atoms.
+                # This also routes each crystal of a batch served by several adapters, see
+                # mattergen.adapter.route_to_adapter.
+                cond_adapt_atoms[cond] = torch.nonzero(
+                    torch.logical_not(cond_adapt_mask[cond][batch].reshape(-1))
+                ).squeeze(-1)
+                cond_adapt_per_atom[cond] = cond_adapt[cond][batch[cond_adapt_atoms[cond]]]
 
         for i in range(self.num_blocks):
             h_adapt = torch.zeros_like(h)
             for cond in self.condition_on_adapt:
+                atoms = cond_adapt_atoms[cond]
                 h_adapt_cond = self.cond_adapt_layers[cond][i](
-                    torch.cat([h, cond_adapt_per_atom[cond]], dim=-1)
+                    torch.cat([h[atoms], cond_adapt_per_atom[cond]], dim=-1)
                 )
                 h_adapt_cond = self.cond_mixin_layers[cond][i](h_adapt_cond)
-                # cond_adapt_mask_per_atom[cond] is 1.0 if we want to use conditional embedding and 0 for unconditional embedding
-                h_adapt += cond_adapt_mask_per_atom[cond] * h_adapt_cond
+                h_adapt = h_adapt.index_add(0, atoms, h_adapt_cond)
             h = h + h_adapt
 
             # Interaction block
-            h, m = self.int_blocks[i](
+            h, m = self.run_block(
+                self.int_blocks[i],
+                self.checkpoint_interaction_blocks,
                 h=h,
                 m=m,
                 rbf3=rbf3,
@@ -219,12 +235,16 @@ class GemNetTCtrl(GemNetT):
                 idx_t=idx_t,
             )  # (nAtoms, emb_size_atom), (nEdges, emb_size_edge)
 
-            E, F = self.out_blocks[i + 1](h, m, rbf_out, idx_t)
+            E, F = self.run_block(
+                self.out_blocks[i + 1], self.checkpoint_output_blocks, h, m, rbf_out, idx_t
+            )
             # (nAtoms, num_targets), (nEdges, num_targets)
             F_st += F
             E_t += E
             rbf_lattice = self.mlp_rbf_lattice(rbf)
-            lattice_update += self.lattice_out_blocks[i + 1](
+            lattice_update += self.run_block(
+                self.lattice_out_blocks[i + 1],
+                self.checkpoint_output_blocks,
                 edge_emb=m,
                 edge_index=edge_index,
                 distance_vec=distance_vec,
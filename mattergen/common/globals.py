@@ -6,3 +6,5 @@ from pathlib import Path
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 GENERATED_CRYSTALS_ZIP_FILE_NAME = "generated_crystals_cif.zip"
 GENERATED_CRYSTALS_EXTXYZ_FILE_NAME = "generated_crystals.extxyz"
+GENERATED_CRYSTALS_NPZ_FILE_NAME = "generated_crystals.npz"
+GENERATED_TRAJECTORIES_NPZ_FILE_NAME = "generated_trajectories.npz"
@@ -16,8 +16,10 @@ from mattergen.common.tests.testutils import get_mp_20_debug_batch
 from mattergen.common.utils.data_utils import (
     cart_to_frac_coords_with_lattice,
     frac_to_cart_coords_with_lattice,
+    get_pbc_distances,
     lattice_matrix_to_params_torch,
     lattice_params_to_matrix_torch,
+    radius_graph_pbc,
 )
 from mattergen.common.utils.eval_utils import make_structure
 from mattergen.common.utils.globals import MODELS_PROJECT_ROOT
@@ -383,3 +385,40 @@ def test_rotation_invariance():
     assert torch.allclose(forces @ rotation_matrix, forces_rotated, atol=1e-3)
 
     assert torch.allclose(rotation_matrix.T @ stress @ rotation_matrix, stress_rotated, atol=1e-3)
+
+
+def test_edge_geometry_matches_pbc_distances():
+    model = get_model(max_neighbors=20, cutoff=5.0)
+    _, frac_coords, _, num_atoms, batch, lengths, angles = reformat_batch(get_mp_20_debug_batch())
+    lattice = lattice_params_to_matrix_torch(lengths, angles)
+    cart_coords = frac_to_cart_coords_with_lattice(frac_coords, num_atoms, lattice)
+    edge_index, to_jimages, num_bonds = radius_graph_pbc(
+        cart_coords=cart_coords,
+        lattice=lattice,
+        num_atoms=num_atoms,
+        radius=model.cutoff,
+        max_num_neighbors_threshold=model.max_neighbors,
+    )
+    D_st, V_st, offsets, lattice_cosines = model.get_edge_geometry(
+        cart_coords, lattice, edge_index, to_jimages, num_bonds
+    )
+
+    out = get_pbc_distances(
+        cart_coords,
+        edge_index,
+        lattice,
+        to_jimages,
+        num_atoms,
+        num_bonds,
+        coord_is_cart=True,
+        return_offsets=True,
+        return_distance_vec=True,
+    )
+    expected_V_st = -out["distance_vec"] / out["distances"][:, None]
+    torch.testing.assert_close(D_st, out["distances"])
+    torch.testing.assert_close(V_st, expected_V_st)
+    torch.testing.assert_close(offsets, out["offsets"])
+    torch.testing.assert_close(
+        lattice_cosines,
+        torch.cosine_similarity(expected_V_st[:, None], lattice[batch[edge_index[0]]], dim=-1),
+    )
@@ -0,0 +1,292 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Columnar storage of crystal structures.
+
+Structures are stored in an uncompressed .npz file with the columns
+    pos: (total number of atoms, 3) fractional coordinates of all atoms,
+    atomic_numbers: (total number of atoms,) atomic numbers of all atoms,
+    num_atoms: (number of structures,) number of atoms of each structure,
+    cell: (number of structures, 3, 3) lattice matrices, one lattice vector per row,
+and, for denoising trajectories,
+    num_frames: (number of trajectories,) number of consecutive structures of each trajectory.
+
+Since the members of an uncompressed .npz file are stored contiguously, the columns can be
+memory-mapped and structures are only converted to pymatgen when they are accessed.
+"""
+
+import os
+import shutil
+import struct
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import BinaryIO, Iterable, Sequence, overload
+from zipfile import ZIP_STORED, ZipFile
+
+import numpy as np
+import numpy.typing
+from pymatgen.core import Lattice, Structure
+
+# dtype and shape of a row of each column
+COLUMNS: dict[str, tuple[numpy.typing.DTypeLike, tuple[int, ...]]] = {
+    "pos": (np.float32, (3,)),
+    "atomic_numbers": (np.int16, ()),
+    "num_atoms": (np.int64, ()),
+    "cell": (np.float32, (3, 3)),
+    "num_frames": (np.int64, ()),
+}
+
+# signature, fixed-size fields, file name length and extra field length of a zip local file header
+_LOCAL_FILE_HEADER = struct.Struct("<4s22xHH")
+
+
+class ColumnarStructureWriter:
+    """
+    Appends structures to a columnar .npz file, see the module docstring.
+
+    The columns of each chunk are spilled to temporary files, so memory usage does not grow with
+    the number of structures. The .npz file is only written when the writer is closed. Use the
+    writer as a context manager to discard the file if an exception is raised.
+    """
+
+    def __init__(self, path: Path | str, float_dtype: numpy.typing.DTypeLike = np.float32):
+        """
+        Args:
+            path: path of the .npz file.
+            float_dtype: dtype of the coordinates and lattices, e.g., np.float64 to store them
+                without loss of precision.
+        """
+        self.path = Path(path)
+        self._dtypes = {
+            k: float_dtype if np.issubdtype(dtype, np.floating) else dtype
+            for k, (dtype, _) in COLUMNS.items()
+        }
+        self._tmpdir: TemporaryDirectory | None = TemporaryDirectory()
+        self._files: dict[str, BinaryIO] = {
+            k: open(os.path.join(self._tmpdir.name, f"{k}.bin"), "wb") for k in COLUMNS
+        }
+        self._lengths = {k: 0 for k in COLUMNS}
+
+    def _append_column(self, name: str, values: numpy.typing.ArrayLike) -> None:
+        row_shape = COLUMNS[name][1]
+        array = np.ascontiguousarray(values, dtype=self._dtypes[name])
+        if array.shape[1:] != row_shape:
+            raise ValueError(
+                f"Expected {name} of shape (*, {', '.join(map(str, row_shape))}), got {array.shape}."
+            )
+        self._files[name].write(array.tobytes())
+        self._lengths[name] += len(array)
+
+    def append(
+        self,
+        pos: numpy.typing.ArrayLike,
+        cell: numpy.typing.ArrayLike,
+        atomic_numbers: numpy.typing.ArrayLike,
+        num_atoms: numpy.typing.ArrayLike,
+    ) -> None:
+        """Appends a chunk of structures, given by the concatenated fractional coordinates and
+        atomic numbers of their atoms, their lattice matrices and their numbers of atoms."""
+        assert self._tmpdir is not None, "The writer is closed."
+        num_atoms = np.asarray(num_atoms)
+        if len(pos) != num_atoms.sum() or len(atomic_numbers) != num_atoms.sum():
+            raise ValueError("The number of atoms does not match pos and atomic_numbers.")
+        if len(cell) != len(num_atoms):
+            raise ValueError("Expected one cell per structure.")
+        self._append_column("pos", pos)
+        self._append_column("atomic_numbers", atomic_numbers)
+        self._append_column("num_atoms", num_atoms)
+        self._append_column("cell", cell)
+
+    def append_structures(self, structures: Iterable[Structure]) -> None:
+        """Appends ordered pymatgen structures."""
+        structures = list(structures)
+        if not all(s.is_ordered for s in structures):
+            raise ValueError("Only ordered structures can be stored.")
+        if not structures:
+            return
+        self.append(
+            pos=np.concatenate([s.frac_coords for s in structures]),
+            cell=np.stack([s.lattice.matrix for s in structures]),
+            atomic_numbers=np.concatenate([s.atomic_numbers for s in structures]),
+            num_atoms=[len(s) for s in structures],
+        )
+
+    def append_trajectory(
+        self,
+        pos: numpy.typing.ArrayLike,
+        cell: numpy.typing.ArrayLike,
+        atomic_numbers: numpy.typing.ArrayLike,
+    ) -> None:
+        """Appends a trajectory given by the fractional coordinates (num_frames, num_atoms, 3),
+        lattice matrices (num_frames, 3, 3) and atomic numbers (num_frames, num_atoms) of its
+        frames."""
+        pos = np.asarray(pos)
+        num_frames, num_atoms = pos.shape[:2]
+        self.append(
+            pos=pos.reshape(-1, 3),
+            cell=cell,
+            atomic_numbers=np.asarray(atomic_numbers).reshape(-1),
+            num_atoms=np.full(num_frames, num_atoms),
+        )
+        self._append_column("num_frames", [num_frames])
+
+    def append_columnar_structures(self, structures: "ColumnarStructures") -> None:
+        """Appends all structures or trajectories of a columnar .npz file, without converting
+        them to pymatgen."""
+        assert self._tmpdir is not None, "The writer is closed."
+        for name, column in structures.columns.items():
+            self._append_column(name, column)
+
+    def close(self) -> None:
+        """Writes the .npz file."""
+        if self._tmpdir is None:
+            return
+        for f in self._files.values():
+            f.close()
+        num_frames = self._lengths["num_frames"]
+        if (
+            num_frames > 0
+            and np.fromfile(self._files["num_frames"].name, dtype=np.int64).sum()
+            != self._lengths["num_atoms"]
+        ):
+            self._discard()
+            raise ValueError("Structures and trajectories cannot be mixed in one file.")
+        with ZipFile(self.path, "w", compression=ZIP_STORED, allowZip64=True) as zip_obj:
+            for name, (_, row_shape) in COLUMNS.items():
+                if name == "num_frames" and num_frames == 0:
+                    continue
+                with zip_obj.open(f"{name}.npy", "w", force_zip64=True) as f:
+                    np.lib.format.write_array_header_1_0(
+                        f,
+                        {
+                            "descr": np.lib.format.dtype_to_descr(np.dtype(self._dtypes[name])),
+                            "fortran_order": False,
+                            "shape": (self._lengths[name], *row_shape),
+                        },
+                    )
+                    with open(self._files[name].name, "rb") as column:
+                        shutil.copyfileobj(column, f)
+        self._discard()
+
+    def _discard(self) -> None:
+        for f in self._files.values():
+            f.close()
+        if self._tmpdir is not None:
+            self._tmpdir.cleanup()
+            self._tmpdir = None
+
+    def __enter__(self) -> "ColumnarStructureWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+
+def memory_map_npz(path: Path | str) -> dict[str, np.ndarray]:
+    """Returns the arrays of an .npz file, memory-mapped for members that are not compressed."""
+    arrays = {}
+    with ZipFile(path) as zip_obj, open(path, "rb") as f:
+        for info in zip_obj.infolist():
+            name = info.filename.removesuffix(".npy")
+            if info.compress_type != ZIP_STORED:
+                with zip_obj.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            f.seek(info.header_offset)
+            signature, name_length, extra_length = _LOCAL_FILE_HEADER.unpack(
+                f.read(_LOCAL_FILE_HEADER.size)
+            )
+            assert signature == b"PK\x03\x04", f"Invalid zip file {path}"
+            f.seek(name_length + extra_length, os.SEEK_CUR)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if np.prod(shape) == 0:
+                # empty arrays cannot be memory-mapped
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+class ColumnarStructures(Sequence[Structure]):
+    """Memory-mapped structures of a columnar .npz file, see the module docstring."""
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.columns = memory_map_npz(self.path)
+        missing = {"pos", "atomic_numbers", "num_atoms", "cell"} - set(self.columns)
+        if missing:
+            raise ValueError(f"{path} is missing the columns {sorted(missing)}.")
+        self.atom_offsets = np.concatenate([[0], np.cumsum(self.columns["num_atoms"])])
+        if "num_frames" in self.columns:
+            self.frame_offsets = np.concatenate([[0], np.cumsum(self.columns["num_frames"])])
+        else:
+            self.frame_offsets = None
+
+    def __len__(self) -> int:
+        return len(self.columns["num_atoms"])
+
+    def get_structure(self, index: int) -> Structure:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} out of range for {len(self)} structures.")
+        start, end = self.atom_offsets[index], self.atom_offsets[index + 1]
+        return Structure(
+            lattice=Lattice(np.asarray(self.columns["cell"][index], dtype=np.float64)),
+            species=self.columns["atomic_numbers"][start:end].tolist(),
+            coords=np.asarray(self.columns["pos"][start:end], dtype=np.float64),
+            coords_are_cartesian=False,
+        )
+
+    @overload
+    def __getitem__(self, index: int) -> Structure:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Structure]:
+        ...
+
+    def __getitem__(self, index: int | slice) -> Structure | list[Structure]:
+        if isinstance(index, slice):
+            return [self.get_structure(i) for i in range(*index.indices(len(self)))]
+        return self.get_structure(index)
+
+    @property
+    def num_trajectories(self) -> int:
+        if self.frame_offsets is None:
+            raise ValueError(f"{self.path} does not contain trajectories.")
+        return len(self.frame_offsets) - 1
+
+    def get_trajectory(self, index: int) -> list[Structure]:
+        """Returns the structures of all frames of a trajectory."""
+        if not 0 <= index < self.num_trajectories:
+            raise IndexError(
+                f"Index {index} out of range for {self.num_trajectories} trajectories."
+            )
+        assert self.frame_offsets is not None
+        return self[self.frame_offsets[index] : self.frame_offsets[index + 1]]
+
+
+def save_columnar_structures(
+    path: Path | str,
+    structures: Iterable[Structure],
+    float_dtype: numpy.typing.DTypeLike = np.float32,
+) -> None:
+    """Saves ordered structures to a columnar .npz file."""
+    with ColumnarStructureWriter(path, float_dtype=float_dtype) as writer:
+        writer.append_structures(structures)
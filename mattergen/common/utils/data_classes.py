@@ -1,10 +1,11 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import copy
 import fnmatch
 import os
 from dataclasses import asdict, dataclass, field
-from functools import cached_property
+from functools import cached_property, lru_cache
 from pathlib import Path
 from typing import Any, Literal, Protocol
 
@@ -93,9 +94,12 @@ class MatterGenCheckpointInfo:
 
     @property
     def config(self) -> DictConfig:
-        with initialize_config_dir(str(self.model_path)):
-            cfg = compose(config_name="config", overrides=self.config_overrides)
-            return cfg
+        # Composing the config with Hydra is slow, so it is done once per config file (and its
+        # modification time) and overrides. Callers get a copy they are free to modify.
+        config_path = os.path.join(self.model_path, "config.yaml")
+        mtime = os.path.getmtime(config_path) if os.path.exists(config_path) else None
+        cfg = _compose_config(str(self.model_path), tuple(self.config_overrides), mtime)
+        return copy.deepcopy(cfg)
 
     @cached_property
     def checkpoint_path(self) -> str:
@@ -112,6 +116,10 @@ class MatterGenCheckpointInfo:
         # I.e., if the path is '/path/', we will find .ckpt files in '/path/version_0/checkpoints'
         # and '/path/version_1/checkpoints', and so on.
         model_path = str(self.model_path)
+        # skip the search for the usual layout of a model directory
+        last_ckpt = os.path.join(model_path, "checkpoints", "last.ckpt")
+        if self.load_epoch == "last" and os.path.isfile(last_ckpt):
+            return last_ckpt
         ckpts = find_local_files(local_path=model_path, glob="*.ckpt")
         assert len(ckpts) > 0, f"No checkpoints found at {model_path}"
         if self.load_epoch == "last":
@@ -156,6 +164,15 @@ class MatterGenCheckpointInfo:
         return ckpt
 
 
+@lru_cache(maxsize=16)
+def _compose_config(
+    config_dir: str, config_overrides: tuple[str, ...], mtime: float | None
+) -> DictConfig:
+    """Composes the config in `config_dir`. `mtime` is only part of the cache key."""
+    with initialize_config_dir(config_dir):
+        return compose(config_name="config", overrides=list(config_overrides))
+
+
 class ProgressCallback(Protocol):
     def __call__(self, progress: float):
         """Callback which can be used to report progress on long-running inference.
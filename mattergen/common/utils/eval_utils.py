@@ -1,10 +1,13 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import hashlib
+import io
 import logging
 import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
-from tempfile import TemporaryDirectory
 from typing import Sequence
 from zipfile import ZipFile
 
@@ -12,17 +15,23 @@ import ase.io
 import hydra
 import numpy as np
 import torch
-from pymatgen.core import Lattice, Structure
+from omegaconf import OmegaConf
+from pymatgen.core import Element, Lattice, Structure
 from pymatgen.io.ase import AseAtomsAdaptor
 
 from mattergen.common.globals import (
     GENERATED_CRYSTALS_EXTXYZ_FILE_NAME,
+    GENERATED_CRYSTALS_NPZ_FILE_NAME,
     GENERATED_CRYSTALS_ZIP_FILE_NAME,
 )
+from mattergen.common.utils.columnar_structures import ColumnarStructures, save_columnar_structures
 from mattergen.common.utils.data_classes import MatterGenCheckpointInfo
 from mattergen.common.utils.globals import get_device
 from mattergen.diffusion.lightning_module import DiffusionLightningModule
 
+# files in a folder or zip file that are read by `load_structures`
+STRUCTURE_FILE_SUFFIXES = (".cif", ".extxyz", ".xyz")
+
 # logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -69,6 +78,37 @@ def load_model_diffusion(
     return model
 
 
+def export_model_for_inference(
+    checkpoint_info: MatterGenCheckpointInfo, output_path: str | os.PathLike
+) -> MatterGenCheckpointInfo:
+    """
+    Writes the weights of a model together with its resolved config to a new model directory.
+    The exported checkpoint contains only the weights that are used for sampling, without the
+    optimizer and other training state of a Lightning checkpoint, so it is smaller and faster to
+    load.
+
+    Args:
+        checkpoint_info: model to export. Its config overrides are applied to the exported config.
+        output_path: model directory to write `config.yaml` and `checkpoints/last.ckpt` to.
+
+    Returns:
+        MatterGenCheckpointInfo of the exported model.
+    """
+    pl_module = load_model_diffusion(checkpoint_info)
+    config = OmegaConf.to_container(checkpoint_info.config, resolve=True)
+    state_dict = {k: v.cpu() for k, v in pl_module.state_dict().items()}
+
+    output_path = Path(output_path)
+    (output_path / "checkpoints").mkdir(parents=True, exist_ok=True)
+    (output_path / "config.yaml").write_text(OmegaConf.to_yaml(config))
+    # `config` is what `DiffusionLightningModule.load_from_checkpoint` instantiates the model from
+    torch.save(
+        {"state_dict": state_dict, "config": config}, output_path / "checkpoints" / "last.ckpt"
+    )
+    logger.info(f"Exported model for inference to {output_path}")
+    return MatterGenCheckpointInfo(model_path=str(output_path.resolve()))
+
+
 def get_crystals_list(
     frac_coords, atom_types, lengths, angles, num_atoms
 ) -> list[dict[str, np.ndarray]]:
@@ -104,64 +144,208 @@ def get_crystals_list(
 
 
 def save_structures(output_path: Path, structures: Sequence[Structure]) -> None:
-    """Save structures to disk in a extxyz file and a compressed zip file containing cif files.
+    """Save structures to disk in a columnar .npz file, an extxyz file and a compressed zip file
+    containing cif files.
 
     Args:
         output_path: path to a directory where the results are written.
         structures: sequence of structures.
     """
-    ase_atoms = [AseAtomsAdaptor.get_atoms(x) for x in structures]
     try:
-        ase.io.write(output_path / GENERATED_CRYSTALS_EXTXYZ_FILE_NAME, ase_atoms)
-
-        with ZipFile(output_path / GENERATED_CRYSTALS_ZIP_FILE_NAME, "w") as zip_obj:
-            for ix, ase_atom in enumerate(ase_atoms):
-                ase.io.write(f"/tmp/gen_{ix}.cif", ase_atom, format="cif")
-                zip_obj.write(f"/tmp/gen_{ix}.cif", arcname=f"gen_{ix}.cif")
+        save_columnar_structures(output_path / GENERATED_CRYSTALS_NPZ_FILE_NAME, structures)
+        save_structures_as_extxyz_and_cif(output_path, structures)
     except IOError as e:
         print(f"Got error {e} writing the generated structures to disk.")
 
 
-def load_structures(input_path: Path) -> Sequence[Structure]:
+def save_structures_as_extxyz_and_cif(output_path: Path, structures: Sequence[Structure]) -> None:
+    """Save structures to disk in an extxyz file and a compressed zip file containing cif files.
+    Use `load_structures` to convert a columnar .npz file on demand.
+
+    Args:
+        output_path: path to a directory where the results are written.
+        structures: sequence of structures.
+    """
+    ase_atoms = [AseAtomsAdaptor.get_atoms(x) for x in structures]
+    ase.io.write(output_path / GENERATED_CRYSTALS_EXTXYZ_FILE_NAME, ase_atoms)
+
+    with ZipFile(output_path / GENERATED_CRYSTALS_ZIP_FILE_NAME, "w") as zip_obj:
+        for ix, ase_atom in enumerate(ase_atoms):
+            # write to memory rather than a shared temporary file, so that concurrent runs do not
+            # overwrite each other's files
+            cif = io.BytesIO()
+            ase.io.write(cif, ase_atom, format="cif")
+            zip_obj.writestr(f"gen_{ix}.cif", cif.getvalue())
+
+
+def save_trajectories_as_extxyz(output_path: Path, trajectories: ColumnarStructures) -> None:
+    """Save the trajectories of a columnar .npz file to a zip file containing one extxyz file per
+    trajectory.
+
+    Args:
+        output_path: path of the zip file.
+        trajectories: trajectories, e.g., `ColumnarStructures("generated_trajectories.npz")`.
+    """
+    with ZipFile(output_path, "w") as zip_obj:
+        for ix in range(trajectories.num_trajectories):
+            ase_atoms = [AseAtomsAdaptor.get_atoms(x) for x in trajectories.get_trajectory(ix)]
+            str_io = io.StringIO()
+            ase.io.write(str_io, ase_atoms, format="extxyz")
+            zip_obj.writestr(f"gen_{ix}.extxyz", str_io.getvalue())
+
+
+def load_structures(
+    input_path: Path, num_workers: int = 1, cache: bool = False
+) -> Sequence[Structure]:
     """Load structures from disk.
 
     Args:
         output_path: path to a file or directory where the results are written.
+        num_workers: number of processes used to parse the structures. Results are in input order.
+        cache: whether to store the parsed structures in a columnar .npz file next to the input,
+            keyed by the hash of the input, and load them from there when the input is unchanged.
+            The cache only stores atomic numbers, coordinates and lattices, so it is not written
+            if any structure is disordered or has oxidation states or site properties.
 
     Returns:
         sequence of structures.
     """
-    # if the path is an xyz or extxyz file, read it directly
+    # if the path is a columnar .npz file, memory-map it
+    if input_path.suffix == ".npz":
+        return ColumnarStructures(input_path)
+
+    if input_path.suffix not in (".xyz", ".extxyz", ".zip") and not input_path.is_dir():
+        raise ValueError(f"Invalid input path {input_path}")
+
+    cache_path = None
+    if cache:
+        cache_path = get_structures_cache_path(input_path)
+        if cache_path.exists():
+            logger.info(f"Loading cached structures from {cache_path}")
+            return ColumnarStructures(cache_path)
+
+    # if the path is an xyz or extxyz file, parse its frames
     if input_path.suffix == ".xyz" or input_path.suffix == ".extxyz":
-        ase_atoms = ase.io.read(input_path, ":")
-        return [AseAtomsAdaptor.get_structure(x) for x in ase_atoms]
+        files = [(input_path.name, frame) for frame in split_extxyz_frames(input_path.read_text())]
+        structures = parse_structures(files, num_workers=num_workers)
 
-    # if the path is a zipped folder, extract it into a temporary directory
+    # if the path is a zipped folder, read its files without extracting them
     elif input_path.suffix == ".zip":
-        with TemporaryDirectory() as tmpdirname:
-            with ZipFile(input_path, "r") as zip_obj:
-                zip_obj.extractall(tmpdirname)
-            return extract_structures_from_folder(tmpdirname)
+        with ZipFile(input_path, "r") as zip_obj:
+            files = [
+                (info.filename, zip_obj.read(info).decode())
+                for info in zip_obj.infolist()
+                if info.filename.endswith(STRUCTURE_FILE_SUFFIXES)
+            ]
+        structures = parse_structures(files, num_workers=num_workers)
 
     # if the path is a directory, read all files in it
-    elif input_path.is_dir():
-        return extract_structures_from_folder(input_path)
+    else:
+        structures = extract_structures_from_folder(input_path, num_workers=num_workers)
+
+    if cache_path is not None:
+        write_structures_cache(cache_path, structures)
+    return structures
+
+
+def extract_structures_from_folder(
+    dirname: str | Path, num_workers: int = 1
+) -> Sequence[Structure]:
+    files = [
+        (filename, Path(dirname, filename).read_text())
+        for filename in os.listdir(dirname)
+        if filename.endswith(STRUCTURE_FILE_SUFFIXES)
+    ]
+    return parse_structures(files, num_workers=num_workers)
+
+
+def split_extxyz_frames(text: str) -> list[str]:
+    """Splits the contents of a (multi-frame) extxyz file into the contents of its frames."""
+    lines = text.splitlines(keepends=True)
+    frames = []
+    start = 0
+    while start < len(lines):
+        if not lines[start].strip():
+            start += 1
+            continue
+        # a frame has a line with the number of atoms, a comment line and one line per atom
+        end = start + int(lines[start]) + 2
+        frames.append("".join(lines[start:end]))
+        start = end
+    return frames
+
 
+def parse_structure(filename: str, content: str) -> Structure | None:
+    """Parses the contents of a .cif file or a single-frame .xyz or .extxyz file. Returns None
+    for other files and CIF files that cannot be parsed."""
+    if filename.endswith(".cif"):
+        try:
+            return Structure.from_str(content, fmt="cif")
+        except ValueError as e:
+            logger.warning(f"Failed to read {filename} as a CIF file: {e}")
+            return None
+    elif filename.endswith((".extxyz", ".xyz")):
+        #  We assume that the file contains only one structure
+        ase_atoms = ase.io.read(io.StringIO(content), 0, format="extxyz")
+        return AseAtomsAdaptor.get_structure(ase_atoms)
+    return None
+
+
+def parse_structures(files: Sequence[tuple[str, str]], num_workers: int = 1) -> list[Structure]:
+    """Parses (filename, content) pairs with `parse_structure` in `num_workers` processes and
+    returns the structures in the order of `files`, skipping files that were not parsed."""
+    with ProcessPoolExecutor(num_workers) if num_workers > 1 else nullcontext() as executor:
+        filenames, contents = [f for f, _ in files], [c for _, c in files]
+        if executor is None:
+            results = list(map(parse_structure, filenames, contents))
+        else:
+            chunksize = max(1, len(files) // (4 * num_workers))
+            results = list(executor.map(parse_structure, filenames, contents, chunksize=chunksize))
+    return [s for s in results if s is not None]
+
+
+def get_structures_cache_path(input_path: Path) -> Path:
+    """Returns the path of the structures cache of a file or directory, which is next to it and
+    named after the hash of its contents."""
+    input_hash = hashlib.sha256()
+    if input_path.is_dir():
+        for filename in sorted(os.listdir(input_path)):
+            if filename.endswith(STRUCTURE_FILE_SUFFIXES):
+                input_hash.update(filename.encode())
+                input_hash.update((input_path / filename).read_bytes())
     else:
-        raise ValueError(f"Invalid input path {input_path}")
+        with open(input_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                input_hash.update(chunk)
+    return input_path.parent / f".{input_path.name}.{input_hash.hexdigest()[:16]}.npz"
 
 
-def extract_structures_from_folder(dirname: str) -> Sequence[Structure]:
-    structures = []
-    for filename in os.listdir(dirname):
-        if filename.endswith(".cif"):
-            try:
-                structures.append(Structure.from_file(f"{dirname}/{filename}"))
-            except ValueError as e:
-                logger.warning(f"Failed to read {filename} as a CIF file: {e}")
-        elif filename.endswith(".extxyz") or filename.endswith(".xyz"):
-            ase_atoms = ase.io.read(
-                f"{dirname}/{filename}", 0
-            )  #  We assume that the file contains only one structure
-            structures.append(AseAtomsAdaptor.get_structure(ase_atoms))
-    return structures
+def is_cacheable_structure(structure: Structure) -> bool:
+    """Whether a structure is fully described by its atomic numbers, coordinates and lattice, i.e.,
+    whether it is read back unchanged from a columnar .npz file."""
+    return (
+        structure.is_ordered
+        and all(isinstance(species, Element) for species in structure.species)
+        and not structure.site_properties
+        and not structure.properties
+    )
+
+
+def write_structures_cache(cache_path: Path, structures: Sequence[Structure]) -> None:
+    """Writes the structures cache and removes outdated caches of the same input."""
+    if not all(is_cacheable_structure(s) for s in structures):
+        logger.warning(
+            "Not caching the structures, since some of them are disordered or have oxidation "
+            "states or site properties."
+        )
+        return
+    try:
+        save_columnar_structures(cache_path, structures, float_dtype=np.float64)
+    except IOError as e:
+        logger.warning(f"Failed to cache the structures in {cache_path}: {e}")
+        return
+    input_name = cache_path.name.rsplit(".", 2)[0]
+    # only remove files named like a cache of the same input, i.e., with a 16-digit hex hash
+    for outdated_path in cache_path.parent.glob(f"{input_name}.{'[0-9a-f]' * 16}.npz"):
+        if outdated_path != cache_path:
+            outdated_path.unlink(missing_ok=True)
@@ -8,13 +8,19 @@
 import os
 from functools import lru_cache
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import torch
 from omegaconf import OmegaConf
 
+if TYPE_CHECKING:
+    import torch
 
+
+# torch is imported on first use to keep the startup of the command line tools fast
 @lru_cache
-def get_device() -> torch.device:
+def get_device() -> "torch.device":
+    import torch
+
     if torch.cuda.is_available():
         return torch.device("cuda")
     if torch.backends.mps.is_available():
@@ -23,17 +29,18 @@ def get_device() -> torch.device:
 
 
 @lru_cache
-def get_pyg_device() -> torch.device:
+def get_pyg_device() -> "torch.device":
     """
     Some operations of pyg don't work on MPS, so fall back to CPU.
     """
+    import torch
+
     if torch.cuda.is_available():
         return torch.device("cuda")
     return torch.device("cpu")
 
 
 MODELS_PROJECT_ROOT = Path(__file__).resolve().parents[2]
-print(f"MODELS_PROJECT_ROOT: {MODELS_PROJECT_ROOT}")
 
 # Set environment variable PROJECT_ROOT so that hydra / OmegaConf can access it.
 os.environ["PROJECT_ROOT"] = str(MODELS_PROJECT_ROOT)  # for hydra
@@ -0,0 +1,128 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Breakdown of the wall time of a computation into stages, e.g., of a sampler into graph
+construction, score model and predictor-corrector updates.
+
+Functions and methods are assigned to stages with `StageTimer.instrument`, or `StageTimer.timed` for
+functions that are not looked up in a namespace, and code sections with `StageTimer.stage`.
+Times are exclusive: the time of a stage that runs inside another stage is only attributed to the
+inner stage, so the times of all stages add up to the time the timer was active, with the time
+outside of any stage reported as "other".
+
+Usage:
+    timer = StageTimer()
+    timer.instrument(GemNetT, "get_triplets", stage="get_triplets")
+    with timer:
+        sampler.sample(conditioning_data)
+    print(timer.as_dict())
+"""
+
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Iterator
+
+import torch
+
+OTHER_STAGE = "other"
+
+
+class StageTimer:
+    """Collects the exclusive wall time and number of calls of the stages of a computation."""
+
+    def __init__(self, synchronize_cuda: bool = False) -> None:
+        """
+        Args:
+            synchronize_cuda: whether to wait for the CUDA kernels of a stage to finish before it
+                is stopped. Otherwise, the time of asynchronous kernels is attributed to the stage
+                that waits for them.
+        """
+        self.synchronize_cuda = synchronize_cuda
+        self.seconds = 0.0
+        self.stage_seconds: dict[str, float] = defaultdict(float)
+        self.calls: Counter[str] = Counter()
+        # functions to instrument, and the original attributes while the timer is active
+        self._instrumented: list[tuple[Any, str, str]] = []
+        self._patches: list[tuple[Any, str, Any]] = []
+        # open stages with their start time and the time of the stages nested inside them
+        self._open_stages: list[list[Any]] = []
+        self._start = 0.0
+        self._active = False
+
+    def instrument(self, owner: Any, attribute: str, stage: str) -> None:
+        """Times the calls of the function or method `owner.attribute` as `stage` while the timer
+        is active. `owner` is a class or module, which has to be the namespace that the function is
+        looked up in by its callers."""
+        assert not self._patches, "Instrument functions before the timer is activated."
+        self._instrumented.append((owner, attribute, stage))
+
+    def _now(self) -> float:
+        if self.synchronize_cuda and torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Times a code section as stage `name`."""
+        self._open_stages.append([name, self._now(), 0.0])
+        try:
+            yield
+        finally:
+            _, start, nested_seconds = self._open_stages.pop()
+            seconds = self._now() - start
+            self.stage_seconds[name] += seconds - nested_seconds
+            self.calls[name] += 1
+            if self._open_stages:
+                self._open_stages[-1][2] += seconds
+
+    def timed(self, function: Callable, stage: str) -> Callable:
+        """Returns `function` timed as `stage` while the timer is active, e.g., for the transforms
+        of a dataset or the collate function of a data loader."""
+
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            if not self._active:
+                return function(*args, **kwargs)
+            with self.stage(stage):
+                return function(*args, **kwargs)
+
+        return timed_function
+
+    def __enter__(self) -> "StageTimer":
+        for owner, attribute, stage in self._instrumented:
+            # restore the attribute of the owner itself, not one it inherits
+            original = vars(owner).get(attribute)
+            self._patches.append((owner, attribute, original))
+            setattr(owner, attribute, self.timed(getattr(owner, attribute), stage))
+        self._active = True
+        self._start = self._now()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.seconds += self._now() - self._start
+        self._active = False
+        for owner, attribute, original in reversed(self._patches):
+            if original is None:
+                delattr(owner, attribute)
+            else:
+                setattr(owner, attribute, original)
+        self._patches = []
+
+    def as_dict(self) -> dict[str, Any]:
+        """Returns the total time and the time, fraction and number of calls of each stage."""
+        stage_seconds = dict(self.stage_seconds)
+        stage_seconds[OTHER_STAGE] = self.seconds - sum(self.stage_seconds.values())
+        return {
+            "seconds": self.seconds,
+            "stages": {
+                name: {
+                    "seconds": seconds,
+                    "fraction": seconds / self.seconds if self.seconds > 0 else 0.0,
+                    "calls": self.calls[name],
+                }
+                for name, seconds in stage_seconds.items()
+            },
+        }
@@ -10,6 +10,7 @@ from mattergen.common.data.chemgraph import ChemGraph
 from mattergen.common.data.types import PropertySourceId
 from mattergen.common.utils.globals import MAX_ATOMIC_NUM, SELECTED_ATOMIC_NUMBERS
 from mattergen.diffusion.model_utils import NoiseLevelEncoding
+from mattergen.diffusion.sampling.conditioning_cache import cached_conditioning
 from mattergen.diffusion.score_models.base import ScoreModel
 from mattergen.property_embeddings import (
     ChemicalSystemMultiHotEmbedding,
@@ -46,6 +47,22 @@ def mask_logits(logits: torch.Tensor, mask: torch.Tensor) -> torch.Tensor:
     return logits + (1 - mask) * -1e10
 
 
+def get_selected_elements_mask(
+    num_classes: int, predictions_are_zero_based: bool, device: torch.device
+) -> torch.Tensor:
+    """Returns a mask of shape (1, num_classes) that is 1 for the elements in SELECTED_ATOMIC_NUMBERS."""
+    # (1, num_selected_elements)
+    selected_atomic_numbers = torch.tensor(SELECTED_ATOMIC_NUMBERS, device=device)
+    predictions_are_one_based = not predictions_are_zero_based
+    # (num_atoms, num_classes)
+    one_hot_selected_elements = atomic_numbers_to_mask(
+        atomic_numbers=selected_atomic_numbers + int(predictions_are_one_based),
+        max_atomic_num=num_classes,
+    )
+    # (1, num_classes)
+    return one_hot_selected_elements.sum(0)[None]
+
+
 def mask_disallowed_elements(
     logits: torch.FloatTensor,
     x: ChemGraph | None = None,
@@ -64,16 +81,16 @@ def mask_disallowed_elements(
             the logits are zero-based (model predicts atomic number index)
     """
     # First, mask out generally undesired elements
-    # (1, num_selected_elements)
-    selected_atomic_numbers = torch.tensor(SELECTED_ATOMIC_NUMBERS, device=logits.device)
-    predictions_are_one_based = not predictions_are_zero_based
-    # (num_atoms, num_classes)
-    one_hot_selected_elements = atomic_numbers_to_mask(
-        atomic_numbers=selected_atomic_numbers + int(predictions_are_one_based),
-        max_atomic_num=logits.shape[1],
-    )
+    # Masks only depend on the conditions, so while sampling they are computed once for all steps.
     # (1, num_classes)
-    k_hot_mask = one_hot_selected_elements.sum(0)[None]
+    k_hot_mask = cached_conditioning(
+        key=("selected_elements_mask", logits.shape[1], predictions_are_zero_based, logits.device),
+        compute=lambda: get_selected_elements_mask(
+            num_classes=logits.shape[1],
+            predictions_are_zero_based=predictions_are_zero_based,
+            device=logits.device,
+        ),
+    )
     # Set the logits for disallowed elements to -inf
     logits = mask_logits(logits=logits, mask=k_hot_mask)
 
@@ -100,9 +117,13 @@ def mask_disallowed_elements(
         keep_all_logits = torch.ones((len(x["chemical_system"]), 1), device=x["num_atoms"].device)
 
         # torch.Tensor, shape=(Nbatch,MAX_ATOMIC_NUM+1) -- 1s where elements are present in chemical system condition, 0 elsewhere
-        multi_hot_chemical_system = ChemicalSystemMultiHotEmbedding.sequences_to_multi_hot(
-            x=ChemicalSystemMultiHotEmbedding.convert_to_list_of_str(x=x["chemical_system"]),
-            device=x["num_atoms"].device,
+        multi_hot_chemical_system = cached_conditioning(
+            key=("chemical_system_multi_hot", x["num_atoms"].device),
+            compute=lambda: ChemicalSystemMultiHotEmbedding.sequences_to_multi_hot(
+                x=ChemicalSystemMultiHotEmbedding.convert_to_list_of_str(x=x["chemical_system"]),
+                device=x["num_atoms"].device,
+            ),
+            conditioning=[x["chemical_system"]],
         )
 
         keep_logits = torch.where(
@@ -145,19 +166,19 @@ def get_chemgraph_from_denoiser_output(
     element_mask_func: when not training, a function can be applied to mask logits for certain atom types
     x_input: the nosiy state input to the score model, contains the lattice to convert cartesisan to fractional noise.
     """
+    batch_idx = x_input.get_batch_idx("pos")
     if not training and element_mask_func:
         # when sampling we may want to mask logits for atom types depending on info in x['chemical_system'] and x['chemical_system_MASK']
         pred_atom_types = element_mask_func(
             logits=pred_atom_types,
             x=x_input,
-            batch_idx=x_input.get_batch_idx("pos"),
+            batch_idx=batch_idx,
         )
 
     replace_dict = dict(
         # convert from cartesian to fractional coordinate score
         pos=(
-            x_input["cell"].inverse().transpose(1, 2)[x_input.get_batch_idx("pos")]
-            @ pred_cart_pos_eps.unsqueeze(-1)
+            x_input["cell"].inverse().transpose(1, 2)[batch_idx] @ pred_cart_pos_eps.unsqueeze(-1)
         ).squeeze(-1),
         cell=pred_lattice_eps,
         atomic_numbers=pred_atom_types,
@@ -24,6 +24,7 @@ from torch_scatter import scatter_add
 
 from mattergen.diffusion.corruption.corruption import B, Corruption, maybe_expand
 from mattergen.diffusion.data.batched_data import BatchedData
+from mattergen.diffusion.sampling import random_streams
 
 
 class ScoreFunction(Protocol):
@@ -136,7 +137,7 @@ class BaseVPSDE(SDE):
         conditioning_data: Optional[BatchedData] = None,
         batch_idx: B = None,
     ) -> torch.Tensor:
-        return torch.randn(*shape)
+        return random_streams.randn(shape, batch_idx)
 
     def prior_logp(
         self,
@@ -242,7 +243,7 @@ class VESDE(SDE):
         conditioning_data: Optional[BatchedData] = None,
         batch_idx: B = None,
     ) -> torch.Tensor:
-        return torch.randn(*shape) * self.sigma_max
+        return random_streams.randn(shape, batch_idx) * self.sigma_max
 
     def prior_logp(
         self,
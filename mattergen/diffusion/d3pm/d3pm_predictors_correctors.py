@@ -10,6 +10,7 @@ from mattergen.diffusion.corruption.d3pm_corruption import D3PMCorruption
 from mattergen.diffusion.corruption.sde_lib import ScoreFunction
 from mattergen.diffusion.data.batched_data import BatchedData
 from mattergen.diffusion.discrete_time import to_discrete_time
+from mattergen.diffusion.sampling import random_streams
 from mattergen.diffusion.sampling.predictors import Predictor
 from mattergen.diffusion.sampling.predictors_correctors import SampleAndMean
 
@@ -70,7 +71,7 @@ class D3PMAncestralSamplingPredictor(Predictor):
 
         # sample from categorical distribution
         x_sample = self.corruption._to_non_zero_based(
-            torch.distributions.Categorical(logits=class_logits).sample()
+            random_streams.categorical(class_logits, batch_idx)
         )
 
         # convert logit output to normalized probabilities
@@ -94,7 +95,7 @@ class D3PMAncestralSamplingPredictor(Predictor):
             )
 
             x_sample = self.corruption._to_non_zero_based(
-                torch.distributions.Categorical(logits=class_logits).sample()
+                random_streams.categorical(class_logits, batch_idx)
             )
 
             # get expected atom type
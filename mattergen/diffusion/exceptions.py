@@ -9,3 +9,8 @@ class IncompatibleSampler(ValueError):
 class AmbiguousConfig(ValueError):
     # Raised when the config is ambiguous
     pass
+
+
+class AllSamplesRejected(RuntimeError):
+    # Raised when a sample health monitor rejects all samples of a batch during denoising
+    pass
@@ -41,6 +41,29 @@ def get_default_optimizer(params):
     return AdamW(params=params, lr=1e-4, weight_decay=0, amsgrad=True)
 
 
+def load_checkpoint(checkpoint_path: str, map_location: Optional[str] = None) -> Dict[str, Any]:
+    """Loads a checkpoint with memory-mapped tensors. Only the tensors that are used, e.g., not the
+    optimizer state, are read from disk, and on CPU, processes that load the same checkpoint share
+    its memory pages. Checkpoints in the legacy format of torch.save cannot be memory-mapped and
+    are read completely."""
+    try:
+        return torch.load(checkpoint_path, map_location=map_location, mmap=True)
+    except RuntimeError:
+        return torch.load(checkpoint_path, map_location=map_location)
+
+
+def load_state_dict(
+    module: torch.nn.Module,
+    state_dict: Dict[str, torch.Tensor],
+    map_location: Optional[str] = None,
+    strict: bool = True,
+) -> torch.nn.modules.module._IncompatibleKeys:
+    """Loads `state_dict` into `module`. On CPU, the module takes over the (memory-mapped) tensors
+    of the state dict instead of copying them into its own parameters."""
+    assign = map_location is not None and torch.device(map_location).type == "cpu"
+    return module.load_state_dict(state_dict, strict=strict, assign=assign)
+
+
 class DiffusionLightningModule(pl.LightningModule, Generic[T]):
     """LightningModule for instantiating and training a DiffusionModule."""
 
@@ -77,7 +100,7 @@ class DiffusionLightningModule(pl.LightningModule, Generic[T]):
     ) -> DiffusionLightningModule:
         """Load model from checkpoint. kwargs are passed to hydra's instantiate and can override
         arguments from the checkpoint config."""
-        checkpoint = torch.load(checkpoint_path, map_location=map_location)
+        checkpoint = load_checkpoint(checkpoint_path, map_location=map_location)
 
         # The config should have been saved in the checkpoint by AddConfigCallback in run.py
         config = Config(**checkpoint["config"])
@@ -92,7 +115,7 @@ class DiffusionLightningModule(pl.LightningModule, Generic[T]):
         assert isinstance(lightning_module, cls)
 
         # Restore state of the DiffusionLightningModule.
-        lightning_module.load_state_dict(checkpoint["state_dict"])
+        load_state_dict(lightning_module, checkpoint["state_dict"], map_location=map_location)
         return lightning_module
 
     @classmethod
@@ -106,18 +129,24 @@ class DiffusionLightningModule(pl.LightningModule, Generic[T]):
         """Load model from checkpoint, but instead of using the config stored in the checkpoint,
         use the config passed in as an argument. This is useful when, e.g., an unused argument was
         removed in the code but is still present in the checkpoint config."""
-        checkpoint = torch.load(checkpoint_path, map_location=map_location)
+        checkpoint = load_checkpoint(checkpoint_path, map_location=map_location)
 
         lightning_module = instantiate(config)
         assert isinstance(lightning_module, cls)
 
         # Restore state of the DiffusionLightningModule.
-        result = lightning_module.load_state_dict(checkpoint["state_dict"], strict=strict)
+        result = load_state_dict(
+            lightning_module, checkpoint["state_dict"], map_location=map_location, strict=strict
+        )
 
         return lightning_module, result
 
     def configure_optimizers(self) -> Any:
-        optimizer = self._optimizer_partial(params=self.diffusion_module.parameters())
+        # frozen parameters, e.g. the base model when fine-tuning only an adapter, are left out
+        # so that the optimizer neither allocates state for them nor iterates over them
+        optimizer = self._optimizer_partial(
+            params=[p for p in self.diffusion_module.parameters() if p.requires_grad]
+        )
         if self._scheduler_partials:
             lr_schedulers = [
                 {
@@ -5,8 +5,9 @@ from typing import Callable
 
 import torch
 
-from mattergen.diffusion.sampling.pc_sampler import Diffusable, PredictorCorrector
 from mattergen.common.data.collate import collate
+from mattergen.diffusion.sampling.conditioning_cache import cached_conditioning
+from mattergen.diffusion.sampling.pc_sampler import Diffusable, PredictorCorrector
 
 BatchTransform = Callable[[Diffusable], Diffusable]
 
@@ -18,6 +19,17 @@ def identity(x: Diffusable) -> Diffusable:
     return x
 
 
+def _collate_joint_batch(
+    batch_no_condition: Diffusable, batch_with_condition: Diffusable
+) -> Diffusable:
+    joint_batch = collate([batch_no_condition, batch_with_condition])
+
+    for attr, value in batch_no_condition.items():
+        if isinstance(value, list):
+            joint_batch[attr] = batch_no_condition[attr] + batch_with_condition[attr]
+    return joint_batch
+
+
 class GuidedPredictorCorrector(PredictorCorrector):
     """
     Sampler for classifier-free guidance.
@@ -74,12 +86,24 @@ class GuidedPredictorCorrector(PredictorCorrector):
             # guided_score = guidance_factor * conditional_score + (1-guidance_factor) * unconditional_score
             batch_no_condition = self._remove_conditioning_fn(x)
             batch_with_condition = self._keep_conditioning_fn(x)
-            joint_batch = collate([batch_no_condition, batch_with_condition])
-
-            for attr,value in batch_no_condition.items():
-                if isinstance(value, list):
-                    joint_batch[attr] = batch_no_condition[attr]+batch_with_condition[attr]
-
+            corrupted_fields = self._multi_corruption.corrupted_fields
+            # While sampling, the joint batch is only collated at the first step. The later steps
+            # reuse its conditioning data, so that values cached for it are reused, too, and only
+            # concatenate the corrupted fields.
+            joint_batch = cached_conditioning(
+                key=("classifier_free_guidance_batch", id(self)),
+                compute=lambda: _collate_joint_batch(batch_no_condition, batch_with_condition),
+                conditioning=[v for k, v in x.items() if k not in corrupted_fields],
+            )
+            joint_batch = joint_batch.replace(
+                **{
+                    k: torch.cat(
+                        [batch_no_condition[k], batch_with_condition[k]],
+                        dim=joint_batch.__cat_dim__(k, joint_batch[k]),
+                    )
+                    for k in corrupted_fields
+                }
+            )
 
             combined_score = super(GuidedPredictorCorrector, self)._score_fn(
                 x=joint_batch, t=torch.cat([t, t], dim=0),
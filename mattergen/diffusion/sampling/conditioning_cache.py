@@ -0,0 +1,68 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Hashable, Iterator, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+class ConditioningCache:
+    """
+    Stores values that only depend on the conditioning data of a batch, e.g., property embeddings
+    and element masks. The conditioning data stays the same across all denoising steps of a
+    sampling run, so these values are computed at the first score evaluation and reused by
+    reference afterwards.
+
+    Values are identified by the identity of the conditioning objects they are computed from,
+    which does not require to read their content, e.g., from the GPU. The cache keeps these
+    objects alive, so that their ids are not reused by other objects while it is active.
+    """
+
+    def __init__(self) -> None:
+        self._values: dict[Hashable, Any] = {}
+        self._conditioning: list[Any] = []
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, conditioning: Sequence[Any], compute: Callable[[], T]) -> T:
+        full_key = (key, *(id(c) for c in conditioning))
+        if full_key in self._values:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._values[full_key] = compute()
+            self._conditioning.extend(conditioning)
+        return self._values[full_key]
+
+
+_active_cache: ContextVar[ConditioningCache | None] = ContextVar("conditioning_cache", default=None)
+
+
+@contextmanager
+def conditioning_cache() -> Iterator[ConditioningCache]:
+    """Activates a new ConditioningCache, e.g., for the duration of one sampling run.
+
+    Only use this when the model parameters do not change while the cache is active.
+    """
+    token = _active_cache.set(ConditioningCache())
+    try:
+        yield _active_cache.get()  # type: ignore
+    finally:
+        _active_cache.reset(token)
+
+
+def cached_conditioning(
+    key: Hashable, compute: Callable[[], T], conditioning: Sequence[Any] = ()
+) -> T:
+    """Returns `compute()`. While a conditioning cache is active, the result is computed only once
+    per key and conditioning objects, e.g., tensors of property values or lists of chemical
+    systems. The result may only depend on the key and on the conditioning objects, which must not
+    be modified in place while the cache is active."""
+    cache = _active_cache.get()
+    if cache is None:
+        return compute()
+    return cache.get(key, conditioning, compute)
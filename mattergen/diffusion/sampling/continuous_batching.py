@@ -0,0 +1,29 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from typing import Protocol, TypeVar
+
+import torch
+
+from mattergen.diffusion.data.batched_data import BatchedData
+
+T = TypeVar("T", bound=BatchedData)
+
+
+class BatchOperations(Protocol[T]):
+    """
+    Operations on batches that PredictorCorrector.sample_continuously needs to take finished
+    samples out of a batch and to add new ones.
+    """
+
+    def select(self, x: T, index: torch.LongTensor) -> T:
+        """Returns the samples of `x` at `index`."""
+        raise NotImplementedError
+
+    def concatenate(self, xs: list[T]) -> T:
+        """Returns a batch with the samples of all batches in `xs`, in order."""
+        raise NotImplementedError
+
+    def get_sizes(self, x: T) -> torch.LongTensor:
+        """Returns the size of each sample of `x`, e.g., its number of atoms, with shape (batch_size,)."""
+        raise NotImplementedError
@@ -0,0 +1,28 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from typing import Protocol, TypeVar
+
+import torch
+
+from mattergen.diffusion.data.batched_data import BatchedData
+
+T = TypeVar("T", bound=BatchedData)
+
+
+class SampleHealthMonitor(Protocol[T]):
+    """
+    Finds hopeless samples during denoising, e.g., samples with non-finite scores, so that the
+    sampler can remove them from the batch instead of denoising them until the last step.
+    """
+
+    # the monitor is applied every `check_every` denoising steps
+    check_every: int
+
+    def is_healthy(self, x: T, score: T, t: torch.Tensor) -> torch.BoolTensor:
+        """Returns a boolean tensor of shape (batch_size,) that is False for hopeless samples."""
+        raise NotImplementedError
+
+    def select(self, x: T, index: torch.LongTensor) -> T:
+        """Returns the samples of `x` at `index`."""
+        raise NotImplementedError
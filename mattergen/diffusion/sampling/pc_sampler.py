@@ -3,7 +3,7 @@
 
 from __future__ import annotations
 
-from typing import Generic, Mapping, Tuple, TypeVar
+from typing import Callable, Generic, Iterable, Iterator, Mapping, Sequence, Tuple, TypeVar
 
 import torch
 from tqdm.auto import tqdm
@@ -11,15 +11,24 @@ from tqdm.auto import tqdm
 from mattergen.diffusion.corruption.multi_corruption import MultiCorruption, apply
 from mattergen.diffusion.data.batched_data import BatchedData
 from mattergen.diffusion.diffusion_module import DiffusionModule
+from mattergen.diffusion.exceptions import AllSamplesRejected
 from mattergen.diffusion.lightning_module import DiffusionLightningModule
+from mattergen.diffusion.sampling.conditioning_cache import conditioning_cache
+from mattergen.diffusion.sampling.continuous_batching import BatchOperations
+from mattergen.diffusion.sampling.health_monitor import SampleHealthMonitor
 from mattergen.diffusion.sampling.pc_partials import CorrectorPartial, PredictorPartial
+from mattergen.diffusion.sampling.random_streams import SampleRandomStreams, sample_random_streams
+from mattergen.diffusion.sampling.trajectory_recorder import (
+    RecordedTrajectories,
+    TrajectoryRecorder,
+)
 
 Diffusable = TypeVar(
     "Diffusable", bound=BatchedData
 )  # Don't use 'T' because it clashes with the 'T' for time
 SampleAndMean = Tuple[Diffusable, Diffusable]
-SampleAndMeanAndMaybeRecords = Tuple[Diffusable, Diffusable, list[Diffusable] | None]
-SampleAndMeanAndRecords = Tuple[Diffusable, Diffusable, list[Diffusable]]
+SampleAndMeanAndMaybeRecords = Tuple[Diffusable, Diffusable, RecordedTrajectories | None]
+SampleAndMeanAndRecords = Tuple[Diffusable, Diffusable, RecordedTrajectories]
 
 
 class PredictorCorrector(Generic[Diffusable]):
@@ -36,6 +45,8 @@ class PredictorCorrector(Generic[Diffusable]):
         N: int,
         eps_t: float = 1e-3,
         max_t: float | None = None,
+        health_monitor: SampleHealthMonitor | None = None,
+        seed: int | None = None,
     ):
         """
         Args:
@@ -47,6 +58,8 @@ class PredictorCorrector(Generic[Diffusable]):
             N: number of noise levels
             eps_t: diffusion time to stop denoising at
             max_t: diffusion time to start denoising at. If None, defaults to the maximum diffusion time. You may want to start at T-0.01, say, for numerical stability.
+            health_monitor: if given, samples that the monitor finds hopeless are removed from the batch during denoising. The returned batches then only contain the remaining samples.
+            seed: if given, the prior samples and the noise of each sample are drawn from its own random stream, which is selected by the seed and the id of the sample. A sample then does not depend on the other samples in its batch and can be regenerated on its own from its id, see `random_streams`.
         """
         self._diffusion_module = diffusion_module
         self.N = N
@@ -81,6 +94,10 @@ class PredictorCorrector(Generic[Diffusable]):
         self._eps_t = eps_t
         self._n_steps_corrector = n_steps_corrector
         self._device = device
+        self._health_monitor = health_monitor
+        self._seed = seed
+        # id of the first sample of the next batch that is sampled without explicit ids
+        self._next_sample_id = 0
 
     @property
     def diffusion_module(self) -> DiffusionModule:
@@ -97,9 +114,27 @@ class PredictorCorrector(Generic[Diffusable]):
     def from_pl_module(cls, pl_module: DiffusionLightningModule, **kwargs) -> PredictorCorrector:
         return cls(diffusion_module=pl_module.diffusion_module, device=pl_module.device, **kwargs)
 
+    def _random_streams(
+        self, batch_size: int, sample_ids: torch.Tensor | Sequence[int] | None
+    ) -> SampleRandomStreams | None:
+        """Returns the random streams of the samples of a batch, or None if the sampler has no
+        seed. The samples get consecutive ids if `sample_ids` is None."""
+        if self._seed is None:
+            return None
+        if sample_ids is None:
+            sample_ids = torch.arange(self._next_sample_id, self._next_sample_id + batch_size)
+        sample_ids = torch.as_tensor(sample_ids, dtype=torch.long, device=self._device)
+        assert len(sample_ids) == batch_size, "Expected one id per sample."
+        if len(sample_ids) > 0:
+            self._next_sample_id = int(sample_ids.max()) + 1
+        return SampleRandomStreams(self._seed, sample_ids)
+
     @torch.no_grad()
     def sample(
-        self, conditioning_data: BatchedData, mask: Mapping[str, torch.Tensor] | None = None
+        self,
+        conditioning_data: BatchedData,
+        mask: Mapping[str, torch.Tensor] | None = None,
+        sample_ids: torch.Tensor | Sequence[int] | None = None,
     ) -> SampleAndMean:
         """Create one sample for each of a batch of conditions.
         Args:
@@ -107,15 +142,20 @@ class PredictorCorrector(Generic[Diffusable]):
                because the sampler uses these to determine the shapes of things to generate.
             mask: for inpainting. Keys should be a subset of the keys in `data`. 1 indicates data that should be fixed, 0 indicates data that should be replaced with sampled values.
                 Shapes of values in `mask` must match the shapes of values in `conditioning_data`.
+            sample_ids: ids of the samples, which select their random streams if the sampler has a seed. Defaults to the ids following those of the previous batch.
         Returns:
            (batch, mean_batch). The difference between these is that `mean_batch` has no noise added at the final denoising step.
 
         """
-        return self._sample_maybe_record(conditioning_data, mask=mask, record=False)[:2]
+        return self._sample_maybe_record(conditioning_data, mask=mask, sample_ids=sample_ids)[:2]
 
     @torch.no_grad()
     def sample_with_record(
-        self, conditioning_data: BatchedData, mask: Mapping[str, torch.Tensor] | None = None
+        self,
+        conditioning_data: BatchedData,
+        mask: Mapping[str, torch.Tensor] | None = None,
+        recorder: TrajectoryRecorder | None = None,
+        sample_ids: torch.Tensor | Sequence[int] | None = None,
     ) -> SampleAndMeanAndRecords:
         """Create one sample for each of a batch of conditions.
         Args:
@@ -123,18 +163,24 @@ class PredictorCorrector(Generic[Diffusable]):
                because the sampler uses these to determine the shapes of things to generate.
             mask: for inpainting. Keys should be a subset of the keys in `data`. 1 indicates data that should be fixed, 0 indicates data that should be replaced with sampled values.
                 Shapes of values in `mask` must match the shapes of values in `conditioning_data`.
+            recorder: decides which steps and fields are recorded. Defaults to recording the corrupted fields at every predictor and corrector step.
+            sample_ids: ids of the samples, which select their random streams if the sampler has a seed. Defaults to the ids following those of the previous batch.
         Returns:
-           (batch, mean_batch). The difference between these is that `mean_batch` has no noise added at the final denoising step.
+           (batch, mean_batch, recorded_trajectories). The difference between the former two is that `mean_batch` has no noise added at the final denoising step.
 
         """
-        return self._sample_maybe_record(conditioning_data, mask=mask, record=True)
+        recorder = recorder or TrajectoryRecorder()
+        return self._sample_maybe_record(  # type: ignore
+            conditioning_data, mask=mask, recorder=recorder, sample_ids=sample_ids
+        )
 
     @torch.no_grad()
     def _sample_maybe_record(
         self,
         conditioning_data: BatchedData,
         mask: Mapping[str, torch.Tensor] | None = None,
-        record: bool = False,
+        recorder: TrajectoryRecorder | None = None,
+        sample_ids: torch.Tensor | Sequence[int] | None = None,
     ) -> SampleAndMeanAndMaybeRecords:
         """Create one sample for each of a batch of conditions.
         Args:
@@ -142,31 +188,41 @@ class PredictorCorrector(Generic[Diffusable]):
                because the sampler uses these to determine the shapes of things to generate.
             mask: for inpainting. Keys should be a subset of the keys in `data`. 1 indicates data that should be fixed, 0 indicates data that should be replaced with sampled values.
                 Shapes of values in `mask` must match the shapes of values in `conditioning_data`.
+            sample_ids: ids of the samples, which select their random streams if the sampler has a seed.
         Returns:
-           (batch, mean_batch, recorded_samples, recorded_predictions).
+           (batch, mean_batch, recorded_trajectories).
            The difference between the former two is that `mean_batch` has no noise added at the final denoising step.
-           The latter two are only returned if `record` is True, and contain the samples and predictions from each step of the diffusion process.
+           The latter is None unless a `recorder` is given, and contains the intermediate samples of the diffusion process.
 
+        Values that only depend on the conditioning data, e.g., property embeddings and element masks,
+        are computed once and reused in all denoising steps.
         """
         if isinstance(self._diffusion_module, torch.nn.Module):
             self._diffusion_module.eval()
         mask = mask or {}
+        if self._health_monitor is not None and any(v is not None for v in mask.values()):
+            raise ValueError("A health monitor cannot be combined with inpainting masks.")
         conditioning_data = conditioning_data.to(self._device)
         mask = {k: v.to(self._device) for k, v in mask.items()}
-        batch = _sample_prior(self._multi_corruption, conditioning_data, mask=mask)
-        return self._denoise(batch=batch, mask=mask, record=record)
+        streams = self._random_streams(conditioning_data.get_batch_size(), sample_ids)
+        with conditioning_cache():
+            with sample_random_streams(streams):
+                batch = _sample_prior(self._multi_corruption, conditioning_data, mask=mask)
+            return self._denoise(batch=batch, mask=mask, recorder=recorder, streams=streams)
 
     @torch.no_grad()
     def _denoise(
         self,
         batch: Diffusable,
         mask: dict[str, torch.Tensor],
-        record: bool = False,
+        recorder: TrajectoryRecorder | None = None,
+        streams: SampleRandomStreams | None = None,
     ) -> SampleAndMeanAndMaybeRecords:
-        """Denoise from a prior sample to a t=eps_t sample."""
-        recorded_samples = None
-        if record:
-            recorded_samples = []
+        """Denoise from a prior sample to a t=eps_t sample, drawing the noise of the samples from
+        `streams` if given."""
+        # index of each sample of the batch in the initial batch, which changes when samples are
+        # rejected by the health monitor
+        sample_ids = torch.arange(batch.get_batch_size(), device=self._device)
         for k in self._predictors:
             mask.setdefault(k, None)
         for k in self._correctors:
@@ -177,49 +233,294 @@ class PredictorCorrector(Generic[Diffusable]):
         timesteps = torch.linspace(self._max_t, self._eps_t, self.N, device=self._device)
         dt = -torch.tensor((self._max_t - self._eps_t) / (self.N - 1)).to(self._device)
 
+        recorded_steps: set[int] = set()
+        if recorder is not None:
+            recorded_steps = recorder.get_recorded_steps(timesteps)
+            frames_per_step = 1 + (self._n_steps_corrector if self._correctors else 0)
+            recorder.start(
+                batch,
+                fields=self._multi_corruption.corrupted_fields,
+                num_frames=len(recorded_steps) * frames_per_step,
+            )
+
         for i in tqdm(range(self.N), miniters=50, mininterval=5):
             # Set the timestep
             t = torch.full((batch.get_batch_size(),), timesteps[i], device=self._device)
+            record = i in recorded_steps
 
             # Corrector updates.
             if self._correctors:
                 for _ in range(self._n_steps_corrector):
-                    score = self._score_fn(batch, t)
-                    fns = {
-                        k: corrector.step_given_score for k, corrector in self._correctors.items()
-                    }
-                    samples_means: dict[str, Tuple[torch.Tensor, torch.Tensor]] = apply(
-                        fns=fns,
-                        broadcast={"t": t, "dt": dt},
-                        x=batch,
-                        score=score,
-                        batch_idx=self._multi_corruption._get_batch_indices(batch),
-                    )
                     if record:
-                        recorded_samples.append(batch.clone().to("cpu"))
-                    batch, mean_batch = _mask_replace(
-                        samples_means=samples_means, batch=batch, mean_batch=mean_batch, mask=mask
-                    )
+                        recorder.record(batch, t=t, sample_ids=sample_ids)  # type: ignore
+                    with sample_random_streams(streams):
+                        batch, mean_batch = self._corrector_step(
+                            batch, mean_batch, t=t, dt=dt, mask=mask
+                        )
 
             # Predictor updates
             score = self._score_fn(batch, t)
-            predictor_fns = {
-                k: predictor.update_given_score for k, predictor in self._predictors.items()
-            }
-            samples_means = apply(
-                fns=predictor_fns,
-                x=batch,
-                score=score,
-                broadcast=dict(t=t, batch=batch, dt=dt),
-                batch_idx=self._multi_corruption._get_batch_indices(batch),
-            )
+            if self._health_monitor is not None and i % self._health_monitor.check_every == 0:
+                healthy = self._health_monitor.is_healthy(x=batch, score=score, t=t)
+                if not healthy.all():
+                    if not healthy.any():
+                        raise AllSamplesRejected(
+                            f"All samples were rejected by the health monitor at step {i}."
+                        )
+                    keep = healthy.nonzero().squeeze(-1)
+                    batch, mean_batch, score = (
+                        self._health_monitor.select(batch, keep),
+                        self._health_monitor.select(mean_batch, keep),
+                        self._health_monitor.select(score, keep),
+                    )
+                    t = t[keep]
+                    sample_ids = sample_ids[keep]
+                    if streams is not None:
+                        streams = streams.select(keep)
             if record:
-                recorded_samples.append(batch.clone().to("cpu"))
-            batch, mean_batch = _mask_replace(
-                samples_means=samples_means, batch=batch, mean_batch=mean_batch, mask=mask
-            )
+                recorder.record(batch, t=t, sample_ids=sample_ids)  # type: ignore
+            with sample_random_streams(streams):
+                batch, mean_batch = self._predictor_step(
+                    batch, mean_batch, score=score, t=t, dt=dt, mask=mask
+                )
+
+        recorded_trajectories = None
+        if recorder is not None:
+            # only contains the trajectories of the samples that are returned
+            recorded_trajectories = recorder.finish(sample_ids)
+        return batch, mean_batch, recorded_trajectories
+
+    def _corrector_step(
+        self,
+        batch: Diffusable,
+        mean_batch: Diffusable,
+        t: torch.Tensor,
+        dt: torch.Tensor,
+        mask: dict[str, torch.Tensor | None],
+    ) -> SampleAndMean:
+        score = self._score_fn(batch, t)
+        fns = {k: corrector.step_given_score for k, corrector in self._correctors.items()}
+        samples_means: dict[str, Tuple[torch.Tensor, torch.Tensor]] = apply(
+            fns=fns,
+            broadcast={"t": t, "dt": dt},
+            x=batch,
+            score=score,
+            batch_idx=self._multi_corruption._get_batch_indices(batch),
+        )
+        return _mask_replace(
+            samples_means=samples_means, batch=batch, mean_batch=mean_batch, mask=mask
+        )
 
-        return batch, mean_batch, recorded_samples
+    def _predictor_step(
+        self,
+        batch: Diffusable,
+        mean_batch: Diffusable,
+        score: Diffusable,
+        t: torch.Tensor,
+        dt: torch.Tensor,
+        mask: dict[str, torch.Tensor | None],
+    ) -> SampleAndMean:
+        predictor_fns = {
+            k: predictor.update_given_score for k, predictor in self._predictors.items()
+        }
+        samples_means = apply(
+            fns=predictor_fns,
+            x=batch,
+            score=score,
+            broadcast=dict(t=t, batch=batch, dt=dt),
+            batch_idx=self._multi_corruption._get_batch_indices(batch),
+        )
+        return _mask_replace(
+            samples_means=samples_means, batch=batch, mean_batch=mean_batch, mask=mask
+        )
+
+    @torch.no_grad()
+    def sample_continuously(
+        self,
+        conditioning_data: Iterable[Diffusable],
+        batch_operations: BatchOperations[Diffusable],
+        max_batch_size: int,
+        first_sample_id: int | None = None,
+    ) -> Iterator[SampleAndMean]:
+        """Creates one sample for each condition in a stream of conditioning batches, with
+        continuous batching: every sample in the batch has its own denoising step. Samples that
+        reach the last step are yielded and replaced by prior samples of the next conditions, so
+        the size of the batch stays close to `max_batch_size` instead of depending on how the
+        conditions are batched.
+
+        Args:
+            conditioning_data: batches of conditioning data, e.g., from a condition loader.
+                Inpainting masks are not supported.
+            batch_operations: selects and concatenates samples of a batch and returns their sizes.
+            max_batch_size: maximum total size of the samples that are denoised together, in the
+                units of `batch_operations.get_sizes`, e.g., the number of atoms. A sample larger
+                than this is denoised on its own.
+            first_sample_id: id of the sample of the first condition. The samples of the following
+                conditions get consecutive ids, which select their random streams if the sampler
+                has a seed. Defaults to the id following those of the previous batch.
+        Yields:
+            (batch, mean_batch) of the samples that finished denoising in a step.
+
+        The conditioning data change whenever samples are replaced, so values that only depend on
+        the conditioning data are not cached here.
+        """
+        if isinstance(self._diffusion_module, torch.nn.Module):
+            self._diffusion_module.eval()
+        mask: dict[str, torch.Tensor | None] = {k: None for k in self._predictors}
+        mask.update({k: None for k in self._correctors})
+        timesteps = torch.linspace(self._max_t, self._eps_t, self.N, device=self._device)
+        dt = -torch.tensor((self._max_t - self._eps_t) / (self.N - 1)).to(self._device)
+
+        if first_sample_id is not None:
+            self._next_sample_id = first_sample_id
+
+        def sample_prior(x: Diffusable) -> tuple[Diffusable, SampleRandomStreams | None]:
+            streams = self._random_streams(x.get_batch_size(), sample_ids=None)
+            with sample_random_streams(streams):
+                return _sample_prior(self._multi_corruption, x.to(self._device), mask=None), streams
+
+        pool = _SamplePool(
+            conditioning_data=iter(conditioning_data),
+            batch_operations=batch_operations,
+            max_batch_size=max_batch_size,
+            sample_prior=sample_prior,
+        )
+        pool.refill()
+        num_steps = 0
+        while pool.batch is not None:
+            batch, mean_batch, step_idx = pool.batch, pool.mean_batch, pool.step_idx
+            t = timesteps[step_idx]
+            with sample_random_streams(pool.streams):
+                for _ in range(self._n_steps_corrector if self._correctors else 0):
+                    batch, mean_batch = self._corrector_step(
+                        batch, mean_batch, t=t, dt=dt, mask=mask
+                    )
+            score = self._score_fn(batch, t)
+            healthy = None
+            if (
+                self._health_monitor is not None
+                and num_steps % self._health_monitor.check_every == 0
+            ):
+                healthy = self._health_monitor.is_healthy(x=batch, score=score, t=t)
+            with sample_random_streams(pool.streams):
+                batch, mean_batch = self._predictor_step(
+                    batch, mean_batch, score=score, t=t, dt=dt, mask=mask
+                )
+            num_steps += 1
+            pool.batch, pool.mean_batch, pool.step_idx = batch, mean_batch, step_idx + 1
+            if healthy is not None:
+                # drop hopeless samples without yielding them
+                pool.remove(~healthy)
+            if pool.step_idx is not None and (pool.step_idx == self.N).any():
+                yield pool.remove(pool.step_idx == self.N)
+            pool.refill()
+
+
+class _SamplePool(Generic[Diffusable]):
+    """The samples of a continuous batching run with their denoising step indices and random
+    streams."""
+
+    def __init__(
+        self,
+        conditioning_data: Iterator[Diffusable],
+        batch_operations: BatchOperations[Diffusable],
+        max_batch_size: int,
+        sample_prior: Callable[[Diffusable], tuple[Diffusable, SampleRandomStreams | None]],
+    ):
+        self._conditioning_data = conditioning_data
+        self._ops = batch_operations
+        self._max_batch_size = max_batch_size
+        self._sample_prior = sample_prior
+        # prior samples of the current conditioning batch that are not in the pool yet
+        self._waiting: Diffusable | None = None
+        self._waiting_streams: SampleRandomStreams | None = None
+        self.batch: Diffusable | None = None
+        self.mean_batch: Diffusable | None = None
+        self.step_idx: torch.LongTensor | None = None
+        self.streams: SampleRandomStreams | None = None
+
+    @property
+    def size(self) -> int:
+        return 0 if self.batch is None else int(self._ops.get_sizes(self.batch).sum())
+
+    def remove(self, removed: torch.BoolTensor) -> SampleAndMean | None:
+        """Removes samples from the pool and returns them."""
+        if not removed.any():
+            return None
+        assert self.batch is not None and self.mean_batch is not None
+        removed_idx, kept_idx = removed.nonzero().squeeze(-1), (~removed).nonzero().squeeze(-1)
+        out = self._ops.select(self.batch, removed_idx), self._ops.select(
+            self.mean_batch, removed_idx
+        )
+        if len(kept_idx) == 0:
+            self.batch = self.mean_batch = self.step_idx = self.streams = None
+        else:
+            self.batch = self._ops.select(self.batch, kept_idx)
+            self.mean_batch = self._ops.select(self.mean_batch, kept_idx)
+            self.step_idx = self.step_idx[kept_idx]
+            self.streams = _select_streams(self.streams, kept_idx)
+        return out
+
+    def refill(self) -> None:
+        """Adds prior samples of the next conditions until the pool is full."""
+        size = self.size
+        admitted = []
+        admitted_streams = []
+        while True:
+            if self._waiting is None:
+                conditioning_data = next(self._conditioning_data, None)
+                if conditioning_data is None:
+                    break
+                self._waiting, self._waiting_streams = self._sample_prior(conditioning_data)
+            sizes = self._ops.get_sizes(self._waiting)
+            num_admitted = int((size + sizes.cumsum(0) <= self._max_batch_size).sum())
+            if num_admitted == 0 and size == 0:
+                num_admitted = 1
+            if num_admitted == 0:
+                break
+            size += int(sizes[:num_admitted].sum())
+            if num_admitted == len(sizes):
+                admitted.append(self._waiting)
+                admitted_streams.append(self._waiting_streams)
+                self._waiting = self._waiting_streams = None
+            else:
+                index = torch.arange(len(sizes), device=sizes.device)
+                admitted.append(self._ops.select(self._waiting, index[:num_admitted]))
+                admitted_streams.append(
+                    _select_streams(self._waiting_streams, index[:num_admitted])
+                )
+                self._waiting = self._ops.select(self._waiting, index[num_admitted:])
+                self._waiting_streams = _select_streams(self._waiting_streams, index[num_admitted:])
+        if not admitted:
+            return
+        step_idx = torch.zeros(
+            sum(x.get_batch_size() for x in admitted), dtype=torch.long, device=sizes.device
+        )
+        if self.batch is None:
+            self.batch = self._ops.concatenate(admitted)
+            self.mean_batch = self.batch.clone()
+            self.step_idx = step_idx
+            self.streams = _concatenate_streams(admitted_streams)
+        else:
+            new_batch = self._ops.concatenate(admitted)
+            self.batch = self._ops.concatenate([self.batch, new_batch])
+            self.mean_batch = self._ops.concatenate([self.mean_batch, new_batch.clone()])
+            self.step_idx = torch.cat([self.step_idx, step_idx])
+            self.streams = _concatenate_streams([self.streams, *admitted_streams])
+
+
+def _select_streams(
+    streams: SampleRandomStreams | None, index: torch.Tensor
+) -> SampleRandomStreams | None:
+    return None if streams is None else streams.select(index)
+
+
+def _concatenate_streams(
+    streams: list[SampleRandomStreams | None],
+) -> SampleRandomStreams | None:
+    if streams[0] is None:
+        return None
+    return SampleRandomStreams.concatenate(streams)  # type: ignore
 
 
 def _mask_replace(
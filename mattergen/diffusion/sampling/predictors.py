@@ -16,6 +16,7 @@ import torch
 from mattergen.diffusion.corruption.corruption import Corruption
 from mattergen.diffusion.corruption.sde_lib import SDE, ScoreFunction, check_score_fn_defined
 from mattergen.diffusion.data.batched_data import BatchedData
+from mattergen.diffusion.sampling import random_streams
 from mattergen.diffusion.sampling.predictors_correctors import SampleAndMean, Sampler
 from mattergen.diffusion.wrapped.wrapped_sde import WrappedSDEMixin
 
@@ -112,7 +113,7 @@ class AncestralSamplingPredictor(Predictor):
             batch=batch,
         )
         # Sample random noise.
-        z = torch.randn_like(x_coeff)
+        z = random_streams.randn_like(x_coeff, batch_idx)
 
         mean = x_coeff * x + score_coeff * score
         sample = mean + std * z
@@ -22,6 +22,7 @@ from mattergen.diffusion.corruption.sde_lib import (
     ScoreFunction,
 )
 from mattergen.diffusion.exceptions import IncompatibleSampler
+from mattergen.diffusion.sampling import random_streams
 from mattergen.diffusion.wrapped.wrapped_sde import WrappedSDEMixin
 
 SampleAndMean = tuple[torch.Tensor, torch.Tensor]
@@ -96,7 +97,7 @@ class LangevinCorrector(Sampler):
     ) -> SampleAndMean:
         alpha = self.get_alpha(t, dt=dt)
         snr = self.snr
-        noise = torch.randn_like(score)
+        noise = random_streams.randn_like(score, batch_idx)
         grad_norm_square = torch.square(score).reshape(score.shape[0], -1).sum(dim=1)
         noise_norm_square = torch.square(noise).reshape(noise.shape[0], -1).sum(dim=1)
         if batch_idx is None:
@@ -0,0 +1,162 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Per-sample random number streams for reproducible sampling.
+
+By default, the prior samples and the noise of the predictors and correctors are drawn from the
+global torch RNG, so the random numbers of a sample depend on the other samples in its batch.
+While `sample_random_streams` is active, `randn`, `randn_like` and `categorical` instead draw the
+random numbers of each sample from its own counter-based stream: every random number is a hash of
+the seed, the id of the sample, the number of draws the sample made before, and the position of
+the number within the sample. A sample therefore gets the same random numbers regardless of the
+size and composition of its batch, so that it can be regenerated on its own from its id.
+"""
+
+from __future__ import annotations
+
+import math
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Sequence
+
+import torch
+
+# splitmix64 constants as signed 64-bit integers
+_GOLDEN_GAMMA = 0x9E3779B97F4A7C15 - 2**64
+_MIX_1 = 0xBF58476D1CE4E5B9 - 2**64
+_MIX_2 = 0x94D049BB133111EB - 2**64
+
+
+def _shift_right(x: torch.Tensor, n: int) -> torch.Tensor:
+    """Logical right shift of int64 values."""
+    return (x >> n) & ((1 << (64 - n)) - 1)
+
+
+def _splitmix64(x: torch.Tensor) -> torch.Tensor:
+    x = x + _GOLDEN_GAMMA
+    x = (x ^ _shift_right(x, 30)) * _MIX_1
+    x = (x ^ _shift_right(x, 27)) * _MIX_2
+    return x ^ _shift_right(x, 31)
+
+
+class SampleRandomStreams:
+    """Counter-based random number streams of the samples of a batch, see the module docstring."""
+
+    def __init__(
+        self, seed: int, sample_ids: torch.Tensor, num_draws: torch.Tensor | None = None
+    ) -> None:
+        """
+        Args:
+            seed: seed shared by all streams.
+            sample_ids: (batch_size,) id of each sample, which selects its stream.
+            num_draws: (batch_size,) number of draws each sample already made. Defaults to zero.
+        """
+        self.seed = seed
+        self.sample_ids = sample_ids.long()
+        self.num_draws = torch.zeros_like(self.sample_ids) if num_draws is None else num_draws
+
+    def __len__(self) -> int:
+        return len(self.sample_ids)
+
+    def select(self, index: torch.Tensor) -> SampleRandomStreams:
+        return SampleRandomStreams(self.seed, self.sample_ids[index], self.num_draws[index])
+
+    @staticmethod
+    def concatenate(streams: Sequence[SampleRandomStreams]) -> SampleRandomStreams:
+        assert len({s.seed for s in streams}) == 1, "Streams with different seeds."
+        return SampleRandomStreams(
+            streams[0].seed,
+            torch.cat([s.sample_ids for s in streams]),
+            torch.cat([s.num_draws for s in streams]),
+        )
+
+    def _uniform(
+        self, shape: Sequence[int], batch_idx: torch.Tensor | None, num_variates: int
+    ) -> torch.Tensor:
+        """Returns `num_variates` uniform random numbers in (0, 1) for each element of a tensor of
+        shape `shape`, with shape (*shape, num_variates). Row i of the tensor belongs to sample
+        `batch_idx[i]`, or to sample i if `batch_idx` is None. Every sample makes one draw."""
+        device = self.sample_ids.device
+        num_rows = shape[0]
+        row_size = math.prod(shape[1:]) * num_variates
+        if batch_idx is None:
+            assert num_rows == len(self), f"Expected {len(self)} rows, got {num_rows}."
+            sample_idx = torch.arange(num_rows, device=device)
+            row_in_sample = torch.zeros_like(sample_idx)
+        else:
+            # rows of a sample are contiguous, as in a PyG batch
+            sample_idx = batch_idx.to(device)
+            counts = torch.bincount(sample_idx, minlength=len(self))
+            first_row = torch.cumsum(counts, 0) - counts
+            row_in_sample = torch.arange(num_rows, device=device) - first_row[sample_idx]
+        position = row_in_sample[:, None] * row_size + torch.arange(row_size, device=device)
+
+        key = _splitmix64(torch.full_like(self.sample_ids, self.seed) ^ self.sample_ids)
+        key = _splitmix64(key ^ self.num_draws)
+        bits = _splitmix64(key[sample_idx, None] ^ position)
+        self.num_draws = self.num_draws + 1
+
+        # MPS does not support float64
+        dtype = torch.float32 if device.type == "mps" else torch.float64
+        uniform = (_shift_right(bits, 11).to(dtype) + 0.5) * 2.0**-53
+        return uniform.reshape(*shape, num_variates)
+
+    def randn(
+        self,
+        shape: Sequence[int],
+        batch_idx: torch.Tensor | None,
+        dtype: torch.dtype | None = None,
+    ) -> torch.Tensor:
+        """Standard normal random numbers, by the Box-Muller transform."""
+        u = self._uniform(shape, batch_idx, num_variates=2)
+        z = torch.sqrt(-2.0 * torch.log(u[..., 0])) * torch.cos(2.0 * math.pi * u[..., 1])
+        return z.to(dtype or torch.get_default_dtype())
+
+    def categorical(self, logits: torch.Tensor, batch_idx: torch.Tensor | None) -> torch.Tensor:
+        """Samples of the categorical distributions with `logits` along the last dimension, by
+        the Gumbel-max trick."""
+        u = self._uniform(logits.shape, batch_idx, num_variates=1)[..., 0].to(logits.device)
+        gumbel = -torch.log(-torch.log(u))
+        return torch.argmax(logits.to(gumbel.dtype) + gumbel, dim=-1)
+
+
+_active_streams: ContextVar[SampleRandomStreams | None] = ContextVar(
+    "sample_random_streams", default=None
+)
+
+
+@contextmanager
+def sample_random_streams(streams: SampleRandomStreams | None) -> Iterator[None]:
+    """Draws the random numbers of `randn`, `randn_like` and `categorical` from `streams`. Does
+    nothing if `streams` is None."""
+    token = _active_streams.set(streams)
+    try:
+        yield
+    finally:
+        _active_streams.reset(token)
+
+
+def randn(shape: Sequence[int], batch_idx: torch.Tensor | None = None) -> torch.Tensor:
+    """Like `torch.randn(*shape)`. While streams are active, the tensor is on the device of the
+    streams and row i belongs to sample `batch_idx[i]`, or to sample i if `batch_idx` is None."""
+    streams = _active_streams.get()
+    if streams is None:
+        return torch.randn(*shape)
+    return streams.randn(shape, batch_idx)
+
+
+def randn_like(x: torch.Tensor, batch_idx: torch.Tensor | None = None) -> torch.Tensor:
+    """Like `torch.randn_like(x)`, see `randn`."""
+    streams = _active_streams.get()
+    if streams is None:
+        return torch.randn_like(x)
+    return streams.randn(x.shape, batch_idx, dtype=x.dtype).to(x.device)
+
+
+def categorical(logits: torch.Tensor, batch_idx: torch.Tensor | None = None) -> torch.Tensor:
+    """Like `torch.distributions.Categorical(logits=logits).sample()`, see `randn`."""
+    streams = _active_streams.get()
+    if streams is None:
+        return torch.distributions.Categorical(logits=logits).sample()
+    return streams.categorical(logits, batch_idx)
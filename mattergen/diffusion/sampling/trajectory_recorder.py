@@ -0,0 +1,155 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Literal, Sequence
+
+import torch
+
+from mattergen.diffusion.data.batched_data import BatchedData
+
+
+@dataclass
+class RecordedTrajectories:
+    """Intermediate samples of a batch, stored per field as one tensor of shape
+    (num_frames, *shape of the field in the batch)."""
+
+    # values of the recorded fields in each frame
+    fields: dict[str, torch.Tensor]
+    # batch index of the rows of each field, None for fields with one row per sample
+    batch_idx: dict[str, torch.LongTensor | None]
+    # diffusion time of each frame, shape (num_frames,)
+    times: torch.Tensor
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.times)
+
+    def get_sample(self, field_name: str, sample_idx: int) -> torch.Tensor:
+        """Returns the trajectory of one sample for a field, shape (num_frames, ...)."""
+        batch_idx = self.batch_idx[field_name]
+        if batch_idx is None:
+            return self.fields[field_name][:, sample_idx]
+        return self.fields[field_name][:, batch_idx == sample_idx]
+
+
+class TrajectoryRecorder:
+    """
+    Records intermediate samples of a PredictorCorrector sampling run.
+
+    Only every `stride`-th denoising step is recorded or, with spacing="log", about
+    num_steps / stride steps that are log-spaced in diffusion time, such that more frames are
+    recorded close to the data. A recorded step has one frame before each of its corrector and
+    predictor updates. Each recorded field is copied into a
+    preallocated, pinned CPU buffer with non-blocking copies, so recording does not wait for the
+    device.
+    """
+
+    def __init__(
+        self,
+        fields: Sequence[str] | None = None,
+        stride: int = 1,
+        spacing: Literal["linear", "log"] = "linear",
+        dtype: torch.dtype | None = None,
+    ):
+        """
+        Args:
+            fields: names of the fields to record. If None, the sampler records its corrupted fields.
+            stride: record every `stride`-th denoising step, or num_steps / stride log-spaced steps.
+            spacing: "linear" or "log", see above.
+            dtype: dtype to store floating point fields in, e.g., torch.float16. If None, fields
+                are stored in their own dtype.
+        """
+        assert stride >= 1, "stride must be at least 1"
+        assert spacing in ("linear", "log"), f"Unknown spacing {spacing}"
+        self.fields = None if fields is None else list(fields)
+        self.stride = stride
+        self.spacing = spacing
+        self.dtype = dtype
+        self._buffers: dict[str, torch.Tensor] = {}
+        self._sample_ids: torch.Tensor | None = None
+        self._times: torch.Tensor | None = None
+        self._batch_idx: dict[str, torch.LongTensor | None] = {}
+        self._num_frames = 0
+
+    def get_recorded_steps(self, timesteps: torch.Tensor) -> set[int]:
+        """Returns the indices of the denoising steps to record, given the decreasing diffusion
+        times of all steps."""
+        num_steps = len(timesteps)
+        if self.spacing == "linear":
+            return set(range(0, num_steps, self.stride))
+        num_frames = max(num_steps // self.stride, 1)
+        times = torch.logspace(
+            torch.log10(timesteps[-1]), torch.log10(timesteps[0]), num_frames, device="cpu"
+        )
+        steps = torch.searchsorted(-timesteps.cpu(), -times).clamp(max=num_steps - 1)
+        return set(steps.tolist())
+
+    def start(self, batch: BatchedData, fields: Sequence[str], num_frames: int) -> None:
+        """Allocates the buffers for `num_frames` frames of batches like `batch`."""
+        fields = self.fields if self.fields is not None else list(fields)
+        pin_memory = torch.cuda.is_available()
+        self._buffers = {}
+        self._batch_idx = {}
+        for k in fields:
+            value = batch[k]
+            dtype = self.dtype if self.dtype is not None and value.is_floating_point() else None
+            self._buffers[k] = torch.empty(
+                (num_frames, *value.shape),
+                dtype=dtype or value.dtype,
+                pin_memory=pin_memory,
+            )
+            batch_idx = batch.get_batch_idx(k)
+            self._batch_idx[k] = None if batch_idx is None else batch_idx.cpu()
+        self._sample_ids = torch.full(
+            (num_frames, batch.get_batch_size()), -1, dtype=torch.long, pin_memory=pin_memory
+        )
+        self._times = torch.empty(num_frames, pin_memory=pin_memory)
+        self._num_frames = 0
+
+    def record(self, batch: BatchedData, t: torch.Tensor, sample_ids: torch.LongTensor) -> None:
+        """Records a frame. `sample_ids` are the indices of the samples of `batch` in the batch
+        passed to `start`, which changes when samples are removed during sampling."""
+        assert self._sample_ids is not None and self._times is not None, "Call start first."
+        frame = self._num_frames
+        for k, buffer in self._buffers.items():
+            value = batch[k].to(buffer.dtype)
+            buffer[frame, : len(value)].copy_(value, non_blocking=True)
+        self._sample_ids[frame, : len(sample_ids)].copy_(sample_ids, non_blocking=True)
+        self._times[frame].copy_(t[0], non_blocking=True)
+        self._num_frames += 1
+
+    def finish(self, sample_ids: torch.LongTensor) -> RecordedTrajectories:
+        """Returns the recorded trajectories of the samples with the given `sample_ids`, in order."""
+        assert self._sample_ids is not None and self._times is not None, "Call start first."
+        if torch.cuda.is_available():
+            # wait for the non-blocking copies
+            torch.cuda.synchronize()
+        num_frames = self._num_frames
+        fields = {k: v[:num_frames] for k, v in self._buffers.items()}
+        batch_idx = dict(self._batch_idx)
+        recorded_ids = self._sample_ids[:num_frames]
+        sample_ids = sample_ids.cpu()
+        batch_size = recorded_ids.shape[1]
+        if len(sample_ids) < batch_size:
+            # Samples were removed during sampling. The rows of a frame are the rows of the
+            # samples that were still in the batch, in order, so map them back to the initial
+            # batch and keep the rows of the samples that are returned.
+            for k in fields:
+                row_sample_idx = torch.arange(batch_size) if batch_idx[k] is None else batch_idx[k]
+                kept = torch.isin(row_sample_idx, sample_ids)
+                rows = []
+                for frame in range(num_frames):
+                    present = torch.isin(row_sample_idx, recorded_ids[frame])
+                    # position of each present row in the recorded frame
+                    position = torch.cumsum(present, 0) - 1
+                    rows.append(fields[k][frame, position[kept]])
+                fields[k] = torch.stack(rows)
+                if batch_idx[k] is not None:
+                    # relabel to the indices of the returned samples
+                    batch_idx[k] = torch.searchsorted(sample_ids, batch_idx[k][kept])
+        return RecordedTrajectories(
+            fields=fields, batch_idx=batch_idx, times=self._times[:num_frames]
+        )
@@ -0,0 +1,117 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import torch
+
+from mattergen.diffusion.corruption.multi_corruption import MultiCorruption
+from mattergen.diffusion.corruption.sde_lib import VPSDE
+from mattergen.diffusion.data.batched_data import SimpleBatchedData
+from mattergen.diffusion.sampling.health_monitor import SampleHealthMonitor
+from mattergen.diffusion.sampling.pc_sampler import PredictorCorrector
+from mattergen.diffusion.sampling.predictors import AncestralSamplingPredictor
+from mattergen.diffusion.tests.test_reverse_sampling import get_diffusion_module
+
+FIELDS = ["x", "y"]
+
+
+class DenseBatchOperations:
+    """Batch operations for SimpleBatchedData with only dense fields, where each sample has the
+    size given by its field `size`."""
+
+    def select(self, x: SimpleBatchedData, index: torch.LongTensor) -> SimpleBatchedData:
+        return x.replace(**{k: v[index] for k, v in x.data.items()})
+
+    def concatenate(self, xs: list[SimpleBatchedData]) -> SimpleBatchedData:
+        return xs[0].replace(**{k: torch.cat([x[k] for x in xs]) for k in xs[0].data})
+
+    def get_sizes(self, x: SimpleBatchedData) -> torch.LongTensor:
+        return x["size"]
+
+
+def get_conditioning_data(ids: torch.LongTensor, sizes: torch.LongTensor) -> SimpleBatchedData:
+    return SimpleBatchedData(
+        data={"id": ids, "size": sizes, **{k: torch.zeros(len(ids), 1) for k in FIELDS}},
+        batch_idx={k: None for k in ["id", "size", *FIELDS]},
+    )
+
+
+def get_sampler(
+    N: int,
+    x0_mean: torch.Tensor,
+    x0_std: torch.Tensor,
+    health_monitor: SampleHealthMonitor | None = None,
+    seed: int | None = None,
+) -> PredictorCorrector:
+    multi_corruption = MultiCorruption(sdes={k: VPSDE() for k in FIELDS})
+    return PredictorCorrector(
+        diffusion_module=get_diffusion_module(
+            x0_mean=x0_mean, x0_std=x0_std, multi_corruption=multi_corruption
+        ),
+        device=torch.device("cpu"),
+        predictor_partials={k: AncestralSamplingPredictor for k in FIELDS},  # type: ignore
+        corrector_partials={},
+        n_steps_corrector=1,
+        N=N,
+        health_monitor=health_monitor,
+        seed=seed,
+    )
+
+
+def test_every_condition_is_sampled_once():
+    N = 5
+    sampler = get_sampler(N=N, x0_mean=torch.tensor(0.0), x0_std=torch.tensor(1.0))
+    sizes = torch.tensor([2, 1, 3, 1, 1, 4, 2])
+    conditioning_data = [
+        get_conditioning_data(ids=torch.arange(3), sizes=sizes[:3]),
+        get_conditioning_data(ids=torch.arange(3, 7), sizes=sizes[3:]),
+    ]
+    batch_sizes = []
+
+    def count_steps(x, t):
+        # every step denoises at most 4 units
+        assert x["size"].sum() <= 4
+        batch_sizes.append(x.get_batch_size())
+        return score_fn(x, t)
+
+    score_fn = sampler._score_fn
+    sampler._score_fn = count_steps  # type: ignore
+
+    finished = list(
+        sampler.sample_continuously(
+            conditioning_data=conditioning_data,
+            batch_operations=DenseBatchOperations(),
+            max_batch_size=4,
+        )
+    )
+
+    ids = torch.cat([mean["id"] for _, mean in finished])
+    assert sorted(ids.tolist()) == list(range(7))
+    assert all(torch.isfinite(sample[k]).all() for sample, _ in finished for k in FIELDS)
+    # every sample is denoised in exactly N steps
+    assert sum(batch_sizes) == N * 7
+    # the pools are [0, 1], [2, 3], [4], [5] and [6], since 4 and 5 do not fit together
+    assert len(batch_sizes) == 5 * N
+
+
+def test_continuous_batching_moments():
+    x0_mean, x0_std = torch.tensor(-2.0), torch.tensor(2.3)
+    sampler = get_sampler(N=200, x0_mean=x0_mean, x0_std=x0_std)
+    conditioning_data = [
+        get_conditioning_data(ids=torch.arange(i, i + 2000), sizes=torch.randint(1, 4, (2000,)))
+        for i in range(0, 10_000, 2000)
+    ]
+
+    samples = torch.cat(
+        [
+            torch.cat([sample[k] for k in FIELDS])
+            for sample, _ in sampler.sample_continuously(
+                conditioning_data=conditioning_data,
+                batch_operations=DenseBatchOperations(),
+                max_batch_size=5000,
+            )
+        ]
+    )
+
+    assert len(samples) == 10_000 * len(FIELDS)
+    assert torch.isclose(samples.mean(), x0_mean, atol=1e-1)
+    assert torch.isclose(samples.std(), x0_std, atol=1e-1)
@@ -0,0 +1,82 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import pytest
+import torch
+
+from mattergen.diffusion.corruption.multi_corruption import MultiCorruption
+from mattergen.diffusion.corruption.sde_lib import VPSDE
+from mattergen.diffusion.data.batched_data import SimpleBatchedData
+from mattergen.diffusion.exceptions import AllSamplesRejected
+from mattergen.diffusion.sampling.pc_sampler import PredictorCorrector
+from mattergen.diffusion.sampling.predictors import AncestralSamplingPredictor
+from mattergen.diffusion.tests.test_reverse_sampling import (
+    _get_conditioning_data,
+    get_diffusion_module,
+)
+
+FIELDS = ["x", "y"]
+
+
+class RejectFirstSamples:
+    """Rejects the first `num_rejected` samples of the batch at the first check."""
+
+    def __init__(self, num_rejected: int, check_every: int = 3):
+        self.num_rejected = num_rejected
+        self.check_every = check_every
+        self.num_checks = 0
+
+    def is_healthy(self, x: SimpleBatchedData, score, t: torch.Tensor) -> torch.BoolTensor:
+        healthy = torch.ones(x.get_batch_size(), dtype=torch.bool)
+        if self.num_checks == 0:
+            healthy[: self.num_rejected] = False
+        self.num_checks += 1
+        return healthy
+
+    def select(self, x: SimpleBatchedData, index: torch.LongTensor) -> SimpleBatchedData:
+        return x.replace(**{k: x[k][index] for k in FIELDS})
+
+
+def get_sampler(health_monitor: RejectFirstSamples) -> PredictorCorrector:
+    multi_corruption = MultiCorruption(sdes={k: VPSDE() for k in FIELDS})
+    return PredictorCorrector(
+        diffusion_module=get_diffusion_module(
+            x0_mean=torch.tensor(1.0), x0_std=torch.tensor(0.5), multi_corruption=multi_corruption
+        ),
+        device=torch.device("cpu"),
+        predictor_partials={k: AncestralSamplingPredictor for k in FIELDS},  # type: ignore
+        corrector_partials={},
+        n_steps_corrector=1,
+        N=10,
+        health_monitor=health_monitor,
+    )
+
+
+def test_rejected_samples_are_removed():
+    health_monitor = RejectFirstSamples(num_rejected=2)
+    sampler = get_sampler(health_monitor)
+    conditioning_data = _get_conditioning_data(batch_size=5, fields=FIELDS)
+
+    sample, mean, records = sampler.sample_with_record(conditioning_data)
+
+    # checks at steps 0, 3, 6 and 9
+    assert health_monitor.num_checks == 4
+    assert sample.get_batch_size() == mean.get_batch_size() == 3
+    assert records.num_frames == sampler.N
+    # the records only contain the trajectories of the returned samples
+    for k in FIELDS:
+        assert records.fields[k].shape == (sampler.N, 3, 1)
+    assert all(torch.isfinite(sample[k]).all() for k in FIELDS)
+
+
+def test_all_samples_rejected():
+    sampler = get_sampler(RejectFirstSamples(num_rejected=5))
+    with pytest.raises(AllSamplesRejected):
+        sampler.sample(_get_conditioning_data(batch_size=5, fields=FIELDS))
+
+
+def test_health_monitor_with_mask_is_rejected():
+    sampler = get_sampler(RejectFirstSamples(num_rejected=0))
+    conditioning_data = _get_conditioning_data(batch_size=5, fields=FIELDS)
+    with pytest.raises(ValueError):
+        sampler.sample(conditioning_data, mask={"x": torch.ones(5, 1)})
@@ -0,0 +1,120 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import torch
+
+from mattergen.diffusion.sampling import random_streams
+from mattergen.diffusion.sampling.random_streams import SampleRandomStreams, sample_random_streams
+from mattergen.diffusion.tests.test_continuous_batching import (
+    FIELDS,
+    DenseBatchOperations,
+    get_conditioning_data,
+    get_sampler,
+)
+from mattergen.diffusion.tests.test_health_monitor import RejectFirstSamples
+
+
+class RejectFirstDenseSamples(RejectFirstSamples):
+    def select(self, x, index):
+        return DenseBatchOperations().select(x, index)
+
+
+def test_stream_statistics():
+    streams = SampleRandomStreams(seed=0, sample_ids=torch.arange(1000))
+    z = streams.randn((1000, 100), batch_idx=None)
+    assert torch.isclose(z.mean(), torch.tensor(0.0), atol=1e-2)
+    assert torch.isclose(z.std(), torch.tensor(1.0), atol=1e-2)
+    # every draw gives new random numbers
+    assert not torch.isclose(z, streams.randn((1000, 100), batch_idx=None)).any()
+
+    probs = torch.tensor([0.1, 0.2, 0.7])
+    classes = streams.categorical(probs.log().expand(1000, 100, 3), batch_idx=None)
+    frequencies = torch.bincount(classes.flatten(), minlength=3) / classes.numel()
+    assert torch.allclose(frequencies, probs, atol=1e-2)
+
+
+def test_streams_do_not_depend_on_batch():
+    batch_idx = torch.tensor([0, 0, 1, 2, 2, 2])
+    streams = SampleRandomStreams(seed=3, sample_ids=torch.tensor([5, 8, 13]))
+    streams.randn((6, 3), batch_idx)
+    batched = streams.randn((6, 3), batch_idx)
+
+    # sample 13 on its own, after the same number of draws
+    alone = SampleRandomStreams(seed=3, sample_ids=torch.tensor([13]))
+    alone_batch_idx = torch.zeros(3, dtype=torch.long)
+    alone.randn((3, 3), alone_batch_idx)
+    torch.testing.assert_close(alone.randn((3, 3), alone_batch_idx), batched[3:], rtol=0, atol=0)
+
+    # a selected stream continues where it stopped
+    torch.testing.assert_close(
+        streams.select(torch.tensor([1])).randn((1, 3), None),
+        SampleRandomStreams(3, torch.tensor([8]), torch.tensor([2])).randn((1, 3), None),
+        rtol=0,
+        atol=0,
+    )
+    assert not torch.equal(
+        batched, SampleRandomStreams(4, torch.tensor([5, 8, 13])).randn((6, 3), batch_idx)
+    )
+
+
+def test_global_rng_without_streams():
+    torch.manual_seed(0)
+    expected = torch.randn(4, 3)
+    torch.manual_seed(0)
+    torch.testing.assert_close(random_streams.randn((4, 3)), expected)
+
+    with sample_random_streams(SampleRandomStreams(0, torch.arange(4))):
+        with_streams = random_streams.randn((4, 3))
+    assert not torch.equal(with_streams, expected)
+
+
+def _sample(sampler, ids: torch.Tensor, sizes: torch.Tensor) -> dict[str, torch.Tensor]:
+    _, mean = sampler.sample(get_conditioning_data(ids=ids, sizes=sizes), sample_ids=ids)
+    return {k: mean[k] for k in ["id", *FIELDS]}
+
+
+def test_sample_can_be_regenerated_alone():
+    sampler = get_sampler(N=20, x0_mean=torch.tensor(-1.0), x0_std=torch.tensor(0.5), seed=7)
+    ids, sizes = torch.arange(6), torch.ones(6, dtype=torch.long)
+    batched = _sample(sampler, ids, sizes)
+
+    alone = _sample(sampler, ids[4:5], sizes[4:5])
+    for k in FIELDS:
+        torch.testing.assert_close(alone[k], batched[k][4:5], rtol=0, atol=0)
+
+    # samples that are kept by the health monitor are the same as without the monitor
+    sampler = get_sampler(
+        N=20,
+        x0_mean=torch.tensor(-1.0),
+        x0_std=torch.tensor(0.5),
+        health_monitor=RejectFirstDenseSamples(num_rejected=2),
+        seed=7,
+    )
+    monitored = _sample(sampler, ids, sizes)
+    assert monitored["id"].tolist() == [2, 3, 4, 5]
+    for k in FIELDS:
+        torch.testing.assert_close(monitored[k], batched[k][2:], rtol=0, atol=0)
+
+
+def test_continuous_batching_matches_sample():
+    sampler = get_sampler(N=20, x0_mean=torch.tensor(-1.0), x0_std=torch.tensor(0.5), seed=7)
+    sizes = torch.tensor([2, 1, 3, 1, 1, 4, 2])
+    expected = _sample(sampler, torch.arange(7), sizes)
+
+    finished = list(
+        sampler.sample_continuously(
+            conditioning_data=[
+                get_conditioning_data(ids=torch.arange(3), sizes=sizes[:3]),
+                get_conditioning_data(ids=torch.arange(3, 7), sizes=sizes[3:]),
+            ],
+            batch_operations=DenseBatchOperations(),
+            max_batch_size=4,
+            first_sample_id=0,
+        )
+    )
+
+    ids = torch.cat([mean["id"] for _, mean in finished])
+    order = torch.argsort(ids)
+    for k in FIELDS:
+        samples = torch.cat([mean[k] for _, mean in finished])[order]
+        torch.testing.assert_close(samples, expected[k], rtol=0, atol=0)
@@ -0,0 +1,50 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import torch
+
+from mattergen.diffusion.data.batched_data import SimpleBatchedData
+from mattergen.diffusion.sampling.trajectory_recorder import TrajectoryRecorder
+
+
+def get_batch(node_values: torch.Tensor, batch_idx: torch.LongTensor) -> SimpleBatchedData:
+    num_samples = int(batch_idx.max()) + 1
+    return SimpleBatchedData(
+        data={"node": node_values, "dense": torch.arange(num_samples, dtype=torch.float)[:, None]},
+        batch_idx={"node": batch_idx, "dense": None},
+    )
+
+
+def test_recorded_steps():
+    timesteps = torch.linspace(1.0, 1e-3, 1000)
+    assert TrajectoryRecorder().get_recorded_steps(timesteps) == set(range(1000))
+    assert TrajectoryRecorder(stride=100).get_recorded_steps(timesteps) == set(range(0, 1000, 100))
+
+    log_steps = sorted(TrajectoryRecorder(stride=100, spacing="log").get_recorded_steps(timesteps))
+    assert log_steps[0] == 0 and log_steps[-1] == 999
+    # log-spaced steps are denser towards the end of denoising
+    assert len([s for s in log_steps if s >= 900]) > len([s for s in log_steps if s < 500])
+
+
+def test_record_with_removed_samples():
+    batch_idx = torch.tensor([0, 0, 1, 2, 2, 2])
+    batch = get_batch(torch.arange(6, dtype=torch.float), batch_idx)
+    recorder = TrajectoryRecorder(fields=["node", "dense"], dtype=torch.float16)
+    recorder.start(batch, fields=[], num_frames=2)
+
+    recorder.record(batch, t=torch.ones(3), sample_ids=torch.arange(3))
+    # sample 1 is removed
+    smaller_batch = get_batch(
+        torch.tensor([10.0, 11.0, 13.0, 14.0, 15.0]), batch_idx[[0, 1, 3, 4, 5]]
+    )
+    smaller_batch = smaller_batch.replace(dense=torch.tensor([[0.0], [2.0]]))
+    recorder.record(smaller_batch, t=torch.full((2,), 0.5), sample_ids=torch.tensor([0, 2]))
+    recorded = recorder.finish(sample_ids=torch.tensor([0, 2]))
+
+    assert recorded.num_frames == 2
+    torch.testing.assert_close(recorded.times, torch.tensor([1.0, 0.5]))
+    assert recorded.fields["node"].dtype == torch.float16
+    assert recorded.fields["node"].tolist() == [[0, 1, 3, 4, 5], [10, 11, 13, 14, 15]]
+    assert recorded.batch_idx["node"].tolist() == [0, 0, 1, 1, 1]
+    assert recorded.fields["dense"].tolist() == [[[0.0], [2.0]], [[0.0], [2.0]]]
+    assert recorded.get_sample("node", 1).tolist() == [[3, 4, 5], [13, 14, 15]]
@@ -1,11 +1,21 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import json
+from contextlib import nullcontext
+
+import numpy as np
+from ase.io import write
 from pymatgen.core.structure import Structure
+from pymatgen.io.ase import AseAtomsAdaptor
 
 from mattergen.common.utils.globals import get_device
 from mattergen.evaluation.metrics.evaluator import MetricsEvaluator
 from mattergen.evaluation.reference.reference_dataset import ReferenceDataset
+from mattergen.evaluation.utils import profiling
+from mattergen.evaluation.utils.evaluation_cache import EvaluationCache, get_structure_fingerprint
+from mattergen.evaluation.utils.logging import logger
+from mattergen.evaluation.utils.profiling import EvaluationProfiler, get_profile_path
 from mattergen.evaluation.utils.relaxation import relax_structures
 from mattergen.evaluation.utils.structure_matcher import (
     DefaultDisorderedStructureMatcher,
@@ -26,6 +36,9 @@ def evaluate(
     potential_load_path: str | None = None,
     device: str = str(get_device()),
     structures_output_path: str | None = None,
+    cache_path: str | None = None,
+    num_workers: int = 1,
+    profile: bool = False,
 ) -> dict[str, float | int]:
     """Evaluate the structures against a reference dataset.
 
@@ -39,27 +52,117 @@ def evaluate(
         potential_load_path: Path to the Machine Learning potential to use for relaxation.
         device: Device to use for relaxation.
         structures_output_path: Path to save the relaxed structures.
+        cache_path: Path to an evaluation cache. If given, relaxations and per-structure results
+            of previous evaluations stored in the cache are reused, and the results of this
+            evaluation are added to the cache. This is useful when evaluating a growing set of
+            structures, e.g., when appending new batches of generated structures.
+        num_workers: Number of processes used to compute the energy corrections.
+        profile: Whether to write a profiling report with the wall time of each stage, metric and
+            underlying computation, StructureMatcher and PhaseDiagram calls, LMDB reads and cache
+            hit rates. It is saved next to `save_as` (e.g., `metrics_profile.json` for
+            `metrics.json`), or printed if `save_as` is None.
 
     Returns:
         metrics: a dictionary of metrics and their values.
     """
     if relax and energies is not None:
         raise ValueError("Cannot accept energies if relax is True.")
-    if relax:
-        relaxed_structures, energies = relax_structures(
-            structures, device=device, potential_load_path=potential_load_path, output_path=structures_output_path
+    cache = None
+    if cache_path is not None:
+        cache = EvaluationCache(
+            cache_path,
+            config={
+                "reference": reference.name if reference is not None else None,
+                "structure_matcher": structure_matcher.name,
+                "relax": relax,
+                "potential_load_path": potential_load_path,
+            },
         )
-    else:
-        relaxed_structures = structures
-    evaluator = MetricsEvaluator.from_structures_and_energies(
-        structures=relaxed_structures,
-        energies=energies,
-        original_structures=structures,
-        reference=reference,
-        structure_matcher=structure_matcher,
-    )
-    return evaluator.compute_metrics(
-        metrics=evaluator.available_metrics,
-        save_as=save_as,
-        pretty_print=True,
+    with EvaluationProfiler() if profile else nullcontext() as profiler:
+        with profiling.section("relaxation"):
+            if relax and cache is not None:
+                relaxed_structures, energies = relax_structures_with_cache(
+                    structures,
+                    cache=cache,
+                    device=device,
+                    potential_load_path=potential_load_path,
+                    output_path=structures_output_path,
+                )
+            elif relax:
+                relaxed_structures, energies = relax_structures(
+                    structures,
+                    device=device,
+                    potential_load_path=potential_load_path,
+                    output_path=structures_output_path,
+                )
+            else:
+                relaxed_structures = structures
+        with profiling.section("setup"):
+            evaluator = MetricsEvaluator.from_structures_and_energies(
+                structures=relaxed_structures,
+                energies=energies,
+                original_structures=structures,
+                reference=reference,
+                structure_matcher=structure_matcher,
+                cache=cache,
+                num_workers=num_workers,
+            )
+        with profiling.section("metrics"):
+            metrics = evaluator.compute_metrics(
+                metrics=evaluator.available_metrics,
+                save_as=save_as,
+                pretty_print=True,
+            )
+        if cache is not None:
+            with profiling.section("cache_update"):
+                evaluator.update_cache()
+    if profiler is not None:
+        if save_as is not None:
+            profiler.save(get_profile_path(save_as))
+        else:
+            print(json.dumps(profiler.as_dict(), indent=2))
+    return metrics
+
+
+def relax_structures_with_cache(
+    structures: list[Structure],
+    cache: EvaluationCache,
+    output_path: str | None = None,
+    **kwargs,
+) -> tuple[list[Structure], np.ndarray]:
+    """Relaxes only the structures whose relaxation is not stored in the cache yet.
+
+    Args:
+        structures: List of structures to relax.
+        cache: Evaluation cache holding previous relaxations. New relaxations are added to it.
+        output_path: Path to save all relaxed structures as an extxyz file.
+        kwargs: Passed to `relax_structures`.
+
+    Returns:
+        relaxed structures and their total energies.
+    """
+    fingerprints = [get_structure_fingerprint(s) for s in structures]
+    relaxations = cache.load_relaxations(fingerprints)
+    to_relax = [i for i, r in enumerate(relaxations) if r is None]
+    profiling.count("relaxation_cache.hits", len(structures) - len(to_relax))
+    profiling.count("relaxation_cache.misses", len(to_relax))
+    logger.info(
+        f"Reusing {len(structures) - len(to_relax)} cached relaxations, "
+        f"relaxing {len(to_relax)} structures."
     )
+    if len(to_relax) > 0:
+        relaxed_structures, energies = relax_structures([structures[i] for i in to_relax], **kwargs)
+        new_relaxations = {
+            fingerprints[i]: (s, e) for i, s, e in zip(to_relax, relaxed_structures, energies)
+        }
+        cache.save_relaxations(new_relaxations)
+        for i in to_relax:
+            relaxations[i] = new_relaxations[fingerprints[i]]
+    relaxed_structures = [r[0] for r in relaxations]
+    energies = np.array([r[1] for r in relaxations])
+    if output_path:
+        relaxed_atoms = [AseAtomsAdaptor.get_atoms(s) for s in relaxed_structures]
+        for atoms, energy in zip(relaxed_atoms, energies):
+            atoms.info["total_energy"] = energy
+        write(output_path, relaxed_atoms, format="extxyz")
+    return relaxed_structures, energies
@@ -3,12 +3,14 @@
 
 from dataclasses import dataclass
 from functools import cached_property, lru_cache
+from itertools import combinations
 from typing import Literal
 
 import numpy as np
 import numpy.typing
 from pandas import DataFrame
 from pymatgen.analysis.phase_diagram import PhaseDiagram
+from pymatgen.entries.computed_entries import ComputedStructureEntry
 from tqdm import tqdm
 
 from mattergen.evaluation.metrics.core import BaseAggregateMetric, BaseMetric, BaseMetricsCapability
@@ -17,7 +19,6 @@ from mattergen.evaluation.reference.reference_dataset import ReferenceDataset
 from mattergen.evaluation.utils.globals import DEFAULT_STABILITY_THRESHOLD
 from mattergen.evaluation.utils.logging import logger
 from mattergen.evaluation.utils.metrics_structure_summary import MetricsStructureSummary
-from mattergen.evaluation.utils.utils import expand_into_subsystems
 
 # -----------------------------#
 # Capabilities
@@ -162,6 +163,11 @@ class EnergyMetricsCapability(BaseMetricsCapability):
             )
         return result
 
+    @cached_property
+    def rmsd_from_relaxation(self) -> numpy.typing.NDArray:
+        """Returns the RMSD (Angstrom) between the original and the relaxed structures."""
+        return np.array([s.rmsd_from_relaxation for s in self._structure_summaries])
+
     def as_dataframe(self) -> DataFrame:
         return DataFrame(
             data={
@@ -175,18 +181,49 @@ class EnergyMetricsCapability(BaseMetricsCapability):
     # Helper functions shared by multiple metrics  #
     # ---------------------------------------------#
 
-    def _get_phase_diagram(self, chemical_system: str) -> PhaseDiagram:
-        """Returns the phase diagram for a given chemical system."""
-        subsys = expand_into_subsystems(chemical_system)
-        reference_entries = [
+    def _get_reference_entries(self, chemical_system: str) -> list[ComputedStructureEntry]:
+        """Returns the reference entries that belong exactly to a chemical system."""
+        return [
             entry
-            for s in subsys
-            for key in ["-".join(sorted(s))]
-            for entry in self.reference_dataset.entries_by_chemsys.get(key, [])
+            for entry in self.reference_dataset.entries_by_chemsys.get(chemical_system, [])
             if not np.isnan(
                 entry.energy
             )  # skip disordered structures, which have nan energy currently
         ]
+
+    def _get_subsystem_hull_entries(self, chemical_system: str) -> list[ComputedStructureEntry]:
+        """Returns the stable reference entries of all strict subsystems of a chemical system.
+
+        These span the boundary of the composition space of the chemical system. All other
+        reference entries of the subsystems lie above the hull there, so they cannot change the
+        convex hull of the chemical system and can be left out when building its phase diagram.
+        """
+        elements = chemical_system.split("-")
+        if len(elements) == 1:
+            return []
+        entries: dict[int, ComputedStructureEntry] = {}
+        for subsystem in combinations(elements, len(elements) - 1):
+            for entry in self._get_reference_hull_entries("-".join(sorted(subsystem))):
+                entries.setdefault(id(entry), entry)
+        return list(entries.values())
+
+    @lru_cache
+    def _get_reference_hull_entries(
+        self, chemical_system: str
+    ) -> tuple[ComputedStructureEntry, ...]:
+        """Returns the stable entries of the reference phase diagram of a chemical system."""
+        phase_diagram = self._get_phase_diagram(chemical_system)
+        stable_entries = {id(entry) for entry in phase_diagram.stable_entries}
+        return tuple(entry for entry in phase_diagram.all_entries if id(entry) in stable_entries)
+
+    @lru_cache
+    def _get_phase_diagram(self, chemical_system: str) -> PhaseDiagram:
+        """Returns the phase diagram for a given chemical system.
+        The hull of each subsystem is built only once and reused by all chemical systems
+        containing it."""
+        reference_entries = self._get_subsystem_hull_entries(
+            chemical_system
+        ) + self._get_reference_entries(chemical_system)
         assert len(reference_entries) > 0, f"No reference data for {chemical_system}."
         return PhaseDiagram(reference_entries)
 
@@ -208,17 +245,7 @@ class EnergyMetricsCapability(BaseMetricsCapability):
         """Returns the internal phase diagram for a given chemical system.
         This is comprised of all reference entries that do not exactly match the chemical system, and
         of all entries belonging to the chemical system."""
-        subsys = expand_into_subsystems(chemical_system)
-        reference_entries = [
-            entry
-            for s in subsys
-            for key in ["-".join(sorted(s))]
-            for entry in self.reference_dataset.entries_by_chemsys.get(key, [])
-            if key != chemical_system  # Do not get reference entries for the chemical system itself
-            and not np.isnan(
-                entry.energy
-            )  # skip disordered structures, which have nan energy currently
-        ]
+        reference_entries = self._get_subsystem_hull_entries(chemical_system)
         reference_entries += self.dataset.entries_by_chemsys.get(chemical_system, [])
         assert len(reference_entries) > 0, f"No data for {chemical_system}."
         return PhaseDiagram(reference_entries)
@@ -227,16 +254,7 @@ class EnergyMetricsCapability(BaseMetricsCapability):
         """Returns the total phase diagram for a given chemical system.
         This is comprised of all reference entries  and
         of all entries belonging to the chemical system."""
-        subsys = expand_into_subsystems(chemical_system)
-        reference_entries = [
-            entry
-            for s in subsys
-            for key in ["-".join(sorted(s))]
-            for entry in self.reference_dataset.entries_by_chemsys.get(key, [])
-            if not np.isnan(
-                entry.energy
-            )  # skip disordered structures, which have nan energy currently
-        ]
+        reference_entries = list(self._get_reference_hull_entries(chemical_system))
         reference_entries += self.dataset.entries_by_chemsys.get(chemical_system, [])
         assert len(reference_entries) > 0, f"No data for {chemical_system}."
         return PhaseDiagram(reference_entries)
@@ -303,7 +321,7 @@ class AvgRMSDFromRelaxation(BaseEnergyMetric, BaseAggregateMetric):
         return "root mean square displacements of atoms (Angstrom) from initial to final DFT relaxation steps in sampled data."
 
     def compute_pre_aggregation_values(self) -> numpy.typing.NDArray:
-        return np.array([d.rmsd_from_relaxation for d in self.energy_capability._structure_summaries])
+        return self.energy_capability.rmsd_from_relaxation
 
 
 class AvgEnergyAboveHullPerAtom(BaseEnergyMetric, BaseAggregateMetric):
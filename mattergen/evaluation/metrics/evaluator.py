@@ -22,10 +22,21 @@ import mattergen.evaluation.metrics.property as property_metrics
 import mattergen.evaluation.metrics.structure as structure_metrics
 from mattergen.evaluation.metrics.core import BaseAggregateMetric, BaseMetric, BaseMetricsCapability
 from mattergen.evaluation.metrics.energy import EnergyMetricsCapability, MissingTerminalsError
+from mattergen.evaluation.metrics.incremental import (
+    IncrementalEnergyMetricsCapability,
+    IncrementalStructureMetricsCapability,
+    get_evaluation_results,
+)
 from mattergen.evaluation.metrics.property import PropertyMetricsCapability
 from mattergen.evaluation.metrics.structure import StructureMetricsCapability
 from mattergen.evaluation.reference.presets import ReferenceMP2020Correction
 from mattergen.evaluation.reference.reference_dataset import ReferenceDataset
+from mattergen.evaluation.utils import profiling
+from mattergen.evaluation.utils.evaluation_cache import (
+    CachedEvaluationResults,
+    EvaluationCache,
+    get_structure_fingerprint,
+)
 from mattergen.evaluation.utils.globals import DEFAULT_STABILITY_THRESHOLD
 from mattergen.evaluation.utils.logging import logger
 from mattergen.evaluation.utils.metrics_structure_summary import (
@@ -54,9 +65,14 @@ class MetricsEvaluator:
     This class is used to evaluate a set of metrics on a set of structures.
     """
 
-    def __init__(self, capabilities: Sequence[BaseMetricsCapability]):
+    def __init__(
+        self,
+        capabilities: Sequence[BaseMetricsCapability],
+        cache: EvaluationCache | None = None,
+    ):
         assert len(capabilities) > 0, "At least one capability is required."
         self.capabilities = capabilities
+        self.cache = cache  # if set, results are written to the cache by update_cache()
 
         self._metrics: dict[
             Type[BaseMetric], BaseMetric
@@ -100,28 +116,53 @@ class MetricsEvaluator:
         | DisorderedStructureMatcher = DefaultDisorderedStructureMatcher(),
         energy_correction_scheme: Compatibility = MaterialsProject2020Compatibility(),
         n_failed_jobs: int = 0,
+        cache: EvaluationCache | None = None,
+        num_workers: int = 1,
     ) -> Self:
+        """Instantiate MetricsEvaluator from a list of structures and their energies.
+
+        If `cache` is given, results of previous evaluations stored in the cache are reused and
+        only structures that were not evaluated before are processed. Call `update_cache` after
+        computing metrics to store the results for later evaluations.
+
+        `num_workers` is the number of processes used to apply `energy_correction_scheme`.
+        """
 
         if reference is None:
             print("No reference dataset provided. Using MP2020 correction as reference.")
             reference = ReferenceMP2020Correction()
 
+        cached_results = None
+        energy_corrections = None
+        if cache is not None:
+            cached_results = cache.load(
+                [get_structure_fingerprint(s, e) for s, e in zip(structures, energies)]
+            )
+            energy_corrections = [r.get("correction") for r in cached_results.records]
+            profiling.count("evaluation_cache.hits", cached_results.num_cached)
+            profiling.count("evaluation_cache.misses", len(structures) - cached_results.num_cached)
+
         structure_summaries = get_metrics_structure_summaries(
             structures=structures,
             energies=energies,
             properties=properties,
             original_structures=original_structures,
             energy_correction_scheme=energy_correction_scheme,
+            energy_corrections=energy_corrections,
+            num_workers=num_workers,
         )
 
-        return cls.from_structure_summaries(
+        evaluator = cls.from_structure_summaries(
             structure_summaries=structure_summaries,
             reference=reference,
             stability_threshold=stability_threshold,
             property_constraints=property_constraints,
             structure_matcher=structure_matcher,
             n_failed_jobs=n_failed_jobs,
+            cached_results=cached_results,
         )
+        evaluator.cache = cache
+        return evaluator
 
     @classmethod
     def from_structure_summaries(
@@ -133,6 +174,7 @@ class MetricsEvaluator:
         structure_matcher: OrderedStructureMatcher
         | DisorderedStructureMatcher = DefaultDisorderedStructureMatcher(),
         n_failed_jobs: int = 0,
+        cached_results: CachedEvaluationResults | None = None,
     ) -> Self:
 
         if reference is None:
@@ -142,20 +184,39 @@ class MetricsEvaluator:
         capabilities: list[BaseMetricsCapability] = []
 
         if reference is not None:
-            structure_capability = StructureMetricsCapability(
-                structure_summaries=structure_summaries,
-                reference_dataset=reference,
-                structure_matcher=structure_matcher,
-                n_failed_jobs=n_failed_jobs,
-            )
-            capabilities.append(structure_capability)
-            try:
-                energy_capability = EnergyMetricsCapability(
+            if cached_results is None:
+                structure_capability = StructureMetricsCapability(
                     structure_summaries=structure_summaries,
                     reference_dataset=reference,
-                    stability_threshold=stability_threshold,
+                    structure_matcher=structure_matcher,
                     n_failed_jobs=n_failed_jobs,
                 )
+            else:
+                structure_capability = IncrementalStructureMetricsCapability(
+                    structure_summaries=structure_summaries,
+                    reference_dataset=reference,
+                    structure_matcher=structure_matcher,
+                    cached_results=cached_results,
+                    n_failed_jobs=n_failed_jobs,
+                )
+            capabilities.append(structure_capability)
+            try:
+                energy_capability = (
+                    EnergyMetricsCapability(
+                        structure_summaries=structure_summaries,
+                        reference_dataset=reference,
+                        stability_threshold=stability_threshold,
+                        n_failed_jobs=n_failed_jobs,
+                    )
+                    if cached_results is None
+                    else IncrementalEnergyMetricsCapability(
+                        structure_summaries=structure_summaries,
+                        reference_dataset=reference,
+                        cached_results=cached_results,
+                        stability_threshold=stability_threshold,
+                        n_failed_jobs=n_failed_jobs,
+                    )
+                )
                 capabilities.append(energy_capability)
             except MissingTerminalsError:
                 # if there are missing terminal systems in the reference dataset, we simply don't
@@ -174,7 +235,15 @@ class MetricsEvaluator:
 
     @cached_property
     def available_capability_types(self) -> frozenset[Type[BaseMetricsCapability]]:
-        return frozenset([type(cap) for cap in self.capabilities])
+        # include base classes so that specialized capabilities satisfy metric requirements
+        return frozenset(
+            [
+                cap_type
+                for cap in self.capabilities
+                for cap_type in type(cap).__mro__
+                if issubclass(cap_type, BaseMetricsCapability)
+            ]
+        )
 
     @cached_property
     def available_metrics(self) -> list[Type[BaseMetric]]:
@@ -259,6 +328,9 @@ class MetricsEvaluator:
             metrics: List of metrics to compute. If "all", all available metrics are computed.
             save_as: Path to save the dictionary. If None, the dictionary is not saved.
             pretty_print: If True, the dictionary is printed in a pretty format.
+
+        If an EvaluationProfiler is active, the computation of each metric is timed in the
+        "metrics" section of its report.
         """
 
         metrics_dict: dict[str, dict] = {}
@@ -267,7 +339,9 @@ class MetricsEvaluator:
         for metric_cls in metrics_classes:
             metric = self._get_metric(metric_cls)
             logger.info(f"Computing metric {metric.name}")
-            metrics_dict[metric.name] = {"value": metric.value, "description": metric.description}
+            with profiling.section(metric.name, group="metrics"):
+                value = metric.value
+            metrics_dict[metric.name] = {"value": value, "description": metric.description}
 
         if pretty_print:
             logger.info(
@@ -290,6 +364,26 @@ class MetricsEvaluator:
 
         return {k: v["value"] for k, v in metrics_dict.items()}
 
+    def update_cache(self) -> None:
+        """Stores per-structure results in the cache so that later evaluations can reuse them.
+        Results that have not been computed yet are computed first."""
+        assert self.cache is not None, "No cache provided."
+        structure_capability = self.structure_capability
+        assert isinstance(structure_capability, IncrementalStructureMetricsCapability)
+        energy_capability = (
+            self.energy_capability
+            if EnergyMetricsCapability in self.available_capability_types
+            else None
+        )
+        self.cache.save(
+            get_evaluation_results(
+                structure_summaries=structure_capability._structure_summaries,
+                cached_results=structure_capability.cached_results,
+                structure_capability=structure_capability,
+                energy_capability=energy_capability,
+            )
+        )
+
     def compute_all_metrics(self) -> dict[str, float | int]:
         """Computes all available metrics."""
         return self.compute_metrics(self.available_metrics)
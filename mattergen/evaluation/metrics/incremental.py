@@ -0,0 +1,258 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from functools import cached_property
+from typing import Any, Callable, Sequence
+
+import numpy as np
+import numpy.typing
+
+from mattergen.evaluation.metrics.energy import EnergyMetricsCapability
+from mattergen.evaluation.metrics.structure import (
+    StructureMetricsCapability,
+    get_space_group,
+    is_smact_valid,
+    structure_validity,
+)
+from mattergen.evaluation.reference.reference_dataset import ReferenceDataset
+from mattergen.evaluation.utils.evaluation_cache import CachedEvaluationResults, EvaluationResults
+from mattergen.evaluation.utils.globals import DEFAULT_STABILITY_THRESHOLD
+from mattergen.evaluation.utils.logging import logger
+from mattergen.evaluation.utils.metrics_structure_summary import MetricsStructureSummary
+from mattergen.evaluation.utils.structure_matcher import (
+    DisorderedStructureMatcher,
+    OrderedStructureMatcher,
+)
+
+
+def merge_cached_values(
+    records: list[dict[str, Any]],
+    key: str,
+    compute: Callable[[list[int]], Sequence[Any]],
+) -> list[Any]:
+    """
+    Returns the value of `key` for every record, calling `compute` with the indices of the
+    records in which the value is missing.
+    """
+    values = [r.get(key) for r in records]
+    missing = [i for i, r in enumerate(records) if key not in r]
+    if len(missing) > 0:
+        for i, value in zip(missing, compute(missing)):
+            values[i] = value
+    return values
+
+
+def get_affected_chemical_systems(dataset: ReferenceDataset, indices: Sequence[int]) -> list[str]:
+    """Returns the chemical systems of the dataset that contain any of the given entry IDs."""
+    indices = set(indices)
+    return [
+        chemsys
+        for chemsys, entries in dataset.entries_by_chemsys.items()
+        if any(e.entry_id in indices for e in entries)
+    ]
+
+
+class IncrementalStructureMetricsCapability(StructureMetricsCapability):
+    """StructureMetricsCapability that reuses the results of previous evaluations.
+
+    Novelty, validity and space groups are only computed for structures that were not
+    evaluated before. New structures are only matched against the unique structures of the
+    previous evaluation when computing uniqueness.
+    """
+
+    def __init__(
+        self,
+        structure_summaries: list[MetricsStructureSummary],
+        reference_dataset: ReferenceDataset,
+        structure_matcher: OrderedStructureMatcher | DisorderedStructureMatcher,
+        cached_results: CachedEvaluationResults,
+        n_failed_jobs: int = 0,
+    ) -> None:
+        super().__init__(
+            structure_summaries=structure_summaries,
+            reference_dataset=reference_dataset,
+            structure_matcher=structure_matcher,
+            n_failed_jobs=n_failed_jobs,
+        )
+        assert len(cached_results.records) == len(structure_summaries)
+        self.cached_results = cached_results
+
+    @property
+    def records(self) -> list[dict[str, Any]]:
+        return self.cached_results.records
+
+    def _subset(self, indices: list[int]) -> ReferenceDataset:
+        # entries keep their global entry_id
+        entries = list(self.dataset)
+        return ReferenceDataset.from_entries("data_entries", [entries[i] for i in indices])
+
+    @cached_property
+    def is_unique(self) -> numpy.typing.NDArray[np.bool_]:
+        is_unique_prefix = self.cached_results.is_unique_prefix
+        if (
+            is_unique_prefix is None
+            or self.cached_results.uniqueness_computer != type(self.uniqueness_computer).__name__
+        ):
+            return super().is_unique
+        if len(is_unique_prefix) == len(self.dataset):
+            return is_unique_prefix
+        return self.uniqueness_computer(self.dataset, is_unique_prefix=is_unique_prefix)
+
+    @cached_property
+    def matches_in_reference(self) -> dict[int, list[str]]:
+        def compute(indices: list[int]) -> list[list[str]]:
+            matches = self.dataset_matcher(self._subset(indices), self.reference_dataset)
+            return [matches.get(i, []) for i in indices]
+
+        values = merge_cached_values(self.records, "matches_in_reference", compute)
+        return {i: v for i, v in enumerate(values) if len(v) > 0}
+
+    @cached_property
+    def structure_validity(self) -> numpy.typing.NDArray[np.bool_]:
+        values = merge_cached_values(
+            self.records,
+            "structure_validity",
+            lambda indices: [structure_validity(self.structures[i]) for i in indices],
+        )
+        return np.array(values, dtype=bool)
+
+    @cached_property
+    def comp_validity(self) -> numpy.typing.NDArray[np.bool_]:
+        values = merge_cached_values(
+            self.records,
+            "comp_validity",
+            lambda indices: [is_smact_valid(self.structures[i]) for i in indices],
+        )
+        return np.array(values, dtype=bool)
+
+    @cached_property
+    def space_group_symbols(self) -> list[str]:
+        return merge_cached_values(
+            self.records,
+            "space_group",
+            lambda indices: [get_space_group(self.structures[i]) for i in indices],
+        )
+
+    def get_records(self) -> list[dict[str, Any]]:
+        """Returns the per-structure results to be stored in an EvaluationCache."""
+        matches = self.matches_in_reference
+        return [
+            {
+                "matches_in_reference": matches.get(i, []),
+                "structure_validity": bool(self.structure_validity[i]),
+                "comp_validity": bool(self.comp_validity[i]),
+                "space_group": self.space_group_symbols[i],
+            }
+            for i in range(len(self.dataset))
+        ]
+
+
+class IncrementalEnergyMetricsCapability(EnergyMetricsCapability):
+    """EnergyMetricsCapability that reuses the results of previous evaluations.
+
+    Energies above the reference hull are only computed for the chemical systems that contain
+    structures which were not evaluated before. Self-consistent phase diagrams are only rebuilt
+    for the chemical systems that contain structures appended since the previous evaluation.
+    """
+
+    def __init__(
+        self,
+        structure_summaries: list[MetricsStructureSummary],
+        reference_dataset: ReferenceDataset,
+        cached_results: CachedEvaluationResults,
+        stability_threshold: float = DEFAULT_STABILITY_THRESHOLD,
+        n_failed_jobs: int = 0,
+    ) -> None:
+        super().__init__(
+            structure_summaries=structure_summaries,
+            reference_dataset=reference_dataset,
+            stability_threshold=stability_threshold,
+            n_failed_jobs=n_failed_jobs,
+        )
+        assert len(cached_results.records) == len(structure_summaries)
+        self.cached_results = cached_results
+
+    @property
+    def records(self) -> list[dict[str, Any]]:
+        return self.cached_results.records
+
+    @cached_property
+    def energy_above_hull(self) -> numpy.typing.NDArray:
+        def compute(indices: list[int]) -> list[float]:
+            result = np.full(len(self.dataset), np.nan)
+            for chemsys in get_affected_chemical_systems(self.dataset, indices):
+                result[[e.entry_id for e in self.dataset.entries_by_chemsys[chemsys]]] = np.array(
+                    self._get_energy_above_hull_per_atom_chemsys(chemsys)
+                )
+            return result[indices].tolist()
+
+        return np.array(merge_cached_values(self.records, "energy_above_hull", compute))
+
+    @cached_property
+    def self_consistent_energy_above_hull(self) -> numpy.typing.NDArray:
+        prefix = self.cached_results.self_consistent_energy_above_hull_prefix
+        if prefix is None:
+            return super().self_consistent_energy_above_hull
+        result = np.zeros(len(self.dataset))
+        result[: len(prefix)] = prefix
+        affected_chemical_systems = get_affected_chemical_systems(
+            self.dataset, range(len(prefix), len(self.dataset))
+        )
+        logger.info(
+            f"Rebuilding self-consistent phase diagrams for {len(affected_chemical_systems)} "
+            f"of {len(self.dataset.entries_by_chemsys)} chemical systems."
+        )
+        for chemsys in affected_chemical_systems:
+            result[[e.entry_id for e in self.dataset.entries_by_chemsys[chemsys]]] = np.array(
+                self._get_self_consistent_energy_above_hull_per_atom_chemsys(chemsys)
+            )
+        return result
+
+    @cached_property
+    def rmsd_from_relaxation(self) -> numpy.typing.NDArray:
+        return np.array(
+            merge_cached_values(
+                self.records,
+                "rmsd_from_relaxation",
+                lambda indices: [
+                    self._structure_summaries[i].rmsd_from_relaxation for i in indices
+                ],
+            ),
+            dtype=float,
+        )
+
+    def get_records(self) -> list[dict[str, Any]]:
+        """Returns the per-structure results to be stored in an EvaluationCache."""
+        return [
+            {
+                "energy_above_hull": float(self.energy_above_hull[i]),
+                "rmsd_from_relaxation": float(self.rmsd_from_relaxation[i]),
+            }
+            for i in range(len(self.dataset))
+        ]
+
+
+def get_evaluation_results(
+    structure_summaries: list[MetricsStructureSummary],
+    cached_results: CachedEvaluationResults,
+    structure_capability: IncrementalStructureMetricsCapability,
+    energy_capability: IncrementalEnergyMetricsCapability | None = None,
+) -> EvaluationResults:
+    """Collects the results of an evaluation so that they can be reused by later evaluations."""
+    records = [
+        {"correction": s.entry.correction, **r}
+        for s, r in zip(structure_summaries, structure_capability.get_records())
+    ]
+    results = EvaluationResults(
+        fingerprints=cached_results.fingerprints,
+        records=records,
+        is_unique=structure_capability.is_unique,
+        uniqueness_computer=type(structure_capability.uniqueness_computer).__name__,
+    )
+    if energy_capability is not None:
+        for record, energy_record in zip(records, energy_capability.get_records()):
+            record.update(energy_record)
+        results.self_consistent_energy_above_hull = (
+            energy_capability.self_consistent_energy_above_hull
+        )
+    return results
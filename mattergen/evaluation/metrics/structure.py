@@ -187,6 +187,28 @@ class StructureMetricsCapability(BaseMetricsCapability):
     def space_group_symbols(self) -> list[str]:
         return [get_space_group(structure) for structure in self.structures]
 
+    @cached_property
+    def structure_validity(self) -> numpy.typing.NDArray[np.bool_]:
+        """Returns a boolean mask indicating whether each structure is structurally valid."""
+        return np.array(
+            [
+                structure_validity(structure=structure)
+                for structure in tqdm(self.structures, desc="Computing structure validity")
+            ],
+            dtype=bool,
+        )
+
+    @cached_property
+    def comp_validity(self) -> numpy.typing.NDArray[np.bool_]:
+        """Returns a boolean mask indicating whether each composition is valid according to smact."""
+        return np.array(
+            [
+                is_smact_valid(structure=structure)
+                for structure in tqdm(self.structures, desc="Computing comp validity")
+            ],
+            dtype=bool,
+        )
+
     @cached_property
     def chemistry_agnostic_space_group_symbols(self) -> list[str]:
         return [get_space_group(structure) for structure in self.chemistry_agnostic_structures]
@@ -340,14 +362,7 @@ class AvgStructureValidity(BaseStructureMetric, BaseAggregateMetric):
         return "Average structural validity of structures in sampled data. Any atom-atom distances less than 0.5 Angstroms or a volume less than 0.1 Angstrom**3 are considered invalid ."
 
     def compute_pre_aggregation_values(self) -> numpy.typing.NDArray:
-        return np.array(
-            [
-                structure_validity(structure=structure)
-                for structure in tqdm(
-                    self.structure_capability.structures, desc="Computing avg structure validity"
-                )
-            ]
-        )
+        return self.structure_capability.structure_validity
 
 
 class AvgCompValidity(BaseStructureMetric, BaseAggregateMetric):
@@ -360,14 +375,7 @@ class AvgCompValidity(BaseStructureMetric, BaseAggregateMetric):
         return "Average composition validity (according to smact) of structures in sampled data."
 
     def compute_pre_aggregation_values(self) -> numpy.typing.NDArray:
-        return np.array(
-            [
-                is_smact_valid(structure=structure)
-                for structure in tqdm(
-                    self.structure_capability.structures, desc="Computing avg comp validity"
-                )
-            ]
-        )
+        return self.structure_capability.comp_validity
 
 
 class AvgStructureCompValidity(BaseStructureMetric, BaseAggregateMetric):
@@ -380,15 +388,9 @@ class AvgStructureCompValidity(BaseStructureMetric, BaseAggregateMetric):
         return "Average number of structures in sampled data that are both valid structures and have a valid smact compositions."
 
     def compute_pre_aggregation_values(self) -> numpy.typing.NDArray:
-        valid_comp = [
-            structure_validity(structure=structure)
-            for structure in self.structure_capability.structures
-        ]
-        valid_struct = [
-            is_smact_valid(structure=structure)
-            for structure in self.structure_capability.structures
-        ]
-        return np.array(valid_comp) & np.array(valid_struct)
+        return (
+            self.structure_capability.structure_validity & self.structure_capability.comp_validity
+        )
 
 
 class FracNovelSystems(BaseStructureMetric):
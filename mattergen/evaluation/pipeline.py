@@ -0,0 +1,179 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import multiprocessing
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable
+
+import numpy as np
+from ase.io import write
+from pymatgen.core.structure import Structure
+from pymatgen.entries.compatibility import Compatibility, MaterialsProject2020Compatibility
+from pymatgen.io.ase import AseAtomsAdaptor
+
+from mattergen.evaluation.metrics.evaluator import MetricsEvaluator
+from mattergen.evaluation.reference.reference_dataset import ReferenceDataset
+from mattergen.evaluation.utils.metrics_structure_summary import (
+    MetricsStructureSummary,
+    get_metrics_structure_summaries,
+)
+from mattergen.evaluation.utils.structure_matcher import (
+    DefaultDisorderedStructureMatcher,
+    DisorderedStructureMatcher,
+    OrderedStructureMatcher,
+)
+
+# Relaxes a batch of structures and returns the relaxed structures and their total energies.
+RelaxFn = Callable[[list[Structure]], tuple[list[Structure], np.ndarray]]
+
+# marks the end of the input queue
+_DONE = None
+
+
+class EvaluationPipeline:
+    """
+    Evaluates structures that arrive in batches, e.g., from `draw_samples_from_sampler`, while
+    further batches are produced.
+
+    The stages run concurrently:
+    1. the producer calls `submit` with each batch of structures,
+    2. a relaxation thread relaxes the batches with `relax_fn`,
+    3. a process pool builds the structure summaries (including energy corrections) of each
+       relaxed batch,
+    and `finish` computes the metrics of all structures, which need the whole set, e.g., for
+    uniqueness. Both hand-overs are bounded by `max_queued_batches`, so a fast stage blocks
+    instead of piling up batches in memory, and the total time approaches that of the slowest stage.
+
+    Usage:
+        with EvaluationPipeline(relax_fn=StructureRelaxer()) as pipeline:
+            generator.structures_callback = pipeline.submit
+            generator.generate()
+            metrics = pipeline.finish()
+    """
+
+    def __init__(
+        self,
+        relax_fn: RelaxFn,
+        reference: ReferenceDataset | None = None,
+        structure_matcher: (
+            OrderedStructureMatcher | DisorderedStructureMatcher
+        ) = DefaultDisorderedStructureMatcher(),
+        energy_correction_scheme: Compatibility = MaterialsProject2020Compatibility(),
+        num_workers: int = 1,
+        max_queued_batches: int = 2,
+    ):
+        """
+        Args:
+            relax_fn: function relaxing a batch of structures, e.g., a `StructureRelaxer`.
+            reference: Reference dataset. If this is None, the default reference dataset will be used.
+            structure_matcher: Structure matcher to use for matching the structures.
+            energy_correction_scheme: Energy correction scheme to apply to the relaxed energies.
+            num_workers: Number of processes used to build the structure summaries.
+            max_queued_batches: Maximum number of batches waiting for relaxation and waiting for
+                their summaries.
+        """
+        self.relax_fn = relax_fn
+        self.reference = reference
+        self.structure_matcher = structure_matcher
+        self.energy_correction_scheme = energy_correction_scheme
+        self.num_workers = num_workers
+        self.max_queued_batches = max_queued_batches
+
+        self._queue: queue.Queue[list[Structure] | None] = queue.Queue(maxsize=max_queued_batches)
+        self._summaries: list[Future] = []
+        self._relaxed_structures: list[Structure] = []
+        self._energies: list[np.ndarray] = []
+        self._error: BaseException | None = None
+        self._executor: ProcessPoolExecutor | None = None
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self) -> "EvaluationPipeline":
+        # Worker processes are spawned rather than forked, since the relaxation thread and the
+        # producer may hold locks or CUDA state when a worker starts.
+        self._executor = ProcessPoolExecutor(
+            self.num_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._thread = threading.Thread(target=self._relax_batches, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._error = self._error or exc_value or RuntimeError("Pipeline was not finished.")
+            self._queue.put(_DONE)
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=exc_type is not None)
+
+    def submit(self, structures: list[Structure]) -> None:
+        """Queues a batch of structures. Blocks while `max_queued_batches` batches are waiting for
+        relaxation."""
+        assert self._thread is not None, "Use the pipeline as a context manager."
+        if self._error is not None:
+            raise RuntimeError("Evaluation pipeline failed.") from self._error
+        if structures:
+            self._queue.put(list(structures))
+
+    def _relax_batches(self) -> None:
+        assert self._executor is not None
+        pending: deque[Future] = deque()
+        while (structures := self._queue.get()) is not _DONE:
+            if self._error is not None:
+                # keep draining the queue so that the producer does not block
+                continue
+            try:
+                relaxed_structures, energies = self.relax_fn(structures)
+                while len(pending) >= self.max_queued_batches + self.num_workers:
+                    pending.popleft().result()
+                summaries = self._executor.submit(
+                    get_metrics_structure_summaries,
+                    structures=relaxed_structures,
+                    energies=list(energies),
+                    original_structures=structures,
+                    energy_correction_scheme=self.energy_correction_scheme,
+                )
+                pending.append(summaries)
+                self._summaries.append(summaries)
+                self._relaxed_structures.extend(relaxed_structures)
+                self._energies.append(np.asarray(energies))
+            except BaseException as e:
+                self._error = e
+
+    def finish(
+        self, save_as: str | None = None, structures_output_path: str | None = None
+    ) -> dict[str, float | int]:
+        """Waits for all submitted batches and returns the metrics of all structures.
+
+        Args:
+            save_as: Save the metrics as a JSON file.
+            structures_output_path: Path to save the relaxed structures and their energies as an
+                extxyz file.
+        """
+        assert self._thread is not None, "Use the pipeline as a context manager."
+        self._queue.put(_DONE)
+        self._thread.join()
+        if self._error is not None:
+            raise RuntimeError("Evaluation pipeline failed.") from self._error
+        if not self._summaries:
+            raise ValueError("No structures were submitted.")
+        structure_summaries: list[MetricsStructureSummary] = [
+            summary for future in self._summaries for summary in future.result()
+        ]
+        if structures_output_path:
+            relaxed_atoms = [AseAtomsAdaptor.get_atoms(s) for s in self._relaxed_structures]
+            for atoms, energy in zip(relaxed_atoms, np.concatenate(self._energies)):
+                atoms.info["total_energy"] = energy
+            write(structures_output_path, relaxed_atoms, format="extxyz")
+        evaluator = MetricsEvaluator.from_structure_summaries(
+            structure_summaries=structure_summaries,
+            reference=self.reference,
+            structure_matcher=self.structure_matcher,
+        )
+        return evaluator.compute_metrics(
+            metrics=evaluator.available_metrics,
+            save_as=save_as,
+            pretty_print=True,
+        )
@@ -2,7 +2,7 @@
 # Licensed under the MIT License.
 
 from collections import defaultdict
-from typing import Iterable, List, Mapping
+from typing import Hashable, Iterable, List, Mapping
 
 import numpy as np
 from pymatgen.analysis.structure_matcher import StructureMatcher
@@ -16,7 +16,9 @@ from mattergen.evaluation.utils.structure_matcher import (
     DefaultDisorderedStructureMatcher,
     DisorderedStructureMatcher,
     OrderedStructureMatcher,
+    check_is_disordered,
 )
+from mattergen.evaluation.utils.symmetry_analysis import DefaultSpaceGroupAnalyzer
 
 
 def get_matches(
@@ -43,26 +45,198 @@ def get_matches(
     return matches
 
 
-def get_unique(structure_matcher: StructureMatcher, structures: List[Structure]) -> List[int]:
+def get_unique(
+    structure_matcher: StructureMatcher,
+    structures: List[Structure],
+    bucket_keys: List[Hashable | None] | None = None,
+) -> List[int]:
 
     if len(structures) == 1:
         return [0]
 
-    unique_structures: list[Structure] = []
+    return extend_unique(structure_matcher, [], structures, bucket_keys)
+
+
+def extend_unique(
+    structure_matcher: StructureMatcher,
+    unique_structures: List[Structure],
+    structures: List[Structure],
+    bucket_keys: List[Hashable | None] | None = None,
+) -> List[int]:
+    """
+    Greedily extends a list of structures known to be unique. A structure is unique if it does
+    not match any of the unique structures before it.
+
+    Args:
+        structure_matcher: StructureMatcher to use for comparison.
+        unique_structures: Structures already known to be unique. These are not modified.
+        structures: Structures to check against `unique_structures` and against each other.
+        bucket_keys: Optional keys of `unique_structures + structures` as returned by
+            `get_uniqueness_bucket_key`. Structures are only compared if their keys are equal or
+            if either key is None. With None, all structures are compared.
+
+    Returns:
+        unique_idx: Indices of the structures in `structures` that are unique.
+    """
+    if bucket_keys is None:
+        bucket_keys = [None] * (len(unique_structures) + len(structures))
+    assert len(bucket_keys) == len(unique_structures) + len(structures)
+
+    all_unique: list[Structure] = []
+    unique_by_key: defaultdict[Hashable, list[Structure]] = defaultdict(list)
+    unique_without_key: list[Structure] = []
+
+    def add_unique(structure: Structure, key: Hashable | None) -> None:
+        all_unique.append(structure)
+        if key is None:
+            unique_without_key.append(structure)
+        else:
+            unique_by_key[key].append(structure)
+
+    for structure, key in zip(unique_structures, bucket_keys):
+        add_unique(structure, key)
+
     unique_idx: list[int] = []
-    for idx, structure in enumerate(structures):
+    for idx, (structure, key) in enumerate(zip(structures, bucket_keys[len(unique_structures) :])):
+        candidates = all_unique if key is None else unique_by_key[key] + unique_without_key
         unique = True
-        for structure_2 in unique_structures:
+        for structure_2 in candidates:
             if structure_matcher.fit(structure, structure_2):
                 unique = False
                 break
         if unique:
-            unique_structures.append(structure)
+            add_unique(structure, key)
             unique_idx.append(idx)
 
     return unique_idx
 
 
+def _get_num_reduced_sites(structure_matcher: StructureMatcher, structure: Structure) -> int | None:
+    """
+    Returns the number of sites of the reduced (e.g., primitive) cell of `structure`, which is
+    equal for all structures matched by a matcher that neither attempts supercells nor allows
+    subsets. Returns None for other matchers.
+    """
+    if (
+        structure_matcher._supercell
+        or structure_matcher._subset
+        or structure_matcher._ignored_species
+    ):
+        return None
+    return len(
+        structure_matcher._get_reduced_structure(structure, structure_matcher._primitive_cell)
+    )
+
+
+def get_uniqueness_bucket_key(
+    structure_matcher: StructureMatcher,
+    structure: Structure,
+    bucket_by_space_group: bool = False,
+) -> Hashable | None:
+    """
+    Returns a key such that `structure_matcher.fit` can only be True for two structures if their
+    keys are equal, or if either key is None. Structures with different keys do not need to be
+    compared, which avoids the `fit` calls between structures of different sizes within a group
+    of structures with the same reduced formula.
+
+    The key only contains invariants of the matcher:
+      - DisorderedStructureMatcher only matches ordered structures with the same reduced formula.
+        If the elements of the formula cannot substitute each other, two ordered structures are
+        only compared by its ordered matcher, so that the number of sites of the reduced cell is
+        invariant, too. Otherwise, a structure can match disordered versions of structures of
+        other sizes. Disordered structures can match any structure and get no key.
+      - Other matchers that neither attempt supercells nor allow subsets only match structures
+        with the same number of sites in their reduced (e.g., primitive) cells.
+    Volumes are not used because the matchers used for evaluation rescale volumes.
+
+    Args:
+        structure_matcher: StructureMatcher used for comparison.
+        structure: Structure to compute the key for.
+        bucket_by_space_group: Whether to add the space group number to the key. Note that
+            the matcher tolerances are looser than the symmetry tolerances, so this can split
+            structures which the matcher would consider equivalent.
+    """
+    if isinstance(structure_matcher, DisorderedStructureMatcher):
+        if not structure.is_ordered:
+            return None
+        structure_nooxi = structure.copy().remove_oxidation_states()
+        key: tuple = (structure_nooxi.composition.reduced_formula,)
+        can_be_disordered, _ = check_is_disordered(
+            structure_nooxi,
+            relative_radius_difference_threshold=(
+                structure_matcher.relative_radius_difference_threshold
+            ),
+            electronegativity_difference_threshold=(
+                structure_matcher.electronegativity_difference_threshold
+            ),
+        )
+        num_reduced_sites = _get_num_reduced_sites(
+            structure_matcher.ordered_structurematcher, structure_nooxi
+        )
+        if not can_be_disordered and num_reduced_sites is not None:
+            key += (num_reduced_sites,)
+    else:
+        num_reduced_sites = _get_num_reduced_sites(structure_matcher, structure)
+        if num_reduced_sites is None:
+            return None
+        key = (num_reduced_sites,)
+    if bucket_by_space_group:
+        try:
+            key += (DefaultSpaceGroupAnalyzer(structure).get_space_group_number(),)
+        except TypeError:
+            # space group analysis failed, most likely due to overlapping atoms
+            key += (1,)
+    return key
+
+
+def get_unique_in_group(
+    structure_matcher: StructureMatcher,
+    data_entries: List[ComputedStructureEntry],
+    is_unique_prefix: np.typing.NDArray[np.bool_] | None = None,
+    use_buckets: bool = True,
+    bucket_by_space_group: bool = False,
+) -> List[int]:
+    """
+    Returns the local indices of the unique entries within a group of entries.
+
+    Args:
+        structure_matcher: StructureMatcher to use for comparison.
+        data_entries: Entries of one group, in the order of the dataset.
+        is_unique_prefix: Uniqueness flags of the first `len(is_unique_prefix)` entries of the
+            dataset, known from a previous evaluation. Entries whose entry_id falls inside the
+            prefix are not matched again, and the remaining entries are only matched against
+            the unique ones.
+        use_buckets: Whether to skip comparisons between structures with different
+            `get_uniqueness_bucket_key`.
+        bucket_by_space_group: Whether to include the space group in the bucket keys.
+    """
+    if is_unique_prefix is None:
+        num_known = 0
+        unique_idx: list[int] = []
+    else:
+        num_known = sum(e.entry_id < len(is_unique_prefix) for e in data_entries)
+        unique_idx = [i for i in range(num_known) if is_unique_prefix[data_entries[i].entry_id]]
+    if num_known == len(data_entries):
+        return unique_idx
+
+    candidate_entries = [data_entries[i] for i in unique_idx] + data_entries[num_known:]
+    bucket_keys = (
+        [
+            get_uniqueness_bucket_key(structure_matcher, e.structure, bucket_by_space_group)
+            for e in candidate_entries
+        ]
+        if use_buckets and len(candidate_entries) > 1
+        else None
+    )
+    new_unique_idx = extend_unique(
+        structure_matcher,
+        [data_entries[i].structure for i in unique_idx],
+        [e.structure for e in data_entries[num_known:]],
+        bucket_keys,
+    )
+    return unique_idx + [num_known + i for i in new_unique_idx]
+
+
 def get_dataset_matcher(
     all_structures_ordered: bool, structure_matcher: StructureMatcher
 ) -> "DatasetMatcher":
@@ -114,41 +288,103 @@ def get_mask_from_local_index(
 
 
 class OrderedDatasetUniquenessComputer:
-    def __init__(self, structure_matcher: StructureMatcher = DefaultDisorderedStructureMatcher()):
+    def __init__(
+        self,
+        structure_matcher: StructureMatcher = DefaultDisorderedStructureMatcher(),
+        use_buckets: bool = True,
+        bucket_by_space_group: bool = False,
+    ):
+        """
+        Args:
+            structure_matcher: StructureMatcher to use for comparison.
+            use_buckets: Whether to only compare structures with equal bucket keys (see
+                `get_uniqueness_bucket_key`). This gives the same result as comparing all
+                structures, but skips the `fit` calls between structures that cannot match.
+            bucket_by_space_group: Whether to also bucket structures by space group. This is
+                faster but may keep near-duplicates whose detected space groups differ.
+        """
         self.structure_matcher = structure_matcher
+        self.use_buckets = use_buckets
+        self.bucket_by_space_group = bucket_by_space_group
 
-    def __call__(self, dataset: ReferenceDataset) -> np.typing.NDArray[bool]:
+    def __call__(
+        self,
+        dataset: ReferenceDataset,
+        is_unique_prefix: np.typing.NDArray[np.bool_] | None = None,
+    ) -> np.typing.NDArray[bool]:
+        """
+        Args:
+            dataset: Dataset to find unique structures in.
+            is_unique_prefix: Optional uniqueness flags of the first entries of the dataset from
+                a previous evaluation. Only the remaining entries are matched.
+        """
         local_index: dict[str, List[int]] = {}
         for reduced_formula, data_entries in tqdm(
             dataset.entries_by_reduced_formula.items(),
             desc="Finding unique structures by reduced formula",
         ):
-            structures = [e.structure for e in data_entries]
             assert all(
-                [s.is_ordered for s in structures]
+                [e.structure.is_ordered for e in data_entries]
             ), "OrderedDatasetUniquenessComputer only works for ordered structures."
-            local_index[reduced_formula] = get_unique(self.structure_matcher, structures)
+            local_index[reduced_formula] = get_unique_in_group(
+                self.structure_matcher,
+                data_entries,
+                is_unique_prefix,
+                use_buckets=self.use_buckets,
+                bucket_by_space_group=self.bucket_by_space_group,
+            )
 
         return get_mask_from_local_index(dataset.entries_by_reduced_formula, local_index)
 
 
 class DisorderedDatasetUniquenessComputer:
-    def __init__(self, structure_matcher: StructureMatcher = DefaultDisorderedStructureMatcher()):
+    def __init__(
+        self,
+        structure_matcher: StructureMatcher = DefaultDisorderedStructureMatcher(),
+        use_buckets: bool = True,
+        bucket_by_space_group: bool = False,
+    ):
+        """
+        Args:
+            structure_matcher: StructureMatcher to use for comparison.
+            use_buckets: Whether to only compare structures with equal bucket keys (see
+                `get_uniqueness_bucket_key`). This gives the same result as comparing all
+                structures, but skips the `fit` calls between structures that cannot match.
+            bucket_by_space_group: Whether to also bucket structures by space group. This is
+                faster but may keep near-duplicates whose detected space groups differ.
+        """
         self.structure_matcher = structure_matcher
+        self.use_buckets = use_buckets
+        self.bucket_by_space_group = bucket_by_space_group
 
-    def __call__(self, dataset: "ReferenceDataset") -> np.typing.NDArray[bool]:
+    def __call__(
+        self,
+        dataset: "ReferenceDataset",
+        is_unique_prefix: np.typing.NDArray[np.bool_] | None = None,
+    ) -> np.typing.NDArray[bool]:
+        """
+        Args:
+            dataset: Dataset to find unique structures in.
+            is_unique_prefix: Optional uniqueness flags of the first entries of the dataset from
+                a previous evaluation. Only the remaining entries are matched.
+        """
         local_index: dict[str, List[int]] = {}
         for chemsys, data_entries in tqdm(
             dataset.entries_by_chemsys.items(),
             desc="Finding unique structures by chemsys",
         ):
-            structures = [e.structure for e in data_entries]
-            if not all([s.is_ordered for s in structures]):
+            if not all([e.structure.is_ordered for e in data_entries]):
                 logger.warning(
                     "Using DisorderedDatasetUniquenessComputer for ordered structures. "
                     "This is less efficient than using OrderedDatasetUniquenessComputer."
                 )
-            local_index[chemsys] = get_unique(self.structure_matcher, structures)
+            local_index[chemsys] = get_unique_in_group(
+                self.structure_matcher,
+                data_entries,
+                is_unique_prefix,
+                use_buckets=self.use_buckets,
+                bucket_by_space_group=self.bucket_by_space_group,
+            )
 
         return get_mask_from_local_index(dataset.entries_by_chemsys, local_index)
 
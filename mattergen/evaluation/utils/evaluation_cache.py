@@ -0,0 +1,186 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+import hashlib
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import numpy.typing
+from pymatgen.core.structure import Structure
+
+from mattergen.evaluation.utils.lmdb_utils import lmdb_get, lmdb_open, lmdb_put
+from mattergen.evaluation.utils.logging import logger
+
+# Number of decimals kept when hashing coordinates, lattices and energies.
+FINGERPRINT_DECIMALS = 6
+
+
+def get_structure_fingerprint(structure: Structure, energy: float | None = None) -> str:
+    """
+    Returns a hash identifying a structure (and optionally its energy) exactly, up to
+    floating point noise. Symmetry-equivalent but differently represented structures get
+    different fingerprints; use a StructureMatcher to compare those.
+    """
+    fingerprint = hashlib.sha256()
+    # adding 0.0 turns -0.0 into 0.0 so that both hash identically
+    fingerprint.update((np.round(structure.lattice.matrix, FINGERPRINT_DECIMALS) + 0.0).tobytes())
+    fingerprint.update((np.round(structure.frac_coords, FINGERPRINT_DECIMALS) + 0.0).tobytes())
+    fingerprint.update(",".join(str(site.species) for site in structure).encode())
+    if energy is not None:
+        fingerprint.update(np.float64(np.round(energy, FINGERPRINT_DECIMALS) + 0.0).tobytes())
+    return fingerprint.hexdigest()
+
+
+@dataclass
+class CachedEvaluationResults:
+    """
+    Results of previous evaluations, aligned with the structures that are being evaluated.
+
+    Per-structure results only depend on the structure itself (e.g., novelty, validity) and are
+    stored in `records`, which is empty for structures that have not been evaluated before.
+    Uniqueness and self-consistent energies above hull depend on the whole set of structures.
+    They are only reused if the previously evaluated set is a prefix of the current one.
+    """
+
+    fingerprints: list[str]
+    records: list[dict[str, Any]]
+    is_unique_prefix: numpy.typing.NDArray[np.bool_] | None = None
+    uniqueness_computer: str | None = None
+    self_consistent_energy_above_hull_prefix: numpy.typing.NDArray | None = None
+
+    @property
+    def num_cached(self) -> int:
+        return sum(len(r) > 0 for r in self.records)
+
+
+@dataclass
+class EvaluationResults:
+    """Results of an evaluation to be written to an EvaluationCache."""
+
+    fingerprints: list[str]
+    records: list[dict[str, Any]]
+    is_unique: numpy.typing.NDArray[np.bool_] | None = None
+    uniqueness_computer: str | None = None
+    self_consistent_energy_above_hull: numpy.typing.NDArray | None = None
+
+
+class EvaluationCache:
+    """
+    Persistent store of evaluation results, backed by a single LMDB file.
+
+    Expected LMDB structure:
+        {
+            "config": {"reference": "MP2020correction", ...},
+            "record.<fingerprint>": {"matches_in_reference": [...], "energy_above_hull": 0.1, ...},
+            "relaxation.<fingerprint>": {"structure": <Structure.as_dict()>, "energy": -10.0},
+            "campaign.fingerprints": [<fingerprint>, ...],
+            "campaign.is_unique": <np.ndarray>,
+            "campaign.uniqueness_computer": "OrderedDatasetUniquenessComputer",
+            "campaign.self_consistent_energy_above_hull": <np.ndarray>,
+        }
+
+    Records are keyed by `get_structure_fingerprint` of the relaxed structure and its energy,
+    relaxations by the fingerprint of the structure before relaxation.
+    """
+
+    def __init__(self, path: str | os.PathLike, config: dict[str, Any] | None = None):
+        """
+        Args:
+            path: path to the LMDB file. It is created on the first call to `save`.
+            config: settings that the cached results depend on, e.g., the name of the reference
+                dataset and of the structure matcher. A ValueError is raised when reusing a cache
+                that was written with a different config.
+        """
+        self.path = Path(path)
+        self.config = config or {}
+        if self.path.exists():
+            stored_config = self._read(["config"], default={})[0]
+            if stored_config != self.config:
+                raise ValueError(
+                    f"Evaluation cache {self.path} was written with config {stored_config}, "
+                    f"which differs from {self.config}. Please use a different cache path."
+                )
+
+    def _read(self, keys: list[str], default: Any = None) -> list[Any]:
+        if not self.path.exists():
+            return [default for _ in keys]
+        with lmdb_open(self.path, readonly=True) as env:
+            with env.begin() as txn:
+                return [lmdb_get(txn, key, default=default, raise_if_missing=False) for key in keys]
+
+    def load(self, fingerprints: list[str]) -> CachedEvaluationResults:
+        """Returns the cached results for the structures with the given fingerprints."""
+        records = [r or {} for r in self._read([f"record.{fp}" for fp in fingerprints])]
+        (
+            previous_fingerprints,
+            is_unique,
+            uniqueness_computer,
+            self_consistent_energy_above_hull,
+        ) = self._read(
+            [
+                "campaign.fingerprints",
+                "campaign.is_unique",
+                "campaign.uniqueness_computer",
+                "campaign.self_consistent_energy_above_hull",
+            ]
+        )
+        results = CachedEvaluationResults(fingerprints=fingerprints, records=records)
+        if previous_fingerprints is not None and (
+            fingerprints[: len(previous_fingerprints)] == previous_fingerprints
+        ):
+            results.is_unique_prefix = is_unique
+            results.uniqueness_computer = uniqueness_computer
+            results.self_consistent_energy_above_hull_prefix = self_consistent_energy_above_hull
+        elif previous_fingerprints is not None:
+            logger.info(
+                "Previously evaluated structures are not a prefix of the current ones. "
+                "Uniqueness and self-consistent energies above hull are recomputed from scratch."
+            )
+        logger.info(
+            f"Found cached results for {results.num_cached}/{len(fingerprints)} structures."
+        )
+        return results
+
+    def load_relaxations(self, fingerprints: list[str]) -> list[tuple[Structure, float] | None]:
+        """Returns the cached relaxed structure and energy for each unrelaxed structure, if any."""
+        return [
+            (Structure.from_dict(r["structure"]), r["energy"]) if r is not None else None
+            for r in self._read([f"relaxation.{fp}" for fp in fingerprints])
+        ]
+
+    def save_relaxations(self, relaxations: dict[str, tuple[Structure, float]]) -> None:
+        """Writes relaxed structures and energies keyed by the fingerprint of the unrelaxed structure."""
+        with lmdb_open(self.path, readonly=False) as env:
+            with env.begin(write=True) as txn:
+                lmdb_put(txn, "config", self.config)
+                for fp, (structure, energy) in relaxations.items():
+                    lmdb_put(
+                        txn,
+                        f"relaxation.{fp}",
+                        {"structure": structure.as_dict(), "energy": float(energy)},
+                    )
+            env.sync()
+
+    def save(self, results: EvaluationResults) -> None:
+        """Writes results to the cache, merging per-structure records with existing ones."""
+        existing_records = self._read([f"record.{fp}" for fp in results.fingerprints])
+        with lmdb_open(self.path, readonly=False) as env:
+            with env.begin(write=True) as txn:
+                lmdb_put(txn, "config", self.config)
+                for fp, existing, record in zip(
+                    results.fingerprints, existing_records, results.records
+                ):
+                    lmdb_put(txn, f"record.{fp}", {**(existing or {}), **record})
+                lmdb_put(txn, "campaign.fingerprints", results.fingerprints)
+                lmdb_put(txn, "campaign.is_unique", results.is_unique)
+                lmdb_put(txn, "campaign.uniqueness_computer", results.uniqueness_computer)
+                lmdb_put(
+                    txn,
+                    "campaign.self_consistent_energy_above_hull",
+                    results.self_consistent_energy_above_hull,
+                )
+            env.sync()
+        logger.info(f"Saved evaluation results to {self.path}")
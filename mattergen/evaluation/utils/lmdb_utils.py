@@ -12,6 +12,8 @@ from typing import Any, Generic, TypeVar
 import lmdb  # type: ignore [import]
 from tqdm import tqdm  # type: ignore [import]
 
+from mattergen.evaluation.utils import profiling
+
 T = TypeVar("T")
 DataPoint = TypeVar("DataPoint")
 
@@ -83,6 +85,7 @@ def lmdb_get(
         the value of the retrieved data.
     """
     value = txn.get(key.encode("ascii"))
+    profiling.count("lmdb_reads")
     if value is None:
         if default is None and raise_if_missing:
             raise LmdbNotFoundError(
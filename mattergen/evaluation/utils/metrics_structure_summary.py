@@ -1,17 +1,29 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+import copy
 import warnings
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
 from dataclasses import dataclass, field
 from functools import cached_property
+from itertools import repeat
+from typing import Any, Callable, Hashable
 
 import numpy as np
-from pymatgen.core import Structure
+from pymatgen.analysis.structure_analyzer import oxide_type, sulfide_type
+from pymatgen.core import Element, Structure
 from pymatgen.entries.compatibility import Compatibility, MaterialsProject2020Compatibility
-from pymatgen.entries.computed_entries import ComputedStructureEntry
+from pymatgen.entries.computed_entries import ComputedStructureEntry, ConstantEnergyAdjustment
 
+from mattergen.evaluation.utils import profiling
 from mattergen.evaluation.utils.utils import compute_rmsd_angstrom, preprocess_structure
-from mattergen.evaluation.utils.vasprunlike import VasprunLike
+from mattergen.evaluation.utils.vasprunlike import IdentityCorrectionScheme, VasprunLike
+
+# Correction schemes whose energy adjustments do not depend on the energy, but only on the
+# composition, the run type and POTCARs derived from it by MPRelaxSet, and the oxide and sulfide
+# type of the structure. Structures sharing these can share their energy adjustments.
+CACHEABLE_CORRECTION_SCHEMES = (MaterialsProject2020Compatibility, IdentityCorrectionScheme)
 
 
 @dataclass
@@ -32,10 +44,7 @@ class MetricsStructureSummary:
         Instantiates a MetricsStructureSummary from a JobStoreTaskDoc.
         Useful for computing DFT-based metrics (or any compatible MLFF).
         """
-        vasprun_like = VasprunLike(structure=structure, energy=energy)
-        entry = vasprun_like.get_computed_entry(
-            inc_structure=True, energy_correction_scheme=energy_correction_scheme
-        )
+        entry = get_corrected_entry(structure, energy, energy_correction_scheme)
         if original_structure is None:
             warnings.warn("No original structure found, cannot compute RMSD metric.")
 
@@ -45,6 +54,29 @@ class MetricsStructureSummary:
             original_structure=original_structure,
         )
 
+    @staticmethod
+    def from_structure_energy_and_correction(
+        structure: Structure,
+        energy: float,
+        correction: float,
+        properties: dict[str, float] | None = None,
+        original_structure: Structure | None = None,
+    ) -> "MetricsStructureSummary":
+        """
+        Instantiates a MetricsStructureSummary from an energy correction that was computed before,
+        e.g., by a previous evaluation. This skips building a VasprunLike.
+        """
+        entry = ComputedStructureEntry(
+            structure=structure,
+            energy=energy,
+            energy_adjustments=[ConstantEnergyAdjustment(correction, name="Cached correction")],
+        )
+        return MetricsStructureSummary(
+            entry=entry,
+            properties=properties or {},
+            original_structure=original_structure,
+        )
+
     @staticmethod
     def from_structure(
         structure: Structure,
@@ -78,25 +110,155 @@ class MetricsStructureSummary:
         return self.entry.composition.chemical_system
 
 
+def get_corrected_entry(
+    structure: Structure, energy: float, energy_correction_scheme: Compatibility
+) -> ComputedStructureEntry:
+    """Returns a ComputedStructureEntry with the energy adjustments of `energy_correction_scheme`."""
+    vasprun_like = VasprunLike(structure=structure, energy=energy)
+    return vasprun_like.get_computed_entry(
+        inc_structure=True, energy_correction_scheme=energy_correction_scheme
+    )
+
+
+def get_energy_correction_key(structure: Structure) -> Hashable:
+    """
+    Returns a key such that structures with the same key get the same energy adjustments from the
+    schemes in CACHEABLE_CORRECTION_SCHEMES. The run type (GGA or GGA+U) and POTCARs are
+    determined by the composition, so the key is the (non-reduced) composition together with the
+    oxide and sulfide type of the structure.
+    """
+    composition = structure.composition
+    return (
+        tuple((str(species), amount) for species, amount in composition.items()),
+        oxide_type(structure),
+        sulfide_type(structure) if Element("S") in composition else None,
+    )
+
+
+def get_entry_with_corrections_of(
+    structure: Structure, energy: float, entry: ComputedStructureEntry
+) -> ComputedStructureEntry:
+    """Returns an entry for `structure` with the parameters, data and energy adjustments of `entry`,
+    which must have the same energy correction key."""
+    return ComputedStructureEntry(
+        structure=structure,
+        energy=energy,
+        energy_adjustments=copy.deepcopy(entry.energy_adjustments),
+        parameters=copy.deepcopy(entry.parameters),
+        data=copy.deepcopy(entry.data),
+    )
+
+
+def _map(executor: Executor | None, fn: Callable, *iterables: list, num_workers: int) -> list[Any]:
+    if executor is None:
+        return list(map(fn, *iterables))
+    chunksize = max(1, len(iterables[0]) // (4 * num_workers))
+    return list(executor.map(fn, *iterables, chunksize=chunksize))
+
+
+def get_corrected_entries(
+    structures: list[Structure],
+    energies: list[float],
+    energy_correction_scheme: Compatibility = MaterialsProject2020Compatibility(),
+    num_workers: int = 1,
+) -> list[ComputedStructureEntry]:
+    """
+    Returns the entries of `get_corrected_entry` for all structures, in the same order.
+
+    For the schemes in CACHEABLE_CORRECTION_SCHEMES, the energy adjustments are computed once per
+    energy correction key and copied to the other structures with that key. This avoids building
+    an MPRelaxSet and guessing oxidation states for every structure of a composition.
+
+    Args:
+        structures: Structures to get entries for.
+        energies: Total energies of the structures.
+        energy_correction_scheme: Energy correction scheme to apply.
+        num_workers: Number of worker processes. If 1, everything runs in the current process.
+    """
+    assert len(structures) == len(energies)
+    cache_corrections = isinstance(energy_correction_scheme, CACHEABLE_CORRECTION_SCHEMES)
+    with ProcessPoolExecutor(num_workers) if num_workers > 1 else nullcontext() as executor:
+        if cache_corrections:
+            keys = _map(executor, get_energy_correction_key, structures, num_workers=num_workers)
+            first_index_of_key: dict[Hashable, int] = {}
+            for i, key in enumerate(keys):
+                first_index_of_key.setdefault(key, i)
+            to_compute = list(first_index_of_key.values())
+            profiling.count("energy_corrections.hits", len(structures) - len(to_compute))
+            profiling.count("energy_corrections.misses", len(to_compute))
+        else:
+            to_compute = list(range(len(structures)))
+        computed_entries = _map(
+            executor,
+            get_corrected_entry,
+            [structures[i] for i in to_compute],
+            [energies[i] for i in to_compute],
+            list(repeat(energy_correction_scheme, len(to_compute))),
+            num_workers=num_workers,
+        )
+    entries = dict(zip(to_compute, computed_entries))
+    if cache_corrections:
+        for i, key in enumerate(keys):
+            if i not in entries:
+                entries[i] = get_entry_with_corrections_of(
+                    structures[i], energies[i], entries[first_index_of_key[key]]
+                )
+    return [entries[i] for i in range(len(structures))]
+
+
 def get_metrics_structure_summaries(
     structures: list[Structure],
     energies: list[float],
     properties: dict[str, list[float]] | None = None,
     original_structures: list[Structure] | None = None,
     energy_correction_scheme: Compatibility = MaterialsProject2020Compatibility(),
+    energy_corrections: list[float | None] | None = None,
+    num_workers: int = 1,
 ) -> list[MetricsStructureSummary]:
+    """
+    Returns a MetricsStructureSummary per structure. If `energy_corrections` is given, structures
+    with a known (not None) correction reuse it instead of applying `energy_correction_scheme`.
+    The energy correction scheme is applied with `get_corrected_entries` using `num_workers`
+    processes.
+    """
     if properties is None:
         properties = {}
     for prop in properties:
         assert len(properties[prop]) == len(structures)
+    if energy_corrections is None:
+        energy_corrections = [None] * len(structures)
+    assert len(energy_corrections) == len(structures)
+
+    to_correct = [i for i in range(len(structures)) if energy_corrections[i] is None]
+    if len(to_correct) > 0 and not original_structures:
+        warnings.warn("No original structure found, cannot compute RMSD metric.")
+    corrected_entries = dict(
+        zip(
+            to_correct,
+            get_corrected_entries(
+                structures=[structures[i] for i in to_correct],
+                energies=[energies[i] for i in to_correct],
+                energy_correction_scheme=energy_correction_scheme,
+                num_workers=num_workers,
+            ),
+        )
+    )
 
     return [
-        MetricsStructureSummary.from_structure_and_energy(
-            structure=structures[i],
-            energy=energies[i],
-            properties={k: v[i] for k, v in properties.items()} if properties else None,
-            original_structure=original_structures[i] if original_structures else None,
-            energy_correction_scheme=energy_correction_scheme,
+        (
+            MetricsStructureSummary(
+                entry=corrected_entries[i],
+                properties={k: v[i] for k, v in properties.items()} if properties else {},
+                original_structure=original_structures[i] if original_structures else None,
+            )
+            if energy_corrections[i] is None
+            else MetricsStructureSummary.from_structure_energy_and_correction(
+                structure=structures[i],
+                energy=energies[i],
+                correction=energy_corrections[i],
+                properties={k: v[i] for k, v in properties.items()} if properties else None,
+                original_structure=original_structures[i] if original_structures else None,
+            )
         )
         for i in range(len(structures))
     ]
@@ -0,0 +1,211 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Instrumentation to find out where the time of an evaluation is spent.
+
+While an EvaluationProfiler is active, it times all cached properties and lru-cached methods of
+the metrics capabilities, `StructureMatcher.fit` calls and PhaseDiagram builds, and collects the
+counters incremented with `count`. Code sections, e.g., single metrics, are timed with `section`;
+the time of the computations and the counters triggered inside a section are attributed to it.
+
+Usage:
+    with EvaluationProfiler() as profiler:
+        evaluator.compute_metrics(metrics="all")
+    profiler.save("metrics_profile.json")
+"""
+
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import cached_property, wraps
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Iterator
+
+from mattergen.evaluation.utils.logging import logger
+
+_active_profiler: "EvaluationProfiler | None" = None
+
+
+def count(name: str, n: int = 1) -> None:
+    """Increments a counter of the active profiler. Does nothing if no profiler is active.
+
+    Counters named `<cache>.hits` and `<cache>.misses` are reported as cache statistics.
+    """
+    if _active_profiler is not None:
+        _active_profiler._count(name, n)
+
+
+def section(name: str, group: str = "stages") -> ContextManager:
+    """Times a code section with the active profiler. Does nothing if no profiler is active."""
+    if _active_profiler is None:
+        return nullcontext()
+    return _active_profiler.section(name, group=group)
+
+
+def get_profile_path(metrics_path: str | os.PathLike) -> Path:
+    """Returns the path of the profiling report that belongs to a metrics file."""
+    path = Path(metrics_path)
+    return path.with_name(f"{path.stem}_profile.json")
+
+
+def _get_subclasses(cls: type) -> list[type]:
+    subclasses = []
+    for subclass in cls.__subclasses__():
+        subclasses += [subclass, *_get_subclasses(subclass)]
+    return subclasses
+
+
+def _new_timing() -> dict[str, float | int]:
+    return {"calls": 0, "seconds": 0.0}
+
+
+class EvaluationProfiler:
+    """
+    Collects wall times, call counts and cache statistics of an evaluation.
+
+    Timings are inclusive: the time of a computation includes the computations it triggers.
+    Recursive calls of the same computation are counted, but their time is only added once.
+    """
+
+    def __init__(self) -> None:
+        self.seconds = 0.0
+        self.timings: dict[str, dict[str, float | int]] = defaultdict(_new_timing)
+        self.counters: Counter[str] = Counter()
+        self.sections: dict[str, dict[str, dict[str, Any]]] = defaultdict(dict)
+        self._open_sections: list[dict[str, Any]] = []
+        self._depth: Counter[str] = Counter()
+        self._patches: list[tuple[Any, str, Any]] = []
+        self._lru_caches: dict[str, Any] = {}
+        self._lru_cache_info_at_start: dict[str, Any] = {}
+        self._start = 0.0
+
+    def __enter__(self) -> "EvaluationProfiler":
+        global _active_profiler
+        assert _active_profiler is None, "Another EvaluationProfiler is already active."
+        self._instrument()
+        _active_profiler = self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        global _active_profiler
+        self.seconds += time.perf_counter() - self._start
+        _active_profiler = None
+        for name, cache in self._lru_caches.items():
+            info, info_at_start = cache.cache_info(), self._lru_cache_info_at_start[name]
+            self._count(f"{name}.hits", info.hits - info_at_start.hits)
+            self._count(f"{name}.misses", info.misses - info_at_start.misses)
+        for owner, attribute, original in reversed(self._patches):
+            setattr(owner, attribute, original)
+        self._patches = []
+
+    @contextmanager
+    def section(self, name: str, group: str = "stages") -> Iterator[None]:
+        """Times a code section and attributes the computations and counters inside it."""
+        stats: dict[str, Any] = {
+            "seconds": 0.0,
+            "timings": defaultdict(_new_timing),
+            "counters": Counter(),
+        }
+        self._open_sections.append(stats)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stats["seconds"] = time.perf_counter() - start
+            self._open_sections.remove(stats)
+            self.sections[group][name] = stats
+
+    def as_dict(self) -> dict[str, Any]:
+        counters = {k: v for k, v in self.counters.items() if not k.endswith((".hits", ".misses"))}
+        caches = {}
+        for key in sorted(self.counters):
+            if key.endswith(".hits"):
+                name = key.removesuffix(".hits")
+                hits, misses = self.counters[key], self.counters[f"{name}.misses"]
+                caches[name] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": hits / (hits + misses) if hits + misses > 0 else None,
+                }
+        return {
+            "seconds": self.seconds,
+            **{
+                group: {
+                    name: {
+                        "seconds": stats["seconds"],
+                        "timings": dict(stats["timings"]),
+                        "counters": dict(stats["counters"]),
+                    }
+                    for name, stats in sections.items()
+                }
+                for group, sections in self.sections.items()
+            },
+            "timings": dict(sorted(self.timings.items(), key=lambda kv: -kv[1]["seconds"])),
+            "counters": counters,
+            "caches": caches,
+        }
+
+    def save(self, path: str | os.PathLike) -> None:
+        """Writes the report as a JSON file."""
+        path = Path(path).resolve()
+        os.makedirs(path.parent, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=4)
+        logger.info(f"Saved profiling report to {path}")
+
+    def _count(self, name: str, n: int) -> None:
+        self.counters[name] += n
+        for stats in self._open_sections:
+            stats["counters"][name] += n
+
+    def _add_timing(self, name: str, seconds: float, is_outermost: bool) -> None:
+        for timings in [self.timings, *(stats["timings"] for stats in self._open_sections)]:
+            timings[name]["calls"] += 1
+            if is_outermost:
+                timings[name]["seconds"] += seconds
+
+    def _timed(self, name: str, fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            self._depth[name] += 1
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._depth[name] -= 1
+                self._add_timing(name, time.perf_counter() - start, self._depth[name] == 0)
+
+        return wrapper
+
+    def _patch(self, owner: Any, attribute: str, value: Any) -> None:
+        self._patches.append((owner, attribute, getattr(owner, attribute)))
+        setattr(owner, attribute, value)
+
+    def _instrument(self) -> None:
+        # imported here to avoid circular imports, since the metrics use the counters of this module
+        from pymatgen.analysis.phase_diagram import PhaseDiagram
+        from pymatgen.analysis.structure_matcher import StructureMatcher
+
+        import mattergen.evaluation.metrics.evaluator  # noqa: F401, registers all capabilities
+        from mattergen.evaluation.metrics.core import BaseMetricsCapability
+
+        for cls in [StructureMatcher, *_get_subclasses(StructureMatcher)]:
+            if "fit" in vars(cls):
+                self._patch(cls, "fit", self._timed(f"{cls.__name__}.fit", vars(cls)["fit"]))
+        self._patch(
+            PhaseDiagram, "__init__", self._timed("PhaseDiagram.__init__", PhaseDiagram.__init__)
+        )
+        for cls in _get_subclasses(BaseMetricsCapability):
+            for attribute, value in list(vars(cls).items()):
+                name = f"{cls.__name__}.{attribute}"
+                if isinstance(value, cached_property):
+                    self._patch(value, "func", self._timed(name, value.func))
+                elif hasattr(value, "cache_info"):  # functools.lru_cache or cachetools.cached
+                    if callable(value.cache_info):
+                        self._lru_caches[name] = value
+                        self._lru_cache_info_at_start[name] = value.cache_info()
+                    self._patch(cls, attribute, self._timed(name, value))
@@ -16,12 +16,23 @@ logger = get_logger()
 logger.level("ERROR")
 
 
-def relax_atoms(
-    atoms: list[Atoms], device: str = str(get_device()), potential_load_path: str = None, output_path: str | None = None, **kwargs
-) -> tuple[list[Atoms], np.ndarray]:
-    potential = Potential.from_checkpoint(
+def load_potential(device: str = str(get_device()), potential_load_path: str = None) -> Potential:
+    return Potential.from_checkpoint(
         device=device, load_path=potential_load_path, load_training_state=False
     )
+
+
+def relax_atoms(
+    atoms: list[Atoms],
+    device: str = str(get_device()),
+    potential_load_path: str = None,
+    output_path: str | None = None,
+    potential: Potential | None = None,
+    **kwargs,
+) -> tuple[list[Atoms], np.ndarray]:
+    # pass a loaded `potential` to avoid reloading it when relaxing several batches
+    if potential is None:
+        potential = load_potential(device=device, potential_load_path=potential_load_path)
     batch_relaxer = BatchRelaxer(potential=potential, filter="EXPCELLFILTER", **kwargs)
     relaxation_trajectories = batch_relaxer.relax(atoms)
     relaxed_atoms = [t[-1] for t in relaxation_trajectories.values()]
@@ -45,3 +56,17 @@ def relax_structures(
     relaxed_atoms, total_energies = relax_atoms(atoms, device=device, potential_load_path=potential_load_path, output_path=output_path, **kwargs)
     relaxed_structures = [AseAtomsAdaptor.get_structure(a) for a in relaxed_atoms]
     return relaxed_structures, total_energies
+
+
+class StructureRelaxer:
+    """Relaxes batches of structures with a potential that is loaded once."""
+
+    def __init__(self, device: str = str(get_device()), potential_load_path: str = None, **kwargs):
+        self.potential = load_potential(device=device, potential_load_path=potential_load_path)
+        self.device = device
+        self.kwargs = kwargs
+
+    def __call__(self, structures: list[Structure]) -> tuple[list[Structure], np.ndarray]:
+        return relax_structures(
+            structures, device=self.device, potential=self.potential, **self.kwargs
+        )
@@ -1,26 +1,33 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
-import io
+import dataclasses
+import math
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from zipfile import ZipFile
+from tempfile import TemporaryDirectory
+from typing import Callable, Iterator, Literal
 
-import ase.io
 import hydra
+import numpy as np
 import torch
 from hydra.utils import instantiate
 from omegaconf import DictConfig, OmegaConf
 from pymatgen.core.structure import Structure
-from pymatgen.io.ase import AseAtomsAdaptor
+from pytorch_lightning import seed_everything
 from tqdm import tqdm
 
+from mattergen.common.data.batch_operations import ChemGraphBatchOperations
 from mattergen.common.data.chemgraph import ChemGraph
 from mattergen.common.data.collate import collate
 from mattergen.common.data.condition_factory import ConditionLoader
 from mattergen.common.data.num_atoms_distribution import NUM_ATOMS_DISTRIBUTIONS
 from mattergen.common.data.types import TargetProperty
+from mattergen.common.globals import GENERATED_TRAJECTORIES_NPZ_FILE_NAME
+from mattergen.common.utils.columnar_structures import ColumnarStructures, ColumnarStructureWriter
 from mattergen.common.utils.data_utils import lattice_matrix_to_params_torch
 from mattergen.common.utils.eval_utils import (
     MatterGenCheckpointInfo,
@@ -30,8 +37,13 @@ from mattergen.common.utils.eval_utils import (
     save_structures,
 )
 from mattergen.common.utils.globals import DEFAULT_SAMPLING_CONFIG_PATH, get_device
+from mattergen.diffusion.exceptions import AllSamplesRejected
 from mattergen.diffusion.lightning_module import DiffusionLightningModule
 from mattergen.diffusion.sampling.pc_sampler import PredictorCorrector
+from mattergen.diffusion.sampling.trajectory_recorder import (
+    RecordedTrajectories,
+    TrajectoryRecorder,
+)
 from mattergen.common.utils.data_classes import ProgressCallback
 
 
@@ -43,7 +55,34 @@ def draw_samples_from_sampler(
     cfg: DictConfig | None = None,
     record_trajectories: bool = True,
     progress_callback: ProgressCallback | None = None,
+    max_num_atoms_per_batch: int | None = None,
+    trajectory_stride: int = 1,
+    trajectory_spacing: Literal["linear", "log"] = "linear",
+    structures_callback: Callable[[list[Structure]], None] | None = None,
+    trajectories_path: Path | None = None,
+    first_sample_id: int = 0,
 ) -> list[Structure]:
+    """Draws one sample for each condition of `condition_loader`.
+
+    If `structures_callback` is given, it is called with the structures of each batch as soon as
+    the batch is denoised, e.g., to relax them while the next batch is generated.
+
+    If `record_trajectories` is True, the intermediate structures of every `trajectory_stride`-th
+    denoising step are written to disk, or of log-spaced steps if `trajectory_spacing` is "log".
+    They are written to `trajectories_path`, by default `output_path /
+    GENERATED_TRAJECTORIES_NPZ_FILE_NAME`.
+
+    If `max_num_atoms_per_batch` is given, the conditions are denoised with continuous batching:
+    crystals that finish denoising are replaced by new ones right away, such that each step
+    denoises up to `max_num_atoms_per_batch` atoms, regardless of the batches of the loader.
+    Trajectories cannot be recorded in this mode.
+
+    The samples of the conditions get consecutive ids starting at `first_sample_id`, which select
+    their random streams if the sampler has a seed.
+
+    If the sampler has a health monitor, the samples it rejects are dropped in both modes, so fewer
+    structures than conditions may be returned. The number of rejected samples is reported.
+    """
 
     # Dict
     properties_to_condition_on = properties_to_condition_on or {}
@@ -52,90 +91,150 @@ def draw_samples_from_sampler(
     assert all([key in sampler.diffusion_module.model.cond_fields_model_was_trained_on for key in properties_to_condition_on.keys()])  # type: ignore
 
     all_samples_list = []
-    all_trajs_list = []
-    for batch_idx, (conditioning_data, mask) in enumerate(tqdm(condition_loader, desc="Generating samples")):
-        if progress_callback is not None:
-            progress_callback(progress=batch_idx / len(condition_loader))
-
-        # generate samples
+    num_rejected = 0
+    if max_num_atoms_per_batch is not None:
         if record_trajectories:
-            sample, mean, intermediate_samples = sampler.sample_with_record(conditioning_data, mask)
-            all_trajs_list.extend(list_of_time_steps_to_list_of_trajectories(intermediate_samples))
-        else:
-            sample, mean = sampler.sample(conditioning_data, mask)
-        all_samples_list.extend(mean.to_data_list())
+            raise ValueError("Trajectories cannot be recorded with continuous batching.")
+        all_samples_list, num_rejected = draw_samples_continuously(
+            sampler=sampler,
+            condition_loader=condition_loader,
+            max_num_atoms_per_batch=max_num_atoms_per_batch,
+            progress_callback=progress_callback,
+            structures_callback=structures_callback,
+            first_sample_id=first_sample_id,
+        )
+    else:
+        # Trajectories are appended to disk batch by batch rather than kept in memory.
+        if trajectories_path is None and output_path is not None:
+            trajectories_path = output_path / GENERATED_TRAJECTORIES_NPZ_FILE_NAME
+        trajectory_writer = (
+            ColumnarStructureWriter(trajectories_path)
+            if record_trajectories and trajectories_path is not None
+            else None
+        )
+        sample_id = first_sample_id
+        for batch_idx, (conditioning_data, mask) in enumerate(
+            tqdm(condition_loader, desc="Generating samples")
+        ):
+            if progress_callback is not None:
+                progress_callback(progress=batch_idx / len(condition_loader))
+            sample_ids = torch.arange(sample_id, sample_id + conditioning_data.get_batch_size())
+            sample_id += conditioning_data.get_batch_size()
+
+            # generate samples. If the sampler has a health monitor, it may return fewer samples
+            # than there are conditions.
+            try:
+                if record_trajectories:
+                    sample, mean, recorded_trajectories = sampler.sample_with_record(
+                        conditioning_data,
+                        mask,
+                        recorder=TrajectoryRecorder(
+                            fields=["pos", "cell", "atomic_numbers"],
+                            stride=trajectory_stride,
+                            spacing=trajectory_spacing,
+                        ),
+                        sample_ids=sample_ids,
+                    )
+                    if trajectory_writer is not None:
+                        append_recorded_trajectories(trajectory_writer, recorded_trajectories)
+                else:
+                    sample, mean = sampler.sample(conditioning_data, mask, sample_ids=sample_ids)
+            except AllSamplesRejected:
+                num_rejected += conditioning_data.get_batch_size()
+                continue
+            num_rejected += conditioning_data.get_batch_size() - mean.get_batch_size()
+            all_samples_list.extend(mean.to_data_list())
+            if structures_callback is not None:
+                structures_callback(structures_from_samples(mean))
+        if trajectory_writer is not None:
+            trajectory_writer.close()
 
     if progress_callback is not None:
         # log 100% progress
         progress_callback(progress=1.0)
 
+    if num_rejected > 0:
+        print(
+            f"Rejected {num_rejected} degenerate samples during denoising, returning "
+            f"{len(all_samples_list)} structures for {num_rejected + len(all_samples_list)} "
+            "conditions."
+        )
+    if not all_samples_list:
+        raise AllSamplesRejected("All samples were rejected during denoising.")
+
     all_samples = collate(all_samples_list)
     assert isinstance(all_samples, ChemGraph)
-    lengths, angles = lattice_matrix_to_params_torch(all_samples.cell)
-    all_samples = all_samples.replace(lengths=lengths, angles=angles)
-
-    generated_strucs = structure_from_model_output(
-        all_samples["pos"].reshape(-1, 3),
-        all_samples["atomic_numbers"].reshape(-1),
-        all_samples["lengths"].reshape(-1, 3),
-        all_samples["angles"].reshape(-1, 3),
-        all_samples["num_atoms"].reshape(-1),
-    )
+    generated_strucs = structures_from_samples(all_samples)
 
     if output_path is not None:
         assert cfg is not None
-        # Save structures to disk in both a extxyz file and a compressed zip file.
+        # Save structures to disk in a columnar .npz file, an extxyz file and a compressed zip file.
         # do this before uploading to mongo in case there is an authentication error
         save_structures(output_path, generated_strucs)
 
-        if record_trajectories:
-            dump_trajectories(
-                output_path=output_path,
-                all_trajs_list=all_trajs_list,
-            )
-
     return generated_strucs
 
 
-def list_of_time_steps_to_list_of_trajectories(
-    list_of_time_steps: list[ChemGraph],
-) -> list[list[ChemGraph]]:
-    # Rearrange the shapes of the recorded intermediate samples and predictions
-    # We get a list of <num_timesteps> many ChemGraphBatches, each containing <batch_size>
-    # many ChemGraphs. Instead, we group all the ChemGraphs of the same trajectory together,
-    # i.e., we construct lists of <batch_size> many lists of
-    # <num_timesteps * (1 + num_corrector_steps)> many ChemGraphs.
-
-    # <num_timesteps * (1 + num_corrector_steps)> many lists of <batch_size> many ChemGraphs
-    data_lists_per_timesteps = [x.to_data_list() for x in list_of_time_steps]
-
-    # <batch_size> many lists of <num_timesteps * (1 + num_corrector_steps)> many ChemGraphs.
-    data_lists_per_sample = [
-        [data_lists_per_timesteps[ix_t][ix_traj] for ix_t in range(len(data_lists_per_timesteps))]
-        for ix_traj in range(len(data_lists_per_timesteps[0]))
-    ]
-    return data_lists_per_sample
+def draw_samples_continuously(
+    sampler: PredictorCorrector,
+    condition_loader: ConditionLoader,
+    max_num_atoms_per_batch: int,
+    progress_callback: ProgressCallback | None = None,
+    structures_callback: Callable[[list[Structure]], None] | None = None,
+    first_sample_id: int = 0,
+) -> tuple[list[ChemGraph], int]:
+    """Returns the samples drawn with continuous batching and the number of samples rejected by the
+    health monitor of the sampler, i.e., of conditions without a sample."""
+    num_conditions = 0
+
+    def get_conditioning_data() -> Iterator[ChemGraph]:
+        nonlocal num_conditions
+        for conditioning_data, mask in condition_loader:
+            assert mask is None, "Continuous batching does not support inpainting masks."
+            num_conditions += conditioning_data.get_batch_size()
+            yield conditioning_data
+
+    total = len(condition_loader.dataset) if hasattr(condition_loader, "dataset") else None
+    samples_list = []
+    with tqdm(total=total, desc="Generating samples") as pbar:
+        for _, mean in sampler.sample_continuously(
+            conditioning_data=get_conditioning_data(),
+            batch_operations=ChemGraphBatchOperations(),
+            max_batch_size=max_num_atoms_per_batch,
+            first_sample_id=first_sample_id,
+        ):
+            samples_list.extend(mean.to_data_list())
+            if structures_callback is not None:
+                structures_callback(structures_from_samples(mean))
+            pbar.update(mean.get_batch_size())
+            if progress_callback is not None and total:
+                progress_callback(progress=len(samples_list) / total)
+    return samples_list, num_conditions - len(samples_list)
+
+
+def append_recorded_trajectories(
+    writer: ColumnarStructureWriter, recorded_trajectories: RecordedTrajectories
+) -> None:
+    """Appends the trajectory of each sample of a batch to a columnar structure file."""
+    cell = recorded_trajectories.fields["cell"].float().numpy()
+    for ix in range(cell.shape[1]):
+        writer.append_trajectory(
+            pos=recorded_trajectories.get_sample("pos", ix).float().numpy(),
+            cell=cell[:, ix],
+            atomic_numbers=recorded_trajectories.get_sample("atomic_numbers", ix).numpy(),
+        )
 
 
-def dump_trajectories(
-    output_path: Path,
-    all_trajs_list: list[list[ChemGraph]],
-) -> None:
-    try:
-        # We gather all trajectories in a single zip file as .extxyz files.
-        # This way we can view them easily after downloading.
-        with ZipFile(output_path / "generated_trajectories.zip", "w") as zip_obj:
-            for ix, traj in enumerate(all_trajs_list):
-                strucs = structures_from_trajectory(traj)
-                ase_atoms = [AseAtomsAdaptor.get_atoms(crystal) for crystal in strucs]
-                str_io = io.StringIO()
-                ase.io.write(str_io, ase_atoms, format="extxyz")
-                str_io.flush()
-                zip_obj.writestr(f"gen_{ix}.extxyz", str_io.getvalue())
-    except IOError as e:
-        print(f"Got error {e} writing the trajectory to disk.")
-    except ValueError as e:
-        print(f"Got error ValueError '{e}' writing the trajectory to disk.")
+def structures_from_samples(samples: ChemGraph) -> list[Structure]:
+    """Returns the structures of a batch of denoised samples."""
+    lengths, angles = lattice_matrix_to_params_torch(samples.cell)
+    return structure_from_model_output(
+        samples["pos"].reshape(-1, 3),
+        samples["atomic_numbers"].reshape(-1),
+        lengths.reshape(-1, 3),
+        angles.reshape(-1, 3),
+        samples["num_atoms"].reshape(-1),
+    )
 
 
 def structure_from_model_output(
@@ -159,21 +258,28 @@ def structure_from_model_output(
     return structures
 
 
-def structures_from_trajectory(traj: list[ChemGraph]) -> list[Structure]:
+def structures_from_recorded_trajectories(
+    recorded_trajectories: RecordedTrajectories,
+) -> list[list[Structure]]:
+    """Returns the structures of each frame of each recorded trajectory."""
+    cell = recorded_trajectories.fields["cell"].float()
+    num_frames, num_samples = cell.shape[:2]
+    lengths, angles = lattice_matrix_to_params_torch(cell.reshape(-1, 3, 3))
+    lengths, angles = lengths.reshape(num_frames, num_samples, 3), angles.reshape(
+        num_frames, num_samples, 3
+    )
     all_strucs = []
-    for batch in traj:
-        cell = batch.cell
-        lengths, angles = lattice_matrix_to_params_torch(cell)
-        all_strucs.extend(
+    for ix in range(num_samples):
+        pos = recorded_trajectories.get_sample("pos", ix)
+        all_strucs.append(
             structure_from_model_output(
-                frac_coords=batch.pos,
-                atom_types=batch.atomic_numbers,
-                lengths=lengths,
-                angles=angles,
-                num_atoms=batch.num_atoms,
+                frac_coords=pos.reshape(-1, 3).float(),
+                atom_types=recorded_trajectories.get_sample("atomic_numbers", ix).reshape(-1),
+                lengths=lengths[:, ix],
+                angles=angles[:, ix],
+                num_atoms=torch.full((num_frames,), pos.shape[1]),
             )
         )
-
     return all_strucs
 
 
@@ -203,6 +309,19 @@ class CrystalGenerator:
     sampling_config_name: str = "default"
 
     record_trajectories: bool = True  # store all intermediate samples by default
+    # record every trajectory_stride-th step, or log-spaced steps if trajectory_spacing is "log"
+    trajectory_stride: int = 1
+    trajectory_spacing: Literal["linear", "log"] = "linear"
+
+    # If set, denoise with continuous batching of up to this many atoms per step
+    max_num_atoms_per_batch: int | None = None
+
+    # Number of processes that generate in parallel, each on a shard of the batches. The processes
+    # use the available GPUs in turn, or share the CPU cores.
+    num_processes: int = 1
+    # If set, the conditions are reproducible, and the sampler draws the random numbers of each
+    # sample from its own stream, so the samples do not depend on num_processes
+    seed: int | None = None
 
     # These attributes are set when prepare() method is called.
     _model: DiffusionLightningModule | None = None
@@ -210,6 +329,8 @@ class CrystalGenerator:
 
     # can be used to monitor progress of generation
     progress_callback: ProgressCallback | None = None
+    # called with the structures of each batch as soon as it is generated
+    structures_callback: Callable[[list[Structure]], None] | None = None
 
     def __post_init__(self) -> None:
         assert self.num_atoms_distribution in NUM_ATOMS_DISTRIBUTIONS, (
@@ -355,6 +476,12 @@ class CrystalGenerator:
         target_compositions_dict: list[dict[str, float]] | None = None,
         output_dir: str = "outputs",
     ) -> list[Structure]:
+        if self.seed is not None:
+            if self.num_processes == 1:
+                # Instantiating the model draws random numbers. Load it before seeding, so that the
+                # conditions are the same as with several processes, which load it in the workers.
+                self.prepare()
+            seed_everything(self.seed)
         # Prioritize the runtime provided batch_size, num_batches and target_compositions_dict
         batch_size = batch_size or self.batch_size
         num_batches = num_batches or self.num_batches
@@ -375,9 +502,12 @@ class CrystalGenerator:
         print("\nSampling config:")
         print(OmegaConf.to_yaml(sampling_config, resolve=True))
         condition_loader = self.get_condition_loader(sampling_config, target_compositions_dict)
+        if self.num_processes > 1:
+            return self._generate_data_parallel(
+                sampling_config, condition_loader, output_path=Path(output_dir)
+            )
 
-        sampler_partial = instantiate(sampling_config.sampler_partial)
-        sampler = sampler_partial(pl_module=self.model)
+        sampler = self.get_sampler(sampling_config)
 
         generated_structures = draw_samples_from_sampler(
             sampler=sampler,
@@ -387,6 +517,121 @@ class CrystalGenerator:
             properties_to_condition_on=self.properties_to_condition_on,
             record_trajectories=self.record_trajectories,
             progress_callback=self.progress_callback,
+            max_num_atoms_per_batch=self.max_num_atoms_per_batch,
+            trajectory_stride=self.trajectory_stride,
+            trajectory_spacing=self.trajectory_spacing,
+            structures_callback=self.structures_callback,
         )
 
         return generated_structures
+
+    def get_sampler(self, sampling_config: DictConfig) -> PredictorCorrector:
+        """Instantiates the sampler of `sampling_config` for the model, seeded with `seed`."""
+        sampler_partial = instantiate(sampling_config.sampler_partial)
+        if self.seed is None:
+            return sampler_partial(pl_module=self.model)
+        return sampler_partial(pl_module=self.model, seed=self.seed)
+
+    def _generate_data_parallel(
+        self, sampling_config: DictConfig, condition_loader: ConditionLoader, output_path: Path
+    ) -> list[Structure]:
+        """
+        Generates with `num_processes` worker processes. Each worker draws the samples of a
+        contiguous shard of the batches of `condition_loader`, with a seed derived from `seed`. The
+        structures and trajectories are returned and saved in the order of the batches.
+        `structures_callback` is called with the structures of each shard.
+        """
+        batches = list(condition_loader)
+        shard_size = math.ceil(len(batches) / self.num_processes)
+        shards = [batches[i : i + shard_size] for i in range(0, len(batches), shard_size)]
+        # id of the sample of the first condition of each shard
+        first_sample_ids = np.cumsum(
+            [0] + [sum(x.get_batch_size() for x, _ in shard) for shard in shards[:-1]]
+        ).tolist()
+        shard_seeds = [
+            int(s.generate_state(1)[0])
+            for s in np.random.SeedSequence(self.seed).spawn(len(shards))
+        ]
+        num_devices = torch.cuda.device_count() if torch.cuda.is_available() else 0
+        num_threads = max(1, torch.get_num_threads() // len(shards))
+        # each worker loads its own copy of the model
+        worker_generator = dataclasses.replace(
+            self, num_processes=1, _model=None, progress_callback=None, structures_callback=None
+        )
+
+        structures = []
+        with TemporaryDirectory(dir=output_path) as shards_dir, ProcessPoolExecutor(
+            max_workers=len(shards), mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            trajectories_paths = [
+                Path(shards_dir) / f"trajectories_{i}.npz" if self.record_trajectories else None
+                for i in range(len(shards))
+            ]
+            futures = [
+                executor.submit(
+                    _generate_shard,
+                    generator=worker_generator,
+                    sampling_config=sampling_config,
+                    batches=shard,
+                    seed=seed,
+                    device_index=i % num_devices if num_devices else None,
+                    num_threads=None if num_devices else num_threads,
+                    trajectories_path=trajectories_path,
+                    first_sample_id=first_sample_id,
+                )
+                for i, (shard, seed, trajectories_path, first_sample_id) in enumerate(
+                    zip(shards, shard_seeds, trajectories_paths, first_sample_ids)
+                )
+            ]
+            for i, future in enumerate(futures):
+                shard_structures = future.result()
+                structures.extend(shard_structures)
+                if self.structures_callback is not None and shard_structures:
+                    self.structures_callback(shard_structures)
+                if self.progress_callback is not None:
+                    self.progress_callback(progress=(i + 1) / len(futures))
+            if self.record_trajectories:
+                with ColumnarStructureWriter(
+                    output_path / GENERATED_TRAJECTORIES_NPZ_FILE_NAME
+                ) as writer:
+                    for trajectories_path in trajectories_paths:
+                        writer.append_columnar_structures(ColumnarStructures(trajectories_path))
+
+        if not structures:
+            raise AllSamplesRejected("All samples were rejected during denoising.")
+        save_structures(output_path, structures)
+        return structures
+
+
+def _generate_shard(
+    generator: CrystalGenerator,
+    sampling_config: DictConfig,
+    batches: list[tuple[ChemGraph, dict[str, torch.Tensor] | None]],
+    seed: int,
+    device_index: int | None,
+    num_threads: int | None,
+    trajectories_path: Path | None,
+    first_sample_id: int,
+) -> list[Structure]:
+    """Draws the samples of a shard of batches in a worker process of
+    `CrystalGenerator._generate_data_parallel`."""
+    if device_index is not None:
+        torch.cuda.set_device(device_index)
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    seed_everything(seed)
+    sampler = generator.get_sampler(sampling_config)
+    try:
+        return draw_samples_from_sampler(
+            sampler=sampler,
+            condition_loader=batches,
+            properties_to_condition_on=generator.properties_to_condition_on,
+            record_trajectories=generator.record_trajectories,
+            max_num_atoms_per_batch=generator.max_num_atoms_per_batch,
+            trajectory_stride=generator.trajectory_stride,
+            trajectory_spacing=generator.trajectory_spacing,
+            trajectories_path=trajectories_path,
+            first_sample_id=first_sample_id,
+        )
+    except AllSamplesRejected:
+        return []
@@ -9,6 +9,7 @@ from mattergen.common.data.chemgraph import ChemGraph
 from mattergen.common.data.types import PropertySourceId, TargetProperty
 from mattergen.common.utils.data_utils import get_atomic_number
 from mattergen.common.utils.globals import MAX_ATOMIC_NUM, PROPERTY_SOURCE_IDS
+from mattergen.diffusion.sampling.conditioning_cache import cached_conditioning
 
 # attribute name in ChemGraph corresponding to a Dict[PropertyName, torch.BoolTensor]
 # object that stores whether to use the unconditional embedding for each conditional field
@@ -412,10 +413,15 @@ class ChemicalSystemMultiHotEmbedding(torch.nn.Module):
         -------
         torch.Tensor, shape = (n_structures_in_batch, MAX_ATOMIC_NUM + 1)
         """
-        return torch.cat(
-            [ChemicalSystemMultiHotEmbedding._sequence_to_multi_hot(_x, device=device) for _x in x],
-            dim=0,
-        )
+        # build the indices of all 1s on the host and copy them to the device at once
+        rows = [i for i, _x in enumerate(x) for _ in _x]
+        columns = [get_atomic_number(symbol=_element) for _x in x for _element in _x]
+        multi_hot = torch.zeros(len(x), MAX_ATOMIC_NUM + 1, device=device)
+        multi_hot[
+            torch.tensor(rows, dtype=torch.long, device=device),
+            torch.tensor(columns, dtype=torch.long, device=device),
+        ] = 1.0
+        return multi_hot
 
     @staticmethod
     def convert_to_list_of_str(x: list[str] | list[list[str]]) -> list[list[str]]:
@@ -499,25 +505,43 @@ class PropertyEmbedding(torch.nn.Module):
             and self.unconditional_embedding_module.only_depends_on_shape_of_input
         ):
             # this allows evaluation of the unconditional score without having to supply conditional values for this property
-            return self.unconditional_embedding_module(x=batch["num_atoms"]).to(batch.pos.device)
+            # while sampling, the embedding is only computed once for all denoising steps
+            return cached_conditioning(
+                key=(id(self), "unconditional", len(batch["num_atoms"]), batch.pos.device),
+                compute=lambda: self.unconditional_embedding_module(x=batch["num_atoms"]).to(
+                    batch.pos.device
+                ),
+            )
         else:
             # raw values for the conditional data as seen by the user, eg dft_bulk_modulus=torch.tensor([300]*n_structures_in_batch)
             data = batch[self.name]
-            if isinstance(data, torch.Tensor) and data.dim() == 2:
-                # [B, 1] => [B,]
-                data = data.squeeze(-1)
-
-            # optionally apply normalization, eg unit standard deviation and zero mean
-            data = self.scaler(data)
-            conditional_embedding: torch.Tensor = self.conditional_embedding_module(data)
-            unconditional_embedding: torch.Tensor = self.unconditional_embedding_module(x=data).to(
-                batch.pos.device
+            # while sampling, the embeddings are only computed once for all denoising steps
+            conditional_embedding, unconditional_embedding = cached_conditioning(
+                key=(id(self), batch.pos.device),
+                compute=lambda: self._get_embeddings(data=data, device=batch.pos.device),
+                conditioning=[data],
             )
 
             return torch.where(
                 use_unconditional_embedding, unconditional_embedding, conditional_embedding
             )
 
+    def _get_embeddings(
+        self, data: torch.Tensor | list[str] | list[list[str]], device: torch.device
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """Returns the conditional and unconditional embeddings of the conditional data."""
+        if isinstance(data, torch.Tensor) and data.dim() == 2:
+            # [B, 1] => [B,]
+            data = data.squeeze(-1)
+
+        # optionally apply normalization, eg unit standard deviation and zero mean
+        data = self.scaler(data)
+        conditional_embedding: torch.Tensor = self.conditional_embedding_module(data)
+        unconditional_embedding: torch.Tensor = self.unconditional_embedding_module(x=data).to(
+            device
+        )
+        return conditional_embedding, unconditional_embedding
+
     def fit_scaler(self, all_data):
         if isinstance(self.scaler, torch.nn.Identity):
             return
@@ -6,16 +6,6 @@ from pathlib import Path
 from typing import Literal
 
 import fire
-import numpy as np
-
-from mattergen.common.utils.eval_utils import load_structures
-from mattergen.common.utils.globals import get_device
-from mattergen.evaluation.evaluate import evaluate
-from mattergen.evaluation.reference.reference_dataset_serializer import LMDBGZSerializer
-from mattergen.evaluation.utils.structure_matcher import (
-    DefaultDisorderedStructureMatcher,
-    DefaultOrderedStructureMatcher,
-)
 
 
 def main(
@@ -28,10 +18,33 @@ def main(
         Literal["MatterSim-v1.0.0-1M.pth", "MatterSim-v1.0.0-5M.pth"] | None
     ) = None,
     reference_dataset_path: str | None = None,
-    device: str = str(get_device()),
+    device: str | None = None,
     structures_output_path: str | None = None,
+    cache_path: str | None = None,
+    num_workers: int = 1,
+    profile: bool = False,
+    cache_parsed_structures: bool = False,
 ):
-    structures = load_structures(Path(structures_path))
+    # Heavy dependencies are imported here rather than at module level, so that the command line
+    # interface starts (and prints its help) quickly. See mattergen/scripts/import_time.py.
+    import numpy as np
+
+    from mattergen.common.utils.eval_utils import load_structures
+    from mattergen.common.utils.globals import get_device
+    from mattergen.evaluation.evaluate import evaluate
+    from mattergen.evaluation.reference.reference_dataset_serializer import LMDBGZSerializer
+    from mattergen.evaluation.utils.structure_matcher import (
+        DefaultDisorderedStructureMatcher,
+        DefaultOrderedStructureMatcher,
+    )
+
+    device = device or str(get_device())
+
+    # num_workers processes are also used to parse the structures; if `cache_parsed_structures`,
+    # they are cached next to `structures_path` so that later evaluations of the file skip parsing.
+    structures = load_structures(
+        Path(structures_path), num_workers=num_workers, cache=cache_parsed_structures
+    )
     energies = np.load(energies_path) if energies_path else None
     structure_matcher = (
         DefaultDisorderedStructureMatcher()
@@ -52,6 +65,9 @@ def main(
         reference=reference,
         device=device,
         structures_output_path=structures_output_path,
+        cache_path=cache_path,
+        num_workers=num_workers,
+        profile=profile,
     )
     print(json.dumps(metrics, indent=2))
 
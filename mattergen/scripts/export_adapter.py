@@ -0,0 +1,44 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from pathlib import Path
+
+import fire
+
+from mattergen.adapter_registry import export_adapter
+from mattergen.common.utils.data_classes import PRETRAINED_MODEL_NAME, MatterGenCheckpointInfo
+
+
+def main(
+    model_path: str,
+    output_path: str,
+    base_model_path: str | None = None,
+    base_pretrained_name: PRETRAINED_MODEL_NAME | None = None,
+):
+    """Writes the adapter weights of a fine-tuned model, without the base model weights.
+
+    Args:
+        model_path: path to the fine-tuned model.
+        output_path: path of the adapter checkpoint.
+        base_model_path: path to the base model. If provided (or base_pretrained_name), we verify
+            that the base model weights were not modified during fine-tuning.
+        base_pretrained_name: name of a pretrained base model on the Hugging Face Hub.
+    """
+    base_checkpoint_info = None
+    if base_model_path is not None:
+        base_checkpoint_info = MatterGenCheckpointInfo(Path(base_model_path).resolve())
+    elif base_pretrained_name is not None:
+        base_checkpoint_info = MatterGenCheckpointInfo.from_hf_hub(base_pretrained_name)
+    export_adapter(
+        checkpoint_info=MatterGenCheckpointInfo(Path(model_path).resolve()),
+        path=output_path,
+        base_checkpoint_info=base_checkpoint_info,
+    )
+
+
+def _main():
+    fire.Fire(main)
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,57 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+from pathlib import Path
+from typing import Literal
+
+import fire
+
+from mattergen.common.utils.data_classes import PRETRAINED_MODEL_NAME, MatterGenCheckpointInfo
+from mattergen.common.utils.eval_utils import export_model_for_inference
+
+
+def main(
+    output_path: str,
+    model_path: str | None = None,
+    pretrained_name: PRETRAINED_MODEL_NAME | None = None,
+    checkpoint_epoch: Literal["best", "last"] | int = "last",
+    config_overrides: list[str] | None = None,
+    strict_checkpoint_loading: bool = True,
+):
+    """Writes a model directory with only the weights used for sampling and the resolved config.
+
+    Args:
+        output_path: model directory to write the exported model to.
+        model_path: path to the model to export.
+        pretrained_name: name of a pretrained model on the Hugging Face Hub, instead of model_path.
+        checkpoint_epoch: epoch of the checkpoint to export, or "best" or "last".
+        config_overrides: overrides of the model config, which are applied to the exported config.
+        strict_checkpoint_loading: whether the checkpoint has to match the model exactly.
+    """
+    assert (
+        pretrained_name is not None or model_path is not None
+    ), "Either pretrained_name or model_path must be provided."
+    assert (
+        pretrained_name is None or model_path is None
+    ), "Only one of pretrained_name or model_path can be provided."
+    config_overrides = config_overrides or []
+    if pretrained_name is not None:
+        checkpoint_info = MatterGenCheckpointInfo.from_hf_hub(
+            pretrained_name, config_overrides=config_overrides
+        )
+    else:
+        checkpoint_info = MatterGenCheckpointInfo(
+            model_path=Path(model_path).resolve(),
+            load_epoch=checkpoint_epoch,
+            config_overrides=config_overrides,
+            strict_checkpoint_loading=strict_checkpoint_loading,
+        )
+    export_model_for_inference(checkpoint_info, output_path)
+
+
+def _main():
+    fire.Fire(main)
+
+
+if __name__ == "__main__":
+    _main()
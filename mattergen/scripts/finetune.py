@@ -17,6 +17,7 @@ from pytorch_lightning.cli import SaveConfigCallback
 
 from mattergen.common.utils.data_classes import MatterGenCheckpointInfo
 from mattergen.common.utils.globals import MODELS_PROJECT_ROOT, get_device
+from mattergen.diffusion.lightning_module import load_checkpoint
 from mattergen.diffusion.run import AddConfigCallback, SimpleParser, maybe_instantiate
 
 logger = logging.getLogger(__name__)
@@ -90,7 +91,7 @@ def init_adapter_lightningmodule_from_pretrained(
 
     lightning_module = hydra.utils.instantiate(lightning_module_cfg)
 
-    ckpt: dict = torch.load(ckpt_path, map_location=get_device())
+    ckpt: dict = load_checkpoint(ckpt_path, map_location=get_device())
     pretrained_dict: OrderedDict = ckpt["state_dict"]
     scratch_dict: OrderedDict = lightning_module.state_dict()
     scratch_dict.update(
@@ -100,8 +101,9 @@ def init_adapter_lightningmodule_from_pretrained(
 
     # freeze pretrained weights if not full finetuning.
     if not adapter_cfg.full_finetuning:
+        pretrained_keys = set(pretrained_dict.keys())
         for name, param in lightning_module.named_parameters():
-            if name in set(pretrained_dict.keys()):
+            if name in pretrained_keys:
                 param.requires_grad_(False)
 
     return lightning_module, lightning_module_cfg
@@ -113,6 +115,14 @@ def init_adapter_lightningmodule_from_pretrained(
 def mattergen_finetune(cfg: omegaconf.DictConfig):
     # Tensor Core acceleration (leads to ~2x speed-up during training)
     torch.set_float32_matmul_precision("high")
+    if not cfg.adapter.full_finetuning and "find_unused_parameters" in cfg.trainer.get(
+        "strategy", {}
+    ):
+        # Frozen parameters are not registered with DDP, so they get no gradient buckets. The
+        # search for unused parameters is an extra traversal of the autograd graph in each step,
+        # which is only needed if some adapter parameters do not contribute to the loss.
+        with open_dict(cfg):
+            cfg.trainer.strategy.find_unused_parameters = cfg.adapter.find_unused_parameters
     trainer: pl.Trainer = maybe_instantiate(cfg.trainer, pl.Trainer)
     datamodule: pl.LightningDataModule = maybe_instantiate(cfg.data_module, pl.LightningDataModule)
 
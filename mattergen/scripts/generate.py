@@ -1,16 +1,19 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+from __future__ import annotations
+
 import os
 from pathlib import Path
-from typing import Literal
+from typing import TYPE_CHECKING, Literal
 
 import fire
-from pymatgen.core.structure import Structure
 
-from mattergen.common.data.types import TargetProperty
-from mattergen.common.utils.data_classes import PRETRAINED_MODEL_NAME, MatterGenCheckpointInfo, ProgressCallback
-from mattergen.generator import CrystalGenerator
+if TYPE_CHECKING:
+    from pymatgen.core.structure import Structure
+
+    from mattergen.common.data.types import TargetProperty
+    from mattergen.common.utils.data_classes import PRETRAINED_MODEL_NAME, ProgressCallback
 
 
 def main(
@@ -30,6 +33,18 @@ def main(
     strict_checkpoint_loading: bool = True,
     target_compositions: list[dict[str, int]] | None = None,
     progress_callback: ProgressCallback | None = None,
+    max_num_atoms_per_batch: int | None = None,
+    trajectory_stride: int = 1,
+    trajectory_spacing: Literal["linear", "log"] = "linear",
+    num_processes: int = 1,
+    seed: int | None = None,
+    evaluate: bool = False,
+    potential_load_path: (
+        Literal["MatterSim-v1.0.0-1M.pth", "MatterSim-v1.0.0-5M.pth"] | None
+    ) = None,
+    reference_dataset_path: str | None = None,
+    structure_matcher: Literal["ordered", "disordered"] = "disordered",
+    num_workers: int = 1,
 ) -> list[Structure]:
     """
     Evaluate diffusion model against molecular metrics.
@@ -48,8 +63,23 @@ def main(
         target_compositions: List of dictionaries with target compositions to condition on. Each dictionary should have the form `{element: number_of_atoms}`. If None, the target compositions are not conditioned on.
            Only supported for models trained for crystal structure prediction (CSP) (default: None)
         progress_callback: Optional callback function that takes in a single float argument representing the progress of the generation process (between 0 and 1).
+        max_num_atoms_per_batch: If set, use continuous batching: crystals that finish denoising are immediately replaced by new ones, keeping up to this many atoms in each denoising step. Requires `--record_trajectories=False`. (default: None)
+        trajectory_stride: Record the trajectories only at every `trajectory_stride`-th denoising step. Larger values make recording cheaper. (default: 1)
+        trajectory_spacing: "linear" to record equally spaced steps, or "log" to record `num_steps / trajectory_stride` steps log-spaced in diffusion time, i.e., more steps close to the end of denoising. (default: linear)
+        num_processes: Number of processes generating in parallel, each on a contiguous shard of the batches. The processes use the available GPUs in turn, or share the CPU cores. The structures are saved in the same order as with a single process. (default: 1)
+        seed: Random seed. Each structure draws its random numbers from its own stream, selected by the seed and the index of the structure, so the generated structures are the same for the same seed, regardless of `num_processes`. (default: None)
+        evaluate: Whether to relax and evaluate the structures like `mattergen-evaluate --relax=True`, overlapped with generation: each batch is relaxed as soon as it is generated. The metrics are written to `{output_path}/metrics.json` and the relaxed structures to `{output_path}/relaxed_structures.extxyz`. (default: False)
+        potential_load_path: Machine learning potential used for relaxation when `evaluate` is True. (default: None, i.e., the MatterSim default)
+        reference_dataset_path: Path to the reference dataset used when `evaluate` is True. (default: None, i.e., the MP2020 correction reference dataset)
+        structure_matcher: Structure matcher used when `evaluate` is True, "ordered" or "disordered". (default: disordered)
+        num_workers: Number of processes building the structure summaries when `evaluate` is True. (default: 1)
     NOTE: When specifying dictionary values via the CLI, make sure there is no whitespace between the key and value, e.g., `--properties_to_condition_on={key1:value1}`.
     """
+    # Heavy dependencies are imported here rather than at module level, so that the command line
+    # interface starts (and prints its help) quickly. See mattergen/scripts/import_time.py.
+    from mattergen.common.utils.data_classes import MatterGenCheckpointInfo
+    from mattergen.generator import CrystalGenerator
+
     assert (
         pretrained_name is not None or model_path is not None
     ), "Either pretrained_name or model_path must be provided."
@@ -96,8 +126,46 @@ def main(
         ),
         target_compositions_dict=target_compositions,
         progress_callback=progress_callback,
+        max_num_atoms_per_batch=max_num_atoms_per_batch,
+        trajectory_stride=trajectory_stride,
+        trajectory_spacing=trajectory_spacing,
+        num_processes=num_processes,
+        seed=seed,
+    )
+    if not evaluate:
+        return generator.generate(output_dir=Path(output_path))
+
+    from mattergen.common.utils.globals import get_device
+    from mattergen.evaluation.pipeline import EvaluationPipeline
+    from mattergen.evaluation.reference.reference_dataset_serializer import LMDBGZSerializer
+    from mattergen.evaluation.utils.relaxation import StructureRelaxer
+    from mattergen.evaluation.utils.structure_matcher import (
+        DefaultDisorderedStructureMatcher,
+        DefaultOrderedStructureMatcher,
     )
-    return generator.generate(output_dir=Path(output_path))
+
+    reference = None
+    if reference_dataset_path:
+        reference = LMDBGZSerializer().deserialize(reference_dataset_path)
+    with EvaluationPipeline(
+        relax_fn=StructureRelaxer(
+            device=str(get_device()), potential_load_path=potential_load_path
+        ),
+        reference=reference,
+        structure_matcher=(
+            DefaultDisorderedStructureMatcher()
+            if structure_matcher == "disordered"
+            else DefaultOrderedStructureMatcher()
+        ),
+        num_workers=num_workers,
+    ) as pipeline:
+        generator.structures_callback = pipeline.submit
+        structures = generator.generate(output_dir=Path(output_path))
+        pipeline.finish(
+            save_as=os.path.join(output_path, "metrics.json"),
+            structures_output_path=os.path.join(output_path, "relaxed_structures.extxyz"),
+        )
+    return structures
 
 
 def _main():
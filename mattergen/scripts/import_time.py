@@ -0,0 +1,92 @@
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""
+Reports how long it takes to import the command line tools, based on `python -X importtime`.
+
+    python -m mattergen.scripts.import_time --budget_seconds=0.5
+
+The command fails if a tool takes longer than the budget to import or if it imports one of
+HEAVY_MODULES at module level. Those should only be imported when a command actually runs.
+"""
+
+import json
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+
+import fire
+
+CLI_MODULES = ["mattergen.scripts.generate", "mattergen.scripts.evaluate"]
+HEAVY_MODULES = [
+    "torch",
+    "torch_geometric",
+    "torch_sparse",
+    "pytorch_lightning",
+    "pymatgen",
+    "ase",
+    "mattersim",
+    "smact",
+    "pandas",
+]
+
+# e.g. "import time:       458 |     939391 |     pytorch_lightning.loops.utilities"
+_IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+@dataclass
+class ImportTimeReport:
+    module: str
+    # cumulative import time of the module in seconds
+    total_seconds: float
+    # modules with the largest cumulative import time, with their time in seconds
+    slowest: list[tuple[str, float]]
+    # top-level packages of HEAVY_MODULES that are imported with the module
+    heavy_modules: list[str]
+
+
+def get_import_time_report(module: str, num_slowest: int = 10) -> ImportTimeReport:
+    """Imports `module` in a fresh interpreter and returns its import time report."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import json, sys, {module}; print(json.dumps(sorted(sys.modules)))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match is not None:
+            times[match.group(4)] = int(match.group(2)) / 1e6
+    imported = {name.split(".")[0] for name in json.loads(result.stdout.splitlines()[-1])}
+    return ImportTimeReport(
+        module=module,
+        total_seconds=times[module],
+        slowest=sorted(times.items(), key=lambda x: x[1], reverse=True)[:num_slowest],
+        heavy_modules=[m for m in HEAVY_MODULES if m in imported],
+    )
+
+
+def main(budget_seconds: float = 1.0, num_slowest: int = 10) -> None:
+    within_budget = True
+    for module in CLI_MODULES:
+        report = get_import_time_report(module, num_slowest=num_slowest)
+        print(f"{module}: {report.total_seconds:.3f}s (budget {budget_seconds:.3f}s)")
+        for name, seconds in report.slowest:
+            print(f"    {seconds:8.3f}s  {name}")
+        if report.heavy_modules:
+            print(f"    imports heavy modules: {', '.join(report.heavy_modules)}")
+        within_budget &= report.total_seconds <= budget_seconds and not report.heavy_modules
+    if not within_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,182 @@
+from types import SimpleNamespace
+
+import hydra
+import pytest
+import torch
+
+from mattergen.adapter import ADAPTER_ID, GemNetTAdapter
+from mattergen.adapter_registry import Adapter, AdapterRegistry
+from mattergen.common.data.chemgraph import ChemGraph
+from mattergen.common.data.collate import collate
+from mattergen.common.gemnet.gemnet_ctrl import GemNetTCtrl
+from mattergen.common.gemnet.layers.embedding_block import AtomEmbedding
+from mattergen.diffusion.lightning_module import DiffusionLightningModule
+from mattergen.property_embeddings import replace_use_unconditional_embedding
+
+HIDDEN_DIM = 16
+
+
+def get_property_embedding_config(name: str) -> dict:
+    return {
+        "_target_": "mattergen.property_embeddings.PropertyEmbedding",
+        "name": name,
+        "unconditional_embedding_module": {
+            "_target_": "mattergen.property_embeddings.EmbeddingVector",
+            "hidden_dim": HIDDEN_DIM,
+        },
+        "conditional_embedding_module": {
+            "_target_": "mattergen.diffusion.model_utils.NoiseLevelEncoding",
+            "d_model": HIDDEN_DIM,
+        },
+        "scaler": {"_target_": "mattergen.common.utils.data_utils.StandardScalerTorch"},
+    }
+
+
+def make_model(conditions: list[str]) -> GemNetTAdapter:
+    gemnet = GemNetTCtrl(
+        condition_on_adapt=conditions,
+        num_targets=1,
+        latent_dim=HIDDEN_DIM,
+        atom_embedding=AtomEmbedding(emb_size=HIDDEN_DIM, with_mask_type=True),
+        num_blocks=2,
+        emb_size_atom=HIDDEN_DIM,
+        emb_size_edge=HIDDEN_DIM,
+        regress_stress=True,
+        otf_graph=True,
+        max_neighbors=20,
+        cutoff=5.0,
+    )
+    property_embeddings_adapt = {
+        cond: hydra.utils.instantiate(get_property_embedding_config(cond)) for cond in conditions
+    }
+    return GemNetTAdapter(
+        gemnet=gemnet, hidden_dim=HIDDEN_DIM, property_embeddings_adapt=property_embeddings_adapt
+    ).eval()
+
+
+def fine_tune(base: GemNetTAdapter, conditions: list[str]) -> GemNetTAdapter:
+    """Returns an adapter model with the base weights of `base` and random adapter weights."""
+    model = make_model(conditions)
+    model.load_state_dict(base.state_dict(), strict=False)
+    for name, param in model.named_parameters():
+        if "cond_mixin_layers" in name:
+            torch.nn.init.normal_(param, std=0.1)
+    for property_embedding in model.property_embeddings_adapt.values():
+        property_embedding.fit_scaler(torch.rand(10, 1))
+    return model
+
+
+@pytest.fixture
+def batch() -> ChemGraph:
+    torch.manual_seed(0)
+    x = collate(
+        [
+            ChemGraph(
+                pos=torch.rand(num_atoms, 3),
+                cell=4.0 * torch.eye(3)[None],
+                atomic_numbers=atomic_numbers,
+                num_atoms=torch.tensor([num_atoms]),
+                dft_band_gap=torch.tensor([[band_gap]]),
+                dft_mag_density=torch.tensor([[mag_density]]),
+            )
+            for num_atoms, atomic_numbers, band_gap, mag_density in [
+                (2, torch.tensor([3, 8]), 1.0, 0.1),
+                (4, torch.tensor([26, 26, 8, 8]), 2.0, 0.2),
+            ]
+        ]
+    )
+    conditional = torch.zeros(2, 1, dtype=torch.bool)
+    return replace_use_unconditional_embedding(
+        batch=x,
+        use_unconditional_embedding={"dft_band_gap": conditional, "dft_mag_density": conditional},
+    )
+
+
+def test_adapter_registry_matches_fine_tuned_models(batch: ChemGraph, tmp_path):
+    torch.manual_seed(1)
+    base = make_model(conditions=[])
+    fine_tuned = {
+        "band_gap": fine_tune(base, ["dft_band_gap"]),
+        "magnetic": fine_tune(base, ["dft_mag_density", "dft_band_gap"]),
+    }
+    registry = AdapterRegistry(SimpleNamespace(diffusion_module=SimpleNamespace(model=base)))
+    for name, model in fine_tuned.items():
+        config = {
+            cond: get_property_embedding_config(cond) for cond in model.property_embeddings_adapt
+        }
+        Adapter.from_model(model).save(tmp_path / f"{name}.pt", config)
+        registry.load_adapter(name, tmp_path / f"{name}.pt")
+
+    # the adapter checkpoint does not contain any base weights
+    adapter_state_dict = torch.load(tmp_path / "band_gap.pt")["state_dict"]
+    assert sum(v.numel() for v in adapter_state_dict.values()) < sum(
+        v.numel() for v in base.state_dict().values()
+    )
+    assert not any(
+        k.startswith(("gemnet.int_blocks", "gemnet.out_blocks")) for k in adapter_state_dict
+    )
+
+    t = torch.tensor([0.5, 0.5])
+    with torch.no_grad():
+        base_output = base(batch, t)
+        # switch adapters back and forth without reloading
+        for name in ["band_gap", "magnetic", "band_gap"]:
+            expected = fine_tuned[name](batch, t)
+            with registry.use(name) as pl_module:
+                output = pl_module.diffusion_module.model(batch, t)
+            torch.testing.assert_close(output.pos, expected.pos)
+            torch.testing.assert_close(output.cell, expected.cell)
+            torch.testing.assert_close(output.atomic_numbers, expected.atomic_numbers)
+            assert not torch.allclose(output.pos, base_output.pos)
+        assert registry.active is None
+        torch.testing.assert_close(base(batch, t).pos, base_output.pos)
+
+
+def test_adapter_registry_raises_for_unknown_adapter():
+    registry = AdapterRegistry(
+        SimpleNamespace(diffusion_module=SimpleNamespace(model=make_model(conditions=[])))
+    )
+    with pytest.raises(KeyError):
+        registry.activate("dft_band_gap")
+
+
+def test_adapter_registry_routes_mixed_batch(batch: ChemGraph, tmp_path):
+    torch.manual_seed(2)
+    base = make_model(conditions=[])
+    fine_tuned = {
+        "band_gap": fine_tune(base, ["dft_band_gap"]),
+        "magnetic": fine_tune(base, ["dft_mag_density", "dft_band_gap"]),
+    }
+    registry = AdapterRegistry(SimpleNamespace(diffusion_module=SimpleNamespace(model=base)))
+    for name, model in fine_tuned.items():
+        registry.register_adapter(name, Adapter.from_model(model))
+
+    t = torch.tensor([0.5, 0.5])
+    # first structure (atoms 0-1) targets the band gap, second one (atoms 2-5) magnetic density
+    with torch.no_grad(), registry.use(["band_gap", "magnetic"]) as pl_module:
+        model = pl_module.diffusion_module.model
+        assert set(model.cond_fields_model_was_trained_on) == {"dft_band_gap", "dft_mag_density"}
+        mixed_batch = batch.replace(
+            **{ADAPTER_ID: registry.get_adapter_ids(["band_gap", "magnetic"])}
+        )
+        output = model(mixed_batch, t)
+        expected_band_gap = fine_tuned["band_gap"](batch, t)
+        expected_magnetic = fine_tuned["magnetic"](batch, t)
+    assert registry.active is None
+    torch.testing.assert_close(output.pos[:2], expected_band_gap.pos[:2])
+    torch.testing.assert_close(output.pos[2:], expected_magnetic.pos[2:])
+    torch.testing.assert_close(output.cell[0], expected_band_gap.cell[0])
+    torch.testing.assert_close(output.cell[1], expected_magnetic.cell[1])
+
+
+def test_optimizer_only_contains_adapter_parameters_of_frozen_model():
+    base = make_model(conditions=[])
+    model = fine_tune(base, ["dft_band_gap"])
+    base_keys = set(base.state_dict())
+    for name, param in model.named_parameters():
+        param.requires_grad_(name not in base_keys)
+    pl_module = DiffusionLightningModule(diffusion_module=torch.nn.ModuleDict({"model": model}))
+
+    optimizer = pl_module.configure_optimizers()
+    optimized = {id(p) for group in optimizer.param_groups for p in group["params"]}
+    assert optimized == {id(p) for p in Adapter.from_model(model).parameters()}
@@ -0,0 +1,45 @@
+import torch
+
+from mattergen.common.data.batch_operations import ChemGraphBatchOperations
+from mattergen.common.data.chemgraph import ChemGraph
+from mattergen.common.data.collate import collate
+
+
+def get_batch(num_atoms: list[int], chemical_systems: list[list[str]]) -> ChemGraph:
+    batch = collate(
+        [
+            ChemGraph(
+                pos=torch.rand(n, 3),
+                cell=torch.eye(3)[None],
+                atomic_numbers=torch.full((n,), 8),
+                num_atoms=torch.tensor([n]),
+            )
+            for n in num_atoms
+        ]
+    )
+    # conditioning values are set on the collated batch, see set_conditional_property_values
+    return batch.replace(
+        chemical_system=chemical_systems,
+        dft_band_gap=torch.tensor(num_atoms, dtype=torch.float)[:, None],
+    )
+
+
+def test_select_and_concatenate():
+    ops = ChemGraphBatchOperations()
+    x = get_batch([1, 2, 3], [["O"], ["Li", "O"], ["F", "O"]])
+    y = get_batch([4], [["Mg", "O"]])
+
+    selected = ops.select(x, torch.tensor([2, 0]))
+    assert selected.num_atoms.tolist() == [3, 1]
+    assert ops.get_sizes(selected).tolist() == [3, 1]
+    torch.testing.assert_close(selected.pos, x.pos[[3, 4, 5, 0]])
+    assert selected.chemical_system == [["F", "O"], ["O"]]
+    assert selected.dft_band_gap.tolist() == [[3.0], [1.0]]
+
+    concatenated = ops.concatenate([selected, y])
+    assert concatenated.get_batch_size() == 3
+    assert concatenated.num_atoms.tolist() == [3, 1, 4]
+    assert concatenated.batch.tolist() == [0, 0, 0, 1, 2, 2, 2, 2]
+    torch.testing.assert_close(concatenated.pos, torch.cat([selected.pos, y.pos]))
+    assert concatenated.chemical_system == [["F", "O"], ["O"], ["Mg", "O"]]
+    assert concatenated.dft_band_gap.tolist() == [[3.0], [1.0], [4.0]]
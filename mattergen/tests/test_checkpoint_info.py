@@ -0,0 +1,41 @@
+import os
+from pathlib import Path
+
+from mattergen.common.utils import data_classes
+from mattergen.common.utils.data_classes import MatterGenCheckpointInfo
+
+
+def test_config_is_composed_once(tmp_path: Path):
+    (tmp_path / "config.yaml").write_text("model:\n  hidden_dim: 8\n")
+    data_classes._compose_config.cache_clear()
+    info = MatterGenCheckpointInfo(
+        model_path=str(tmp_path), config_overrides=["model.hidden_dim=16"]
+    )
+
+    cfg = info.config
+    cfg.model.hidden_dim = 32
+    assert info.config.model.hidden_dim == 16
+    assert data_classes._compose_config.cache_info().misses == 1
+
+    # a modified config file is composed again
+    (tmp_path / "config.yaml").write_text("model:\n  hidden_dim: 8\n  num_layers: 2\n")
+    os.utime(tmp_path / "config.yaml", (0, 1))
+    assert info.config.model.num_layers == 2
+
+
+def test_checkpoint_path(tmp_path: Path):
+    for name in ["checkpoints/last.ckpt", "checkpoints/epoch=1-loss_val=0.2.ckpt"]:
+        (tmp_path / name).parent.mkdir(exist_ok=True)
+        (tmp_path / name).touch()
+    (tmp_path / "version_0").mkdir()
+    (tmp_path / "version_0" / "epoch=2-loss_val=0.1.ckpt").touch()
+
+    assert MatterGenCheckpointInfo(str(tmp_path)).checkpoint_path == str(
+        tmp_path / "checkpoints" / "last.ckpt"
+    )
+    assert MatterGenCheckpointInfo(str(tmp_path), load_epoch=1).checkpoint_path == str(
+        tmp_path / "checkpoints" / "epoch=1-loss_val=0.2.ckpt"
+    )
+    assert MatterGenCheckpointInfo(str(tmp_path), load_epoch="best").checkpoint_path == str(
+        tmp_path / "version_0" / "epoch=2-loss_val=0.1.ckpt"
+    )
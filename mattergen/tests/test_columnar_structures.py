@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from pymatgen.core import Lattice, Structure
+
+from mattergen.common.utils.columnar_structures import (
+    ColumnarStructures,
+    ColumnarStructureWriter,
+    save_columnar_structures,
+)
+from mattergen.common.utils.eval_utils import load_structures, save_trajectories_as_extxyz
+
+
+def get_structures() -> list[Structure]:
+    return [
+        Structure(Lattice.cubic(3.0), ["Si"], [[0.0, 0.0, 0.0]]),
+        Structure(
+            Lattice.from_parameters(4.0, 5.0, 6.0, 80.0, 95.0, 110.0),
+            ["Na", "Cl", "Cl"],
+            [[0.0, 0.0, 0.0], [0.5, 0.5, 0.5], [0.25, 0.1, 0.9]],
+        ),
+        Structure(Lattice.hexagonal(2.5, 4.0), ["C", "C"], [[0.0, 0.0, 0.0], [1 / 3, 2 / 3, 0.5]]),
+    ]
+
+
+def test_round_trip(tmp_path: Path):
+    structures = get_structures()
+    path = tmp_path / "structures.npz"
+    with ColumnarStructureWriter(path) as writer:
+        # append in chunks
+        writer.append_structures(structures[:1])
+        writer.append_structures(structures[1:])
+
+    loaded = load_structures(path)
+
+    assert isinstance(loaded, ColumnarStructures)
+    assert isinstance(loaded.columns["pos"], np.memmap)
+    assert len(loaded) == len(structures)
+    for original, read in zip(structures, loaded):
+        assert read.matches(original)
+        assert np.allclose(read.lattice.matrix, original.lattice.matrix, atol=1e-5)
+        assert np.allclose(read.frac_coords, original.frac_coords, atol=1e-6)
+    assert [s.formula for s in loaded[1:]] == [s.formula for s in structures[1:]]
+    assert loaded[-1].formula == structures[-1].formula
+
+
+def test_compressed_npz_is_loaded(tmp_path: Path):
+    structures = get_structures()
+    path = tmp_path / "structures.npz"
+    save_columnar_structures(path, structures)
+    compressed_path = tmp_path / "compressed.npz"
+    np.savez_compressed(compressed_path, **ColumnarStructures(path).columns)
+
+    loaded = ColumnarStructures(compressed_path)
+
+    assert [s.formula for s in loaded] == [s.formula for s in structures]
+
+
+def test_trajectories(tmp_path: Path):
+    path = tmp_path / "trajectories.npz"
+    rng = np.random.default_rng(0)
+    with ColumnarStructureWriter(path) as writer:
+        for num_frames, num_atoms in [(4, 2), (3, 5)]:
+            writer.append_trajectory(
+                pos=rng.random((num_frames, num_atoms, 3)),
+                cell=np.tile(np.eye(3) * 4.0, (num_frames, 1, 1)),
+                atomic_numbers=np.full((num_frames, num_atoms), 6),
+            )
+
+    trajectories = ColumnarStructures(path)
+
+    assert len(trajectories) == 7
+    assert trajectories.num_trajectories == 2
+    assert [len(s) for s in trajectories.get_trajectory(1)] == [5, 5, 5]
+
+    save_trajectories_as_extxyz(tmp_path / "trajectories.zip", trajectories)
+    assert (tmp_path / "trajectories.zip").exists()
+
+
+def test_exception_discards_file(tmp_path: Path):
+    path = tmp_path / "structures.npz"
+    with pytest.raises(ValueError):
+        with ColumnarStructureWriter(path) as writer:
+            writer.append_structures(get_structures())
+            writer.append(
+                pos=np.zeros((2, 3)), cell=np.eye(3)[None], atomic_numbers=[1], num_atoms=[2]
+            )
+    assert not path.exists()
@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+from pymatgen.core import Lattice, Structure
+from pymatgen.entries.computed_entries import ComputedStructureEntry
+
+from mattergen.evaluation.reference.reference_dataset import ReferenceDataset
+from mattergen.evaluation.utils.dataset_matcher import (
+    DisorderedDatasetUniquenessComputer,
+    OrderedDatasetUniquenessComputer,
+    get_uniqueness_bucket_key,
+)
+from mattergen.evaluation.utils.structure_matcher import (
+    DefaultDisorderedStructureMatcher,
+    DefaultOrderedStructureMatcher,
+)
+
+
+def _perturbed(structure: Structure, rng: np.random.Generator, scale: float) -> Structure:
+    structure = structure.copy()
+    structure.perturb(scale * rng.random())
+    structure.scale_lattice(structure.volume * (1 + 0.1 * rng.random()))
+    return structure
+
+
+@pytest.fixture
+def dataset() -> ReferenceDataset:
+    rng = np.random.default_rng(0)
+    rocksalt = Structure.from_spacegroup(
+        "Fm-3m", Lattice.cubic(4.2), ["Mg", "O"], [[0, 0, 0], [0.5, 0.5, 0.5]]
+    )
+    cscl = Structure(Lattice.cubic(2.6), ["Mg", "O"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    fe_ni = Structure(Lattice.cubic(2.9), ["Fe", "Ni"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    prototypes = [
+        rocksalt,
+        cscl,
+        cscl * (2, 1, 1),
+        fe_ni,
+        Structure(
+            Lattice.cubic(2.9),
+            ["Fe", "Fe", "Ni", "Ni"],
+            [[0, 0, 0], [0.5, 0.5, 0.5], [0.5, 0, 0], [0, 0.5, 0.5]],
+        ),
+        Structure(Lattice.cubic(2.9), [{"Fe": 0.5, "Ni": 0.5}], [[0, 0, 0]]),
+    ]
+    structures = [
+        _perturbed(prototypes[i], rng, scale=0.5) for i in rng.integers(len(prototypes), size=30)
+    ]
+    entries = [ComputedStructureEntry(structure=s, energy=np.nan) for s in structures]
+    for i, e in enumerate(entries):
+        e.entry_id = i
+    return ReferenceDataset.from_entries("data", entries)
+
+
+def test_ordered_uniqueness_with_buckets(dataset: ReferenceDataset):
+    ordered_dataset = ReferenceDataset.from_entries(
+        "data", [e for e in dataset if e.structure.is_ordered]
+    )
+    for i, e in enumerate(ordered_dataset):
+        e.entry_id = i
+    structure_matcher = DefaultOrderedStructureMatcher()
+    expected = OrderedDatasetUniquenessComputer(structure_matcher, use_buckets=False)(
+        ordered_dataset
+    )
+    result = OrderedDatasetUniquenessComputer(structure_matcher, use_buckets=True)(ordered_dataset)
+    np.testing.assert_array_equal(result, expected)
+    assert 0 < expected.sum() < len(expected)
+
+
+class CountingDisorderedStructureMatcher(DefaultDisorderedStructureMatcher):
+    def __init__(self):
+        super().__init__()
+        self.num_fit_calls = 0
+
+    def fit(self, structure_1: Structure, structure_2: Structure) -> bool:
+        self.num_fit_calls += 1
+        return super().fit(structure_1, structure_2)
+
+
+def test_ordered_uniqueness_with_disordered_matcher_buckets():
+    # the default combination of the evaluation, since generated structures are ordered
+    rng = np.random.default_rng(0)
+    prototypes = [
+        Structure(Lattice.cubic(4.0), ["Mg", "O"] * n, rng.random((2 * n, 3))) for n in [1, 2, 3]
+    ]
+    structures = [
+        _perturbed(prototypes[i], rng, scale=0.05) for i in rng.integers(len(prototypes), size=12)
+    ]
+    entries = [ComputedStructureEntry(structure=s, energy=np.nan) for s in structures]
+    for i, e in enumerate(entries):
+        e.entry_id = i
+    dataset = ReferenceDataset.from_entries("data", entries)
+
+    exhaustive_matcher = CountingDisorderedStructureMatcher()
+    expected = OrderedDatasetUniquenessComputer(exhaustive_matcher, use_buckets=False)(dataset)
+    bucketed_matcher = CountingDisorderedStructureMatcher()
+    result = OrderedDatasetUniquenessComputer(bucketed_matcher, use_buckets=True)(dataset)
+    np.testing.assert_array_equal(result, expected)
+    assert 0 < expected.sum() < len(expected)
+    # structures of different sizes are not compared
+    assert bucketed_matcher.num_fit_calls < exhaustive_matcher.num_fit_calls
+
+
+def test_disordered_uniqueness_with_buckets(dataset: ReferenceDataset):
+    structure_matcher = DefaultDisorderedStructureMatcher()
+    expected = DisorderedDatasetUniquenessComputer(structure_matcher, use_buckets=False)(dataset)
+    result = DisorderedDatasetUniquenessComputer(structure_matcher, use_buckets=True)(dataset)
+    np.testing.assert_array_equal(result, expected)
+    assert 0 < expected.sum() < len(expected)
+
+
+def test_uniqueness_bucket_keys():
+    cscl = Structure(Lattice.cubic(2.6), ["Mg", "O"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    disordered = Structure(Lattice.cubic(2.9), [{"Fe": 0.5, "Ni": 0.5}], [[0, 0, 0]])
+    ordered_matcher = DefaultOrderedStructureMatcher()
+    disordered_matcher = DefaultDisorderedStructureMatcher()
+
+    # supercells reduce to the same primitive cell
+    assert get_uniqueness_bucket_key(ordered_matcher, cscl) == get_uniqueness_bucket_key(
+        ordered_matcher, cscl * (2, 2, 1)
+    )
+    # Mg and O cannot substitute each other, so the ordered matcher keeps the number of sites
+    assert get_uniqueness_bucket_key(disordered_matcher, cscl) == ("MgO", 2)
+    assert get_uniqueness_bucket_key(disordered_matcher, cscl * (2, 2, 1)) == ("MgO", 2)
+    # Fe and Ni can, so an ordered FeNi can match disordered versions of other sizes
+    fe_ni = Structure(Lattice.cubic(2.9), ["Fe", "Ni"], [[0, 0, 0], [0.5, 0.5, 0.5]])
+    assert get_uniqueness_bucket_key(disordered_matcher, fe_ni) == ("FeNi",)
+    assert get_uniqueness_bucket_key(disordered_matcher, disordered) is None
+    assert get_uniqueness_bucket_key(ordered_matcher, cscl, bucket_by_space_group=True) == (2, 221)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from pymatgen.analysis.phase_diagram import PhaseDiagram
+from pymatgen.core import Composition, Lattice, Structure
+from pymatgen.entries.computed_entries import ComputedStructureEntry
+
+from mattergen.evaluation.metrics.energy import EnergyMetricsCapability
+from mattergen.evaluation.reference.reference_dataset import ReferenceDataset
+from mattergen.evaluation.utils.metrics_structure_summary import MetricsStructureSummary
+from mattergen.evaluation.utils.utils import expand_into_subsystems
+
+ELEMENTS = ["Li", "Fe", "P", "O"]
+
+
+def _random_entry(rng: np.random.Generator, elements: list[str]) -> ComputedStructureEntry:
+    species = [el for el in elements for _ in range(rng.integers(1, 4))]
+    structure = Structure(
+        Lattice.cubic(2.0 * len(species) ** (1 / 3)), species, rng.random((len(species), 3))
+    )
+    energy = -len(species) * rng.uniform(1.0, 4.0)
+    return ComputedStructureEntry(structure=structure, energy=energy)
+
+
+@pytest.fixture
+def energy_capability() -> EnergyMetricsCapability:
+    rng = np.random.default_rng(0)
+    reference_entries = [
+        entry
+        for subsystem in expand_into_subsystems("-".join(ELEMENTS))
+        for _ in range(3 if len(subsystem) == 1 else 10)
+        for entry in [_random_entry(rng, list(subsystem))]
+    ]
+    for i, entry in enumerate(reference_entries):
+        entry.entry_id = f"ref-{i}"
+    reference = ReferenceDataset.from_entries("reference", reference_entries)
+    structure_summaries = [
+        MetricsStructureSummary(entry=_random_entry(rng, list(elements)))
+        for elements in [ELEMENTS, ELEMENTS[:3], ELEMENTS, ["Li", "O"], ELEMENTS[1:], ELEMENTS]
+    ]
+    return EnergyMetricsCapability(
+        structure_summaries=structure_summaries, reference_dataset=reference
+    )
+
+
+def _get_entries_of_subsystems(
+    dataset: ReferenceDataset, chemical_system: str, include_chemical_system: bool = True
+) -> list[ComputedStructureEntry]:
+    return [
+        entry
+        for subsystem in expand_into_subsystems(chemical_system)
+        for key in ["-".join(sorted(subsystem))]
+        if include_chemical_system or key != chemical_system
+        for entry in dataset.entries_by_chemsys.get(key, [])
+    ]
+
+
+def test_energy_above_hull_with_shared_subsystem_hulls(energy_capability: EnergyMetricsCapability):
+    """Compares against phase diagrams built from all reference entries of all subsystems."""
+    reference = energy_capability.reference_dataset
+    for chemsys, entries in energy_capability.dataset.entries_by_chemsys.items():
+        ids = [e.entry_id for e in entries]
+        reference_diagram = PhaseDiagram(_get_entries_of_subsystems(reference, chemsys))
+        np.testing.assert_allclose(
+            energy_capability.energy_above_hull[ids],
+            [reference_diagram.get_e_above_hull(e, allow_negative=True) for e in entries],
+            atol=1e-8,
+        )
+        self_consistent_diagram = PhaseDiagram(
+            _get_entries_of_subsystems(reference, chemsys, include_chemical_system=False) + entries
+        )
+        np.testing.assert_allclose(
+            energy_capability.self_consistent_energy_above_hull[ids],
+            [self_consistent_diagram.get_e_above_hull(e, allow_negative=True) for e in entries],
+            atol=1e-8,
+        )
+        full_diagram = energy_capability._get_full_phase_diagram(chemsys)
+        expected_full_diagram = PhaseDiagram(
+            _get_entries_of_subsystems(reference, chemsys) + entries
+        )
+        for composition in [Composition("LiFePO4"), Composition("Li2O"), entries[0].composition]:
+            if set(composition.chemical_system.split("-")) <= set(chemsys.split("-")):
+                assert full_diagram.get_hull_energy_per_atom(composition) == pytest.approx(
+                    expected_full_diagram.get_hull_energy_per_atom(composition)
+                )
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from pymatgen.core import Structure
+
+from mattergen.evaluation.metrics.evaluator import MetricsEvaluator
+from mattergen.evaluation.pipeline import EvaluationPipeline
+from mattergen.evaluation.reference.reference_dataset import ReferenceDataset
+from mattergen.evaluation.utils.structure_matcher import DefaultOrderedStructureMatcher
+from mattergen.evaluation.utils.vasprunlike import IdentityCorrectionScheme
+from mattergen.tests.test_incremental_evaluation import (  # noqa: F401
+    reference,
+    structures_and_energies,
+)
+
+
+class LookupRelaxer:
+    """Returns the structures unchanged with known energies."""
+
+    def __init__(self, structures: list[Structure], energies: list[float]):
+        self.energies = {id(s): e for s, e in zip(structures, energies)}
+        self.batch_sizes: list[int] = []
+
+    def __call__(self, structures: list[Structure]) -> tuple[list[Structure], np.ndarray]:
+        self.batch_sizes.append(len(structures))
+        return structures, np.array([self.energies[id(s)] for s in structures])
+
+
+def test_pipeline_matches_evaluation(reference: ReferenceDataset, structures_and_energies):
+    structures, energies = structures_and_energies
+    expected = MetricsEvaluator.from_structures_and_energies(
+        structures=structures,
+        energies=energies,
+        original_structures=structures,
+        reference=reference,
+        structure_matcher=DefaultOrderedStructureMatcher(),
+        energy_correction_scheme=IdentityCorrectionScheme(),
+    ).compute_metrics(metrics="all")
+
+    relaxer = LookupRelaxer(structures, energies)
+    with EvaluationPipeline(
+        relax_fn=relaxer,
+        reference=reference,
+        structure_matcher=DefaultOrderedStructureMatcher(),
+        energy_correction_scheme=IdentityCorrectionScheme(),
+        num_workers=2,
+        max_queued_batches=1,
+    ) as pipeline:
+        for i in range(0, len(structures), 3):
+            pipeline.submit(structures[i : i + 3])
+        metrics = pipeline.finish()
+
+    assert relaxer.batch_sizes == [3, 3, 3, 1]
+    assert metrics.keys() == expected.keys()
+    for k, v in expected.items():
+        assert metrics[k] == pytest.approx(v, nan_ok=True), k
+
+
+def test_pipeline_raises_relaxation_errors(reference: ReferenceDataset, structures_and_energies):
+    structures, _ = structures_and_energies
+
+    def fail(structures: list[Structure]) -> tuple[list[Structure], np.ndarray]:
+        raise ValueError("relaxation failed")
+
+    with EvaluationPipeline(relax_fn=fail, reference=reference) as pipeline:
+        pipeline.submit(structures[:2])
+        with pytest.raises(RuntimeError, match="Evaluation pipeline failed") as exc_info:
+            pipeline.finish()
+    assert isinstance(exc_info.value.__cause__, ValueError)
@@ -0,0 +1,67 @@
+import json
+from pathlib import Path
+
+from pymatgen.analysis.phase_diagram import PhaseDiagram
+from pymatgen.analysis.structure_matcher import StructureMatcher
+from pymatgen.core import Lattice, Structure
+from pymatgen.entries.computed_entries import ComputedStructureEntry
+
+from mattergen.evaluation.metrics.evaluator import MetricsEvaluator
+from mattergen.evaluation.metrics.structure import StructureMetricsCapability
+from mattergen.evaluation.reference.reference_dataset import ReferenceDataset
+from mattergen.evaluation.utils.profiling import EvaluationProfiler, get_profile_path
+from mattergen.evaluation.utils.structure_matcher import DefaultOrderedStructureMatcher
+from mattergen.evaluation.utils.vasprunlike import IdentityCorrectionScheme
+
+
+def _cscl(a: float, cation: str, anion: str) -> Structure:
+    return Structure(Lattice.cubic(a), [cation, anion], [[0, 0, 0], [0.5, 0.5, 0.5]])
+
+
+def test_evaluation_profiler(tmp_path: Path):
+    reference = ReferenceDataset.from_entries(
+        "reference",
+        [
+            ComputedStructureEntry(structure=s, energy=e, data={"material_id": f"ref-{i}"})
+            for i, (s, e) in enumerate(
+                [
+                    (Structure(Lattice.cubic(3.0), ["Mg"], [[0, 0, 0]]), -1.5),
+                    (Structure(Lattice.cubic(3.0), ["O"], [[0, 0, 0]]), -4.9),
+                    (_cscl(2.6, "Mg", "O"), -11.0),
+                ]
+            )
+        ],
+    )
+    fit, phase_diagram_init = StructureMatcher.fit, PhaseDiagram.__init__
+    is_unique_func = StructureMetricsCapability.is_unique.func
+    evaluator = MetricsEvaluator.from_structures_and_energies(
+        structures=[_cscl(2.6, "Mg", "O"), _cscl(2.7, "Mg", "O"), _cscl(2.8, "Mg", "O")],
+        energies=[-11.0, -10.0, -12.0],
+        reference=reference,
+        structure_matcher=DefaultOrderedStructureMatcher(),
+        energy_correction_scheme=IdentityCorrectionScheme(),
+    )
+    save_as = tmp_path / "metrics.json"
+    with EvaluationProfiler() as profiler:
+        metrics = evaluator.compute_metrics(metrics="all", save_as=save_as)
+    profiler.save(get_profile_path(save_as))
+
+    # instrumentation is removed again
+    assert StructureMatcher.fit is fit and PhaseDiagram.__init__ is phase_diagram_init
+    assert StructureMetricsCapability.is_unique.func is is_unique_func
+
+    report = json.loads((tmp_path / "metrics_profile.json").read_text())
+    assert set(report["metrics"]) == set(metrics)
+    assert report["timings"]["StructureMatcher.fit"]["calls"] > 0
+    assert report["timings"]["PhaseDiagram.__init__"]["calls"] > 0
+    assert report["timings"]["StructureMetricsCapability.is_unique"]["calls"] == 1
+    # each computation is attributed to the first metric that needs it
+    assert (
+        sum(
+            m["timings"].get("EnergyMetricsCapability.energy_above_hull", {}).get("calls", 0)
+            for m in report["metrics"].values()
+        )
+        == 1
+    )
+    cache = report["caches"]["EnergyMetricsCapability._get_energy_above_hull_per_atom_chemsys"]
+    assert cache["misses"] == 1
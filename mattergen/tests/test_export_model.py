@@ -0,0 +1,66 @@
+import os
+from pathlib import Path
+
+import torch
+from hydra import compose, initialize_config_dir
+from hydra.utils import instantiate
+from omegaconf import OmegaConf
+
+from mattergen.common.utils.data_classes import MatterGenCheckpointInfo
+from mattergen.common.utils.eval_utils import export_model_for_inference, load_model_diffusion
+from mattergen.common.utils.globals import MODELS_PROJECT_ROOT
+from mattergen.diffusion.lightning_module import DiffusionLightningModule
+
+
+def write_training_checkpoint(
+    model_path: Path, checkpoint_name: str = "epoch=3-loss_val=0.5.ckpt"
+) -> DiffusionLightningModule:
+    """Writes a small model with a checkpoint that includes optimizer state, like a Lightning
+    checkpoint, to `model_path`."""
+    with initialize_config_dir(os.path.join(MODELS_PROJECT_ROOT, "conf")):
+        config = compose(
+            config_name="default",
+            overrides=[
+                "lightning_module.diffusion_module.model.hidden_dim=16",
+                "lightning_module.diffusion_module.model.gemnet.num_blocks=1",
+            ],
+        )
+    config = OmegaConf.to_container(config, resolve=True)
+    torch.manual_seed(0)
+    pl_module = instantiate(config["lightning_module"])
+    optimizer = torch.optim.AdamW(pl_module.parameters())
+    (model_path / "checkpoints").mkdir(parents=True)
+    (model_path / "config.yaml").write_text(OmegaConf.to_yaml(config))
+    torch.save(
+        {
+            "state_dict": pl_module.state_dict(),
+            "optimizer_states": [optimizer.state_dict()],
+            "config": config,
+        },
+        model_path / "checkpoints" / checkpoint_name,
+    )
+    return pl_module
+
+
+def test_export_model_for_inference(tmp_path: Path):
+    pl_module = write_training_checkpoint(tmp_path / "model")
+
+    exported = export_model_for_inference(
+        MatterGenCheckpointInfo(
+            model_path=str(tmp_path / "model"),
+            load_epoch=3,
+            config_overrides=["lightning_module.diffusion_module.model.gemnet.max_neighbors=10"],
+        ),
+        tmp_path / "exported",
+    )
+
+    checkpoint = torch.load(exported.checkpoint_path)
+    assert checkpoint.keys() == {"state_dict", "config"}
+    assert exported.config.lightning_module.diffusion_module.model.gemnet.max_neighbors == 10
+    for loaded in [
+        load_model_diffusion(exported),
+        DiffusionLightningModule.load_from_checkpoint(exported.checkpoint_path, map_location="cpu"),
+    ]:
+        assert loaded.state_dict().keys() == pl_module.state_dict().keys()
+        for k, v in pl_module.state_dict().items():
+            torch.testing.assert_close(loaded.state_dict()[k], v)
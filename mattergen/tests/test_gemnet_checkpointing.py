@@ -0,0 +1,63 @@
+import pytest
+import torch
+
+from mattergen.common.gemnet.gemnet import GemNetT
+from mattergen.common.gemnet.layers.embedding_block import AtomEmbedding
+
+HIDDEN_DIM = 16
+
+
+def get_gradients(model: GemNetT, inputs: dict[str, torch.Tensor]) -> dict[str, torch.Tensor]:
+    model.zero_grad()
+    output = model(**inputs)
+    loss = output.forces.square().sum() + output.stress.square().sum()
+    loss.backward()
+    return {
+        "forces": output.forces.detach(),
+        "stress": output.stress.detach(),
+        **{
+            name: param.grad.clone()
+            for name, param in model.named_parameters()
+            if param.grad is not None
+        },
+    }
+
+
+@pytest.mark.parametrize(
+    "checkpoint_interaction_blocks, checkpoint_output_blocks",
+    [(True, False), (False, True), (True, True)],
+)
+def test_gradient_checkpointing_gives_same_gradients(
+    checkpoint_interaction_blocks: bool, checkpoint_output_blocks: bool
+):
+    torch.manual_seed(0)
+    model = GemNetT(
+        num_targets=1,
+        latent_dim=HIDDEN_DIM,
+        atom_embedding=AtomEmbedding(emb_size=HIDDEN_DIM, with_mask_type=True),
+        num_blocks=2,
+        emb_size_atom=HIDDEN_DIM,
+        emb_size_edge=HIDDEN_DIM,
+        regress_stress=True,
+        otf_graph=True,
+        max_neighbors=20,
+        cutoff=5.0,
+    )
+    num_atoms = torch.tensor([2, 4])
+    inputs = dict(
+        z=torch.randn(2, HIDDEN_DIM),
+        frac_coords=torch.rand(6, 3),
+        atom_types=torch.tensor([3, 8, 26, 26, 8, 8]),
+        num_atoms=num_atoms,
+        batch=torch.repeat_interleave(torch.arange(2), num_atoms),
+        lattice=4.0 * torch.eye(3).expand(2, 3, 3),
+    )
+    expected = get_gradients(model, inputs)
+
+    model.checkpoint_interaction_blocks = checkpoint_interaction_blocks
+    model.checkpoint_output_blocks = checkpoint_output_blocks
+    actual = get_gradients(model, inputs)
+
+    assert actual.keys() == expected.keys()
+    for name in expected:
+        torch.testing.assert_close(actual[name], expected[name], msg=name)
@@ -0,0 +1,53 @@
+import pytest
+import torch
+from torch_sparse import SparseTensor
+
+from mattergen.common.gemnet.gemnet import GemNetT
+from mattergen.common.gemnet.utils import ragged_range
+
+
+def get_triplets_sparse(edge_index: torch.Tensor, num_atoms: int):
+    """Triplet enumeration via a torch_sparse adjacency matrix, which GemNetT used before."""
+    idx_s, idx_t = edge_index
+    value = torch.arange(idx_s.size(0), dtype=idx_s.dtype)
+    adj = SparseTensor(row=idx_t, col=idx_s, value=value, sparse_sizes=(num_atoms, num_atoms))
+    adj_edges = adj[idx_t]
+    id3_ba = adj_edges.storage.value()
+    id3_ca = adj_edges.storage.row()
+    mask = id3_ba != id3_ca
+    id3_ba = id3_ba[mask]
+    id3_ca = id3_ca[mask]
+    id3_ragged_idx = ragged_range(torch.bincount(id3_ca, minlength=idx_s.size(0)))
+    return id3_ba, id3_ca, id3_ragged_idx
+
+
+@pytest.mark.parametrize("with_duplicates", [True, False])
+def test_get_triplets_matches_sparse_adjacency(with_duplicates: bool):
+    torch.manual_seed(0)
+    num_atoms = 7
+    keys = torch.randint(num_atoms**2, (60,))
+    if not with_duplicates:
+        keys = torch.unique(keys)
+        keys = keys[torch.randperm(len(keys))]
+    # edges c->a in random order, possibly several between the same atoms as for periodic
+    # interactions
+    edge_index = torch.stack([keys % num_atoms, keys // num_atoms])
+    num_edges = edge_index.shape[1]
+
+    # get_triplets does not depend on the state of the model
+    id3_ba, id3_ca, id3_ragged_idx = GemNetT.get_triplets(
+        None, edge_index, num_atoms=torch.tensor(num_atoms)
+    )
+    expected_id3_ba, expected_id3_ca, expected_id3_ragged_idx = get_triplets_sparse(
+        edge_index, num_atoms
+    )
+    assert torch.equal(id3_ca, expected_id3_ca)
+    assert torch.equal(id3_ragged_idx, expected_id3_ragged_idx)
+    if with_duplicates:
+        # the sparse adjacency does not define the order of duplicate edges b->a
+        assert torch.equal(
+            torch.sort(id3_ca * num_edges + id3_ba).values,
+            torch.sort(expected_id3_ca * num_edges + expected_id3_ba).values,
+        )
+    else:
+        assert torch.equal(id3_ba, expected_id3_ba)
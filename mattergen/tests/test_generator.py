@@ -1,12 +1,31 @@
 # Copyright (c) Microsoft Corporation.
 # Licensed under the MIT License.
 
+from pathlib import Path
 from typing import List
 
+import numpy as np
 import pytest
+import torch
+from pymatgen.core.structure import Structure
 
+from mattergen.common.data.chemgraph import ChemGraph
+from mattergen.common.data.collate import collate
+from mattergen.common.globals import (
+    GENERATED_CRYSTALS_NPZ_FILE_NAME,
+    GENERATED_TRAJECTORIES_NPZ_FILE_NAME,
+)
+from mattergen.common.utils.columnar_structures import ColumnarStructures
+from mattergen.common.utils.data_classes import MatterGenCheckpointInfo
 from mattergen.common.utils.globals import MAX_ATOMIC_NUM
+from mattergen.diffusion.sampling.trajectory_recorder import TrajectoryRecorder
+from mattergen.generator import (
+    CrystalGenerator,
+    draw_samples_from_sampler,
+    structures_from_recorded_trajectories,
+)
 from mattergen.property_embeddings import ChemicalSystemMultiHotEmbedding
+from mattergen.tests.test_export_model import write_training_checkpoint
 
 
 @pytest.mark.parametrize("chemical_system", [["Li", "O"], ["Li", "O", "F"], ["C", "O", "H"]])
@@ -22,3 +41,112 @@ def test_chemical_system_to_multi_hot(chemical_system: List[str]) -> None:
         MAX_ATOMIC_NUM + 1,
     )
     assert multi_hot_encoding.sum() == len(chemical_system)
+
+
+def test_structures_from_recorded_trajectories() -> None:
+    batch = collate(
+        [
+            ChemGraph(
+                pos=torch.rand(n, 3),
+                cell=(3.0 + n) * torch.eye(3)[None],
+                atomic_numbers=torch.full((n,), z),
+                num_atoms=torch.tensor([n]),
+            )
+            for n, z in [(2, 8), (3, 14)]
+        ]
+    )
+    recorder = TrajectoryRecorder(fields=["pos", "cell", "atomic_numbers"])
+    recorder.start(batch, fields=[], num_frames=4)
+    for t in [1.0, 0.75, 0.5, 0.25]:
+        recorder.record(batch, t=torch.full((2,), t), sample_ids=torch.arange(2))
+
+    trajectories = structures_from_recorded_trajectories(recorder.finish(torch.arange(2)))
+
+    assert [len(traj) for traj in trajectories] == [4, 4]
+    assert [len(traj[0]) for traj in trajectories] == [2, 3]
+    assert trajectories[1][-1].composition.reduced_formula == "Si"
+    assert trajectories[0][-1].lattice.abc == pytest.approx((5.0, 5.0, 5.0))
+
+
+class RejectEverySecondCondition:
+    """Stands in for a continuous batching sampler whose health monitor rejects every second
+    condition."""
+
+    def sample_continuously(self, conditioning_data, batch_operations, max_batch_size, **kwargs):
+        for batch in conditioning_data:
+            kept = batch_operations.select(batch, torch.arange(0, batch.get_batch_size(), 2))
+            yield kept, kept
+
+
+def test_continuous_batching_reports_rejected_samples(capsys: pytest.CaptureFixture) -> None:
+    condition_loader = [
+        (
+            collate(
+                [
+                    ChemGraph(
+                        pos=torch.rand(2, 3),
+                        cell=4.0 * torch.eye(3)[None],
+                        atomic_numbers=torch.full((2,), 14),
+                        num_atoms=torch.tensor([2]),
+                    )
+                    for _ in range(batch_size)
+                ]
+            ),
+            None,
+        )
+        for batch_size in [3, 2]
+    ]
+
+    structures = draw_samples_from_sampler(
+        sampler=RejectEverySecondCondition(),  # type: ignore
+        condition_loader=condition_loader,  # type: ignore
+        record_trajectories=False,
+        max_num_atoms_per_batch=4,
+    )
+
+    assert len(structures) == 3
+    assert "Rejected 2 degenerate samples" in capsys.readouterr().out
+
+
+def test_generate_data_parallel(tmp_path: Path) -> None:
+    write_training_checkpoint(tmp_path / "model", checkpoint_name="last.ckpt")
+
+    def generate(num_processes: int) -> list[Structure]:
+        output_path = tmp_path / f"outputs_{num_processes}"
+        output_path.mkdir()
+        structures = CrystalGenerator(
+            checkpoint_info=MatterGenCheckpointInfo(
+                model_path=str(tmp_path / "model"),
+                config_overrides=[
+                    "lightning_module.diffusion_module.corruption.discrete_corruptions"
+                    ".atomic_numbers.d3pm.schedule.num_steps=3",
+                    # the few noisy atoms of each crystal are far apart
+                    "lightning_module.diffusion_module.model.gemnet.cutoff=300",
+                    "lightning_module.diffusion_module.model.gemnet.max_neighbors=20",
+                ],
+            ),
+            batch_size=2,
+            num_batches=3,
+            sampling_config_overrides=[
+                "sampler_partial.N=3",
+                "~sampler_partial.corrector_partials",
+            ],
+            trajectory_stride=2,
+            num_processes=num_processes,
+            seed=0,
+        ).generate(output_dir=str(output_path))
+        saved = ColumnarStructures(output_path / GENERATED_CRYSTALS_NPZ_FILE_NAME)
+        assert [len(s) for s in saved] == [len(s) for s in structures]
+        trajectories = ColumnarStructures(output_path / GENERATED_TRAJECTORIES_NPZ_FILE_NAME)
+        assert [
+            len(trajectories.get_trajectory(i)[-1]) for i in range(trajectories.num_trajectories)
+        ] == [len(s) for s in structures]
+        return structures
+
+    structures = generate(num_processes=2)
+    # the conditions are drawn before sharding, and each sample has its own random stream, so the
+    # structures do not depend on num_processes
+    for s, expected in zip(structures, generate(num_processes=1), strict=True):
+        assert s.atomic_numbers == expected.atomic_numbers
+        np.testing.assert_allclose(s.frac_coords, expected.frac_coords, atol=1e-4)
+        np.testing.assert_allclose(s.lattice.matrix, expected.lattice.matrix, atol=1e-4)
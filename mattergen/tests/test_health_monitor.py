@@ -0,0 +1,61 @@
+import torch
+
+from mattergen.common.data.chemgraph import ChemGraph
+from mattergen.common.data.collate import collate
+from mattergen.common.diffusion.health_monitor import CrystalHealthMonitor
+
+
+def get_crystal(pos: list[list[float]], cell_length: float = 4.0) -> ChemGraph:
+    return ChemGraph(
+        pos=torch.tensor(pos),
+        cell=cell_length * torch.eye(3)[None],
+        atomic_numbers=torch.full((len(pos),), 8),
+        num_atoms=torch.tensor([len(pos)]),
+    )
+
+
+def get_batch() -> ChemGraph:
+    batch = collate(
+        [
+            get_crystal([[0.0, 0.0, 0.0], [0.5, 0.5, 0.5]]),
+            # two atoms 0.04 Å apart
+            get_crystal([[0.0, 0.0, 0.0], [0.01, 0.0, 0.0]]),
+            get_crystal([[float("nan"), 0.0, 0.0], [0.5, 0.5, 0.5]]),
+            # volume per atom of 0.0005 Å^3
+            get_crystal([[0.0, 0.0, 0.0], [0.5, 0.5, 0.5]], cell_length=0.1),
+        ]
+    )
+    # conditioning values are set on the collated batch, see set_conditional_property_values
+    return batch.replace(
+        chemical_system=[["O"], ["O", "Li"], ["O"], ["O", "F"]],
+        dft_band_gap=torch.arange(4.0)[:, None],
+    )
+
+
+def test_crystal_health_monitor():
+    x = get_batch()
+    score = x.replace(pos=torch.zeros_like(x.pos), cell=torch.zeros_like(x.cell))
+    health_monitor = CrystalHealthMonitor(min_distance=0.5, geometry_check_max_t=0.1)
+
+    # early in denoising, only non-finite values are rejected
+    healthy = health_monitor.is_healthy(x=x, score=score, t=torch.full((4,), 0.5))
+    assert healthy.tolist() == [True, True, False, True]
+
+    healthy = health_monitor.is_healthy(x=x, score=score, t=torch.full((4,), 0.05))
+    assert healthy.tolist() == [True, False, False, False]
+
+    score = score.replace(cell=score.cell.index_fill(0, torch.tensor([1]), float("inf")))
+    healthy = health_monitor.is_healthy(x=x, score=score, t=torch.full((4,), 0.5))
+    assert healthy.tolist() == [True, False, False, True]
+
+
+def test_crystal_health_monitor_select():
+    x = get_batch()
+    selected = CrystalHealthMonitor().select(x, torch.tensor([1, 3]))
+
+    assert selected.get_batch_size() == 2
+    assert selected.num_atoms.tolist() == [2, 2]
+    torch.testing.assert_close(selected.cell, x.cell[[1, 3]])
+    torch.testing.assert_close(selected.pos, x.pos[[2, 3, 6, 7]])
+    assert selected.chemical_system == [["O", "Li"], ["O", "F"]]
+    torch.testing.assert_close(selected.dft_band_gap, torch.tensor([[1.0], [3.0]]))
@@ -0,0 +1,11 @@
+import pytest
+
+from mattergen.scripts.import_time import CLI_MODULES, get_import_time_report
+
+
+@pytest.mark.parametrize("module", CLI_MODULES)
+def test_cli_does_not_import_heavy_modules(module: str):
+    report = get_import_time_report(module)
+
+    assert report.heavy_modules == []
+    assert report.slowest[0][0] == module
@@ -0,0 +1,132 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from pymatgen.core import Lattice, Structure
+from pymatgen.entries.computed_entries import ComputedStructureEntry
+
+from mattergen.evaluation.metrics.evaluator import MetricsEvaluator
+from mattergen.evaluation.reference.reference_dataset import ReferenceDataset
+from mattergen.evaluation.utils.evaluation_cache import EvaluationCache
+from mattergen.evaluation.utils.structure_matcher import DefaultOrderedStructureMatcher
+from mattergen.evaluation.utils.vasprunlike import IdentityCorrectionScheme
+
+
+def _rocksalt(a: float, cation: str, anion: str) -> Structure:
+    return Structure.from_spacegroup(
+        "Fm-3m", Lattice.cubic(a), [cation, anion], [[0, 0, 0], [0.5, 0.5, 0.5]]
+    )
+
+
+def _cscl(a: float, cation: str, anion: str) -> Structure:
+    return Structure(Lattice.cubic(a), [cation, anion], [[0, 0, 0], [0.5, 0.5, 0.5]])
+
+
+@pytest.fixture
+def reference() -> ReferenceDataset:
+    structures_and_energies = [
+        (Structure(Lattice.cubic(3.0), ["Li"], [[0, 0, 0]]), -1.9),
+        (Structure(Lattice.cubic(3.5), ["Na"], [[0, 0, 0]]), -1.3),
+        (Structure(Lattice.cubic(3.0), ["Mg"], [[0, 0, 0]]), -1.5),
+        (Structure(Lattice.cubic(3.0), ["O"], [[0, 0, 0]]), -4.9),
+        (_rocksalt(4.2, "Mg", "O"), -47.0),
+    ]
+    entries = [
+        ComputedStructureEntry(structure=s, energy=e, data={"material_id": f"ref-{i}"})
+        for i, (s, e) in enumerate(structures_and_energies)
+    ]
+    return ReferenceDataset.from_entries("reference", entries)
+
+
+@pytest.fixture
+def structures_and_energies() -> tuple[list[Structure], list[float]]:
+    structures = [
+        _rocksalt(4.2, "Mg", "O"),  # in reference
+        _cscl(2.6, "Mg", "O"),
+        _rocksalt(4.6, "Li", "O"),
+        _cscl(2.6, "Mg", "O"),  # duplicate
+        _rocksalt(4.8, "Na", "O"),
+        _cscl(2.8, "Li", "O"),
+        # structures appended in the second evaluation
+        _cscl(2.6, "Mg", "O"),  # duplicate of an earlier structure
+        _cscl(2.9, "Na", "O"),
+        _rocksalt(5.0, "Na", "O"),  # duplicate up to scaling of an earlier structure
+        _cscl(3.0, "Li", "Mg"),  # new chemical system
+    ]
+    energies = [-47.0, -11.0, -24.0, -11.0, -20.0, -7.0, -11.0, -6.0, -21.0, -4.0]
+    return structures, energies
+
+
+def _evaluate(structures, energies, reference, cache=None) -> MetricsEvaluator:
+    evaluator = MetricsEvaluator.from_structures_and_energies(
+        structures=structures,
+        energies=energies,
+        reference=reference,
+        structure_matcher=DefaultOrderedStructureMatcher(),
+        energy_correction_scheme=IdentityCorrectionScheme(),
+        cache=cache,
+    )
+    evaluator.compute_metrics(metrics="all")
+    return evaluator
+
+
+def test_incremental_evaluation_matches_full_evaluation(
+    tmp_path: Path, reference: ReferenceDataset, structures_and_energies
+):
+    structures, energies = structures_and_energies
+    expected = _evaluate(structures, energies, reference)
+
+    cache_path = tmp_path / "cache.lmdb"
+    first = _evaluate(structures[:6], energies[:6], reference, EvaluationCache(cache_path))
+    first.update_cache()
+    incremental = _evaluate(structures, energies, reference, EvaluationCache(cache_path))
+
+    cached_results = incremental.structure_capability.cached_results
+    assert cached_results.num_cached == 7  # includes the duplicate appended structure
+    assert cached_results.is_unique_prefix is not None
+
+    np.testing.assert_array_equal(incremental.is_unique, expected.is_unique)
+    np.testing.assert_array_equal(incremental.is_novel, expected.is_novel)
+    assert incremental.matches_in_reference == expected.matches_in_reference
+    np.testing.assert_allclose(
+        incremental.energy_capability.energy_above_hull,
+        expected.energy_capability.energy_above_hull,
+    )
+    np.testing.assert_allclose(
+        incremental.energy_capability.self_consistent_energy_above_hull,
+        expected.energy_capability.self_consistent_energy_above_hull,
+    )
+    assert incremental.compute_metrics(metrics="all") == pytest.approx(
+        expected.compute_metrics(metrics="all"), nan_ok=True
+    )
+
+
+def test_incremental_evaluation_with_reordered_structures(
+    tmp_path: Path, reference: ReferenceDataset, structures_and_energies
+):
+    structures, energies = structures_and_energies
+    cache_path = tmp_path / "cache.lmdb"
+    _evaluate(structures, energies, reference, EvaluationCache(cache_path)).update_cache()
+
+    # the previous structures are not a prefix anymore, so uniqueness is recomputed
+    reversed_evaluator = _evaluate(
+        structures[::-1], energies[::-1], reference, EvaluationCache(cache_path)
+    )
+    assert reversed_evaluator.structure_capability.cached_results.is_unique_prefix is None
+    expected = _evaluate(structures[::-1], energies[::-1], reference)
+    np.testing.assert_array_equal(reversed_evaluator.is_unique, expected.is_unique)
+    np.testing.assert_allclose(
+        reversed_evaluator.energy_capability.self_consistent_energy_above_hull,
+        expected.energy_capability.self_consistent_energy_above_hull,
+    )
+
+
+def test_evaluation_cache_rejects_different_config(
+    tmp_path: Path, reference, structures_and_energies
+):
+    structures, energies = structures_and_energies
+    cache_path = tmp_path / "cache.lmdb"
+    cache = EvaluationCache(cache_path, config={"reference": "reference"})
+    _evaluate(structures[:2], energies[:2], reference, cache).update_cache()
+    with pytest.raises(ValueError):
+        EvaluationCache(cache_path, config={"reference": "other_reference"})
@@ -0,0 +1,110 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from pymatgen.core import Lattice, Structure
+
+from mattergen.common.utils.columnar_structures import ColumnarStructures
+from mattergen.common.utils.eval_utils import (
+    get_structures_cache_path,
+    load_structures,
+    save_structures_as_extxyz_and_cif,
+)
+
+
+def get_structures(num_structures: int = 6) -> list[Structure]:
+    rng = np.random.default_rng(0)
+    return [
+        Structure(
+            Lattice.from_parameters(*(3.0 + rng.random(3)), 90.0, 90.0, 90.0),
+            ["Na", "Cl"] * (i + 1),
+            rng.random((2 * (i + 1), 3)),
+        )
+        for i in range(num_structures)
+    ]
+
+
+def assert_same_structures(loaded: list[Structure], structures: list[Structure]):
+    assert len(loaded) == len(structures)
+    for read, original in zip(loaded, structures):
+        assert read.composition == original.composition
+        assert np.allclose(read.lattice.abc, original.lattice.abc, atol=1e-5)
+
+
+@pytest.mark.parametrize("file_name", ["generated_crystals.extxyz", "generated_crystals_cif.zip"])
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_load_structures_in_order(tmp_path: Path, file_name: str, num_workers: int):
+    structures = get_structures()
+    save_structures_as_extxyz_and_cif(tmp_path, structures)
+
+    loaded = load_structures(tmp_path / file_name, num_workers=num_workers)
+
+    assert_same_structures(list(loaded), structures)
+
+
+def test_load_structures_from_folder(tmp_path: Path):
+    structures = get_structures(2)
+    for i, structure in enumerate(structures):
+        (tmp_path / f"gen_{i}.cif").write_text(structure.to(fmt="cif"))
+    (tmp_path / "notes.txt").write_text("not a structure")
+
+    loaded = sorted(load_structures(tmp_path), key=len)
+
+    assert_same_structures(loaded, structures)
+
+
+def test_load_structures_cache(tmp_path: Path):
+    structures = get_structures()
+    save_structures_as_extxyz_and_cif(tmp_path, structures)
+    input_path = tmp_path / "generated_crystals.extxyz"
+    cache_path = get_structures_cache_path(input_path)
+
+    loaded = load_structures(input_path, cache=True)
+    assert not isinstance(loaded, ColumnarStructures)
+    assert cache_path.exists()
+
+    cached = load_structures(input_path, cache=True)
+    assert isinstance(cached, ColumnarStructures)
+    # the cached structures are the same as the ones parsed again
+    parsed = load_structures(input_path)
+    assert list(cached) == list(parsed)
+    for read, original in zip(cached, parsed):
+        assert np.array_equal(read.frac_coords, original.frac_coords)
+        assert np.array_equal(read.lattice.matrix, original.lattice.matrix)
+
+    # changing the input invalidates the cache and removes the outdated one
+    save_structures_as_extxyz_and_cif(tmp_path, structures[:3])
+    assert len(load_structures(input_path, cache=True)) == 3
+    assert not cache_path.exists()
+    assert get_structures_cache_path(input_path).exists()
+
+
+def test_load_structures_does_not_cache_decorated_structures(tmp_path: Path):
+    structures = get_structures(3)
+    structures[0].add_oxidation_state_by_element({"Na": 1, "Cl": -1})
+    structures[1].add_site_property("magmom", [0.5, 0.0] * 2)
+    save_structures_as_extxyz_and_cif(tmp_path, structures)
+    input_path = tmp_path / "generated_crystals.extxyz"
+
+    loaded = load_structures(input_path, cache=True)
+    assert not get_structures_cache_path(input_path).exists()
+
+    # loading again parses the file again, with the same decorations
+    loaded_again = load_structures(input_path, cache=True)
+    assert not isinstance(loaded_again, ColumnarStructures)
+    assert list(loaded_again) == list(loaded)
+    assert loaded_again[0].species[0].oxi_state == 1
+    assert loaded_again[1].site_properties["magmom"] == [0.5, 0.0] * 2
+
+
+def test_load_structures_cache_only_removes_outdated_caches(tmp_path: Path):
+    structures = get_structures(2)
+    save_structures_as_extxyz_and_cif(tmp_path, structures)
+    input_path = tmp_path / "generated_crystals.extxyz"
+    user_file = tmp_path / ".generated_crystals.extxyz.backup.npz"
+    user_file.write_bytes(b"")
+
+    load_structures(input_path, cache=True)
+
+    assert get_structures_cache_path(input_path).exists()
+    assert user_file.exists()
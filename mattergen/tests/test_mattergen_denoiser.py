@@ -10,6 +10,10 @@ from mattergen.common.data.collate import collate
 from mattergen.common.data.transform import set_chemical_system_string
 from mattergen.common.utils.globals import MAX_ATOMIC_NUM
 from mattergen.denoiser import mask_disallowed_elements
+from mattergen.diffusion.sampling.conditioning_cache import (
+    cached_conditioning,
+    conditioning_cache,
+)
 from mattergen.property_embeddings import (
     ChemicalSystemMultiHotEmbedding,
     SetConditionalEmbeddingType,
@@ -251,3 +255,60 @@ def test_mask_disallowed_elements(zero_based_predictions: bool):
             assert set(sampled_types).difference(set(chemsys)) == set()
         else:
             assert set(sampled_types).difference(set(chemsys)) != set()
+
+
+def test_conditioning_cache_reuses_element_masks():
+    samples = [
+        ChemGraph(
+            pos=torch.rand(3, 3),
+            num_atoms=torch.tensor([3]),
+            atomic_numbers=torch.tensor([57, 11, 8]),
+            cell=torch.eye(3),
+        ),
+        ChemGraph(
+            pos=torch.rand(2, 3),
+            num_atoms=torch.tensor([2]),
+            atomic_numbers=torch.tensor([26, 8]),
+            cell=torch.eye(3),
+        ),
+    ]
+    batch = collate([set_chemical_system_string(sample) for sample in samples])
+    x = ChemGraph(
+        pos=batch.pos,
+        cell=batch.cell,
+        atomic_numbers=batch.atomic_numbers,
+        num_atoms=batch.num_atoms,
+        chemical_system=batch.chemical_system,
+    )
+    x = replace_use_unconditional_embedding(batch=x, use_unconditional_embedding={"chemical_system": torch.zeros(2, 1, dtype=torch.bool)})  # type: ignore
+    logits = torch.randn(batch.pos.shape[0], MAX_ATOMIC_NUM + 1)
+
+    expected = mask_disallowed_elements(logits=logits, x=x, batch_idx=batch.batch)
+    with conditioning_cache() as cache:
+        for _ in range(3):
+            masked_logits = mask_disallowed_elements(logits=logits, x=x, batch_idx=batch.batch)
+            torch.testing.assert_close(masked_logits, expected)
+    # selected elements mask and chemical system mask are computed in the first step only
+    assert cache.misses == 2
+    assert cache.hits == 4
+
+
+def test_conditioning_cache_is_keyed_by_conditioning_identity():
+    values = torch.tensor([1.0, 2.0])
+    calls = []
+
+    def compute():
+        calls.append(None)
+        return values * 2
+
+    # without an active cache, the value is computed every time
+    cached_conditioning(key="double", compute=compute, conditioning=[values])
+    with conditioning_cache() as cache:
+        for _ in range(3):
+            doubled = cached_conditioning(key="double", compute=compute, conditioning=[values])
+            torch.testing.assert_close(doubled, values * 2)
+        # equal values in a different tensor are a different conditioning
+        cached_conditioning(key="double", compute=compute, conditioning=[values.clone()])
+    assert len(calls) == 3
+    assert cache.misses == 2
+    assert cache.hits == 2
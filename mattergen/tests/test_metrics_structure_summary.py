@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from pymatgen.core import Lattice, Structure
+from pymatgen.entries.compatibility import MaterialsProject2020Compatibility
+
+from mattergen.evaluation.utils.metrics_structure_summary import (
+    MetricsStructureSummary,
+    get_energy_correction_key,
+    get_metrics_structure_summaries,
+)
+
+
+@pytest.fixture
+def structures_and_energies() -> tuple[list[Structure], list[float]]:
+    rng = np.random.default_rng(0)
+    prototypes = [
+        Structure.from_spacegroup(
+            "Fm-3m", Lattice.cubic(4.2), ["Mg", "O"], [[0, 0, 0], [0.5, 0.5, 0.5]]
+        ),
+        Structure(Lattice.cubic(2.6), ["Fe", "O"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+        # peroxide
+        Structure(
+            Lattice.cubic(4.0),
+            ["Li", "Li", "O", "O"],
+            [[0, 0, 0], [0.5, 0.5, 0.5], [0.2, 0.2, 0.2], [0.2, 0.2, 0.5]],
+        ),
+        Structure(Lattice.cubic(3.0), ["Zn", "S"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+        Structure(Lattice.cubic(3.0), ["Li", "F"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+    ]
+    structures = []
+    for i in rng.integers(len(prototypes), size=20):
+        structure = prototypes[i].copy()
+        structure.perturb(0.05)
+        structures.append(structure)
+    energies = list(rng.uniform(-20.0, -5.0, size=len(structures)))
+    return structures, energies
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_metrics_structure_summaries_match_per_structure_summaries(
+    structures_and_energies, num_workers: int
+):
+    structures, energies = structures_and_energies
+    scheme = MaterialsProject2020Compatibility()
+    expected = [
+        MetricsStructureSummary.from_structure_and_energy(s, e, energy_correction_scheme=scheme)
+        for s, e in zip(structures, energies)
+    ]
+    summaries = get_metrics_structure_summaries(
+        structures, energies, energy_correction_scheme=scheme, num_workers=num_workers
+    )
+    assert len({get_energy_correction_key(s) for s in structures}) < len(structures)
+    assert [s.entry.as_dict() for s in summaries] == [s.entry.as_dict() for s in expected]
@@ -9,11 +9,14 @@ import pytest
 import torch
 
 from mattergen.common.data.chemgraph import ChemGraph
+from mattergen.common.diffusion import predictors_correctors
 from mattergen.common.diffusion.corruption import (
     LatticeVPSDE,
     expand,
     make_noise_symmetric_preserve_variance,
 )
+from mattergen.common.diffusion.predictors_correctors import LatticeLangevinDiffCorrector
+from mattergen.common.utils.data_utils import compute_lattice_polar_decomposition
 from mattergen.diffusion.corruption.sde_lib import VPSDE
 
 
@@ -198,3 +201,55 @@ def test_expand(output_shape: Tuple):
 
     # we only match the len, not number of elements
     assert expanded_data.shape != output_shape
+
+
+def test_LatticeLangevinDiffCorrector_returns_symmetric_lattices():
+    corrector = LatticeLangevinDiffCorrector(
+        corruption=LatticeVPSDE(limit_density=0.05), score_fn=None, n_steps=1
+    )
+    x = torch.randn(4, 3, 3) + 3 * torch.eye(3)
+    torch.manual_seed(0)
+    sample, mean = corrector.step_given_score(
+        x=x,
+        batch_idx=None,
+        score=torch.randn(4, 3, 3),
+        t=torch.full((4,), 0.5),
+        dt=torch.tensor(-0.001),
+    )
+    assert sample.shape == mean.shape == (4, 3, 3)
+    torch.testing.assert_close(sample, sample.transpose(1, 2))
+    torch.testing.assert_close(mean, mean.transpose(1, 2))
+    # both are already in the symmetric polar decomposition form
+    torch.testing.assert_close(sample, compute_lattice_polar_decomposition(sample))
+    torch.testing.assert_close(mean, compute_lattice_polar_decomposition(mean))
+
+
+def test_LatticeLangevinDiffCorrector_matches_per_tensor_polar_decomposition(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    corrector = LatticeLangevinDiffCorrector(
+        corruption=LatticeVPSDE(limit_density=0.05), score_fn=None, n_steps=1
+    )
+    x = torch.randn(16, 3, 3) + 3 * torch.eye(3)
+    score = torch.randn(16, 3, 3)
+
+    def step():
+        torch.manual_seed(0)
+        return corrector.step_given_score(
+            x=x, batch_idx=None, score=score, t=torch.full((16,), 0.5), dt=torch.tensor(-0.001)
+        )
+
+    sample, mean = step()
+    # the sample and mean before the decomposition, with the same noise
+    monkeypatch.setattr(predictors_correctors, "compute_lattice_polar_decomposition", lambda x: x)
+    raw_sample, raw_mean = step()
+
+    # the batched decomposition gives the same lattices as decomposing the sample and the mean
+    # separately, and as decomposing each lattice on its own
+    torch.testing.assert_close(sample, compute_lattice_polar_decomposition(raw_sample))
+    torch.testing.assert_close(mean, compute_lattice_polar_decomposition(raw_mean))
+    for batched, raw in [(sample, raw_sample), (mean, raw_mean)]:
+        for i in range(len(raw)):
+            torch.testing.assert_close(
+                batched[i : i + 1], compute_lattice_polar_decomposition(raw[i : i + 1])
+            )
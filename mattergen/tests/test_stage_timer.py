@@ -0,0 +1,63 @@
+import sys
+import time
+
+from mattergen.common.utils.profiling import OTHER_STAGE, StageTimer
+
+
+class Model:
+    def forward(self) -> None:
+        time.sleep(0.02)
+        build_graph()
+
+    def step(self) -> None:
+        self.forward()
+        time.sleep(0.01)
+
+
+class GuidedModel(Model):
+    pass
+
+
+def build_graph() -> None:
+    time.sleep(0.03)
+
+
+def test_stage_timer():
+    timer = StageTimer()
+    timer.instrument(Model, "forward", stage="forward")
+    timer.instrument(GuidedModel, "step", stage="step")
+    timer.instrument(sys.modules[__name__], "build_graph", stage="graph")
+    with timer:
+        for _ in range(2):
+            GuidedModel().step()
+        with timer.stage("postprocessing"):
+            time.sleep(0.01)
+
+    # the instrumented functions are restored, including the inherited method
+    assert "step" not in vars(GuidedModel)
+    assert not hasattr(Model.forward, "__wrapped__")
+    assert not hasattr(build_graph, "__wrapped__")
+
+    timings = timer.as_dict()
+    stages = timings["stages"]
+    # exclusive times, which do not include the nested stages
+    assert 0.06 <= stages["graph"]["seconds"]
+    assert 0.04 <= stages["forward"]["seconds"] < 0.09
+    assert 0.02 <= stages["step"]["seconds"] < 0.1
+    assert stages["graph"]["calls"] == stages["forward"]["calls"] == stages["step"]["calls"] == 2
+    assert stages["postprocessing"]["calls"] == 1
+    assert abs(sum(s["seconds"] for s in stages.values()) - timings["seconds"]) < 1e-9
+    assert 0 <= stages[OTHER_STAGE]["seconds"] < 0.05
+
+
+def test_timed_function_only_while_active():
+    timer = StageTimer()
+    transform = timer.timed(build_graph, stage="transform")
+    transform()
+    with timer:
+        transform()
+    transform()
+
+    stages = timer.as_dict()["stages"]
+    assert stages["transform"]["calls"] == 1
+    assert 0.03 <= stages["transform"]["seconds"] < 0.06